@@ -0,0 +1,13 @@
+"""
+Admin view for the outgoing mail queue.
+"""
+
+from django.contrib import admin
+from contact.models import OutboundMessage
+
+class OutboundMessageAdmin(admin.ModelAdmin):
+    """Display queued and sent messages in a table."""
+    list_display = ('created', 'from_email', 'subject', 'status', 'attempts', 'next_attempt')
+    list_filter = ('status',)
+
+admin.site.register(OutboundMessage, OutboundMessageAdmin)
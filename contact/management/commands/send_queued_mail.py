@@ -0,0 +1,30 @@
+"""
+Deliver contact form messages from the outgoing mail queue.
+"""
+
+from time import sleep
+from django.core.management.base import BaseCommand
+from contact.models import send_batch
+
+class Command(BaseCommand):
+    """Send queued mail in batches, once or as a long-running worker."""
+    help = 'Send messages waiting in the outgoing mail queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, checking the queue every few seconds.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when the queue is empty (with --loop).')
+        parser.add_argument('--batch-size', type=int,
+                            help='Messages to send per connection. Defaults to '
+                                 'MAIL_QUEUE_BATCH_SIZE.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_batch(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent} messages, {failed} failed.')
+            if not options['loop']:
+                break
+            if not sent and not failed:
+                sleep(options['interval'])
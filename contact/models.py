@@ -0,0 +1,112 @@
+"""
+Queue of outgoing emails from the contact form.
+
+Talking to the mail server can be slow, so the contact form only stores its
+message here. A background worker (manage.py send_queued_mail) delivers the
+queue in batches over a single connection, backing off and retrying when the
+server can't be reached and giving up after a few attempts.
+"""
+
+from datetime import timedelta
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPSenderRefused
+from django.conf import settings
+from django.core.mail import BadHeaderError, EmailMessage, get_connection
+from django.db import models, transaction
+from django.utils import timezone
+
+# How long a worker has to deliver a batch before another worker may try it
+CLAIM_SECONDS = 300
+
+class OutboundMessage(models.Model):
+    """An email waiting to be sent, or the record of one which has been."""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    subject = models.CharField(max_length=256)
+    body = models.TextField()
+    from_email = models.CharField('from', max_length=512)
+    to_email = models.CharField('to', max_length=254)
+    created = models.DateTimeField(default=timezone.now)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt'])]
+
+    def __str__(self):
+        return self.subject + ' from ' + self.from_email
+
+    def record_failure(self, error, permanent=False):
+        """Note a failed attempt, and either schedule a retry or give up."""
+        self.attempts += 1
+        self.last_error = str(error)
+        if permanent or self.attempts >= settings.MAIL_QUEUE_MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            delay = settings.MAIL_QUEUE_RETRY_SECONDS * 2 ** (self.attempts - 1)
+            self.next_attempt = timezone.now() + timedelta(seconds=delay)
+        self.save()
+
+def queue_mail(subject, body, from_email, to_email):
+    """Add an email to the queue, to be sent by the worker."""
+    return OutboundMessage.objects.create(subject=subject, body=body,
+                                          from_email=from_email, to_email=to_email)
+
+def claim_batch(batch_size):
+    """Take the next batch of messages which are due, so no other worker sends them too."""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(OutboundMessage.objects.select_for_update(skip_locked=True)
+                     .filter(status=OutboundMessage.PENDING, next_attempt__lte=now)
+                     .order_by('next_attempt')[:batch_size])
+        OutboundMessage.objects.filter(id__in=[message.id for message in batch]) \
+                               .update(next_attempt=now + timedelta(seconds=CLAIM_SECONDS))
+    return batch
+
+def send_batch(batch_size=None):
+    """Deliver one batch of queued messages over a single connection.
+
+    Returns the number sent and the number that failed.
+    """
+    batch = claim_batch(batch_size or settings.MAIL_QUEUE_BATCH_SIZE)
+    if not batch:
+        return 0, 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except (OSError, SMTPException) as error:
+        for message in batch:
+            message.record_failure(error)
+        return 0, len(batch)
+
+    sent = failed = 0
+    try:
+        for message in batch:
+            email = EmailMessage(message.subject, message.body, message.from_email,
+                                 [message.to_email], connection=connection)
+            try:
+                email.send()
+            except (BadHeaderError, ValueError) as error:
+                # Headers which can't be written out won't improve with another try
+                message.record_failure(error, permanent=True)
+                failed += 1
+            except (SMTPRecipientsRefused, SMTPSenderRefused) as error:
+                # The server won't take this one however many times we ask
+                message.record_failure(error, permanent=True)
+                failed += 1
+            except (OSError, SMTPException) as error:
+                message.record_failure(error)
+                failed += 1
+            else:
+                message.status = OutboundMessage.SENT
+                message.attempts += 1
+                message.save()
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
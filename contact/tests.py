@@ -2,12 +2,20 @@
 Unit tests for the contact form.
 
 Uses the django test mailbox to make sure emails are getting sent as expected.
+Messages are only queued by the form, so tests run the queue worker to send them.
 """
 
 import os
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from django.test import TestCase, override_settings
 from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
+from contact.models import OutboundMessage, queue_mail, send_batch
 
 CONTACT_ADDRESS = os.environ.get('CONTACT_ADDRESS')
 
@@ -26,6 +34,7 @@ class ContactTests(TestCase):
                                     {'name': 'Bill',
                                      'email': 'bill@example.com',
                                      'message': 'Hi there'})
+        send_batch()
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'Web Feedback')
         self.assertEqual(mail.outbox[0].body, 'Hi there')
@@ -39,6 +48,7 @@ class ContactTests(TestCase):
                                     {'name': '',
                                      'email': '',
                                      'message': 'Hi there'})
+        send_batch()
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'Web Feedback')
         self.assertEqual(mail.outbox[0].body, 'Hi there')
@@ -54,3 +64,91 @@ class ContactTests(TestCase):
                                      'message': ''})
         self.assertEqual(len(mail.outbox), 0)
         self.assertIn('contact/contact.html', map(lambda t: t.name, response.templates))
+
+    def test_reject_bad_address(self):
+        """Check that the page shows a warning if the email address makes no sense."""
+        response = self.client.post(reverse('contact'),
+                                    {'name': 'Bill',
+                                     'email': 'bill',
+                                     'message': 'Hi there'})
+        self.assertContains(response, 'class="warning"')
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_reject_line_breaks(self):
+        """Check that the page shows a warning if the name or address runs over two lines."""
+        for name, email in [('Bill\nBcc: x@example.com', ''), ('Bill', 'bill@example.com\r\nX')]:
+            response = self.client.post(reverse('contact'),
+                                        {'name': name, 'email': email, 'message': 'Hi there'})
+            self.assertContains(response, 'class="warning"')
+        self.assertFalse(OutboundMessage.objects.exists())
+
+class UnreachableBackend(BaseEmailBackend):
+    """Mail backend for a server which can't be reached."""
+    def open(self):
+        raise OSError('Connection refused')
+
+    def send_messages(self, email_messages):
+        self.open()
+        return 0
+
+class CountingBackend(LocmemBackend):
+    """Test mailbox which also counts the connections opened."""
+    opened = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+        return True
+
+class MailQueueTests(TestCase):
+    """Tests for the outgoing mail queue and its worker."""
+
+    def test_message_queued(self):
+        """Check that the form doesn't send anything until the worker runs."""
+        self.client.post(reverse('contact'), {'name': 'Bill', 'email': '', 'message': 'Hi there'})
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('send_queued_mail', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OutboundMessage.objects.get().status, OutboundMessage.SENT)
+
+    @override_settings(EMAIL_BACKEND='contact.tests.CountingBackend')
+    def test_batch_connection(self):
+        """Check that a batch is sent over one connection, and limited to the batch size."""
+        for i in range(5):
+            queue_mail('Web Feedback', str(i), CONTACT_ADDRESS, CONTACT_ADDRESS)
+        CountingBackend.opened = 0
+        self.assertEqual(send_batch(3), (3, 0))
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual([message.body for message in mail.outbox], ['0', '1', '2'])
+        self.assertEqual(send_batch(3), (2, 0))
+        self.assertEqual(send_batch(3), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='contact.tests.UnreachableBackend',
+                       MAIL_QUEUE_RETRY_SECONDS=60, MAIL_QUEUE_MAX_ATTEMPTS=3)
+    def test_retry_backoff(self):
+        """Check that failed messages are retried later, with a growing delay, then dropped."""
+        message = queue_mail('Web Feedback', 'Hi there', CONTACT_ADDRESS, CONTACT_ADDRESS)
+        for attempt, delay in [(1, 60), (2, 120)]:
+            before = timezone.now()
+            self.assertEqual(send_batch(), (0, 1))
+            message.refresh_from_db()
+            self.assertEqual(message.attempts, attempt)
+            self.assertEqual(message.status, OutboundMessage.PENDING)
+            self.assertGreaterEqual(message.next_attempt, before + timedelta(seconds=delay))
+            self.assertEqual(send_batch(), (0, 0))
+            OutboundMessage.objects.update(next_attempt=timezone.now())
+
+        self.assertEqual(send_batch(), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboundMessage.FAILED)
+        self.assertIn('Connection refused', message.last_error)
+
+    def test_bad_header(self):
+        """Check that a message whose headers can't be written fails for good, and the rest
+        of the batch is still sent."""
+        bad = queue_mail('Web Feedback', 'Hi there', 'Bill\n<bill@example.com>', CONTACT_ADDRESS)
+        queue_mail('Web Feedback', 'Hello', CONTACT_ADDRESS, CONTACT_ADDRESS)
+        self.assertEqual(send_batch(), (1, 1))
+        bad.refresh_from_db()
+        self.assertEqual(bad.status, OutboundMessage.FAILED)
+        self.assertEqual(bad.attempts, 1)
+        self.assertEqual([message.body for message in mail.outbox], ['Hello'])
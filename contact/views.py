@@ -1,12 +1,16 @@
 """
 Functions to render and handle the contact form.
+
+Messages are queued rather than sent during the request, so a slow mail
+server never holds up the site. See contact.models for the delivery side.
 """
 
 import os
-from smtplib import SMTPRecipientsRefused
 from django import forms
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from django.shortcuts import render
-from django.core.mail import send_mail
+from contact.models import queue_mail
 
 CONTACT_ADDRESS = os.environ.get('CONTACT_ADDRESS')
 
@@ -25,10 +29,16 @@ def contact(request):
             name = form.cleaned_data['name'] or 'Anonymous'
             email = form.cleaned_data['email'] or CONTACT_ADDRESS
             message = form.cleaned_data['message']
+            if any(char in name + email for char in '\r\n'):
+                # They'd end up in the email's headers, which can't hold line breaks
+                context['form'] = form
+                context['warning'] = "Names and email addresses need to fit on one line."
+                return render(request, 'contact/contact.html', context)
             try:
-                send_mail('Web Feedback', message, name + '<' + email  + '>', [CONTACT_ADDRESS])
+                validate_email(email)
+                queue_mail('Web Feedback', message, name + '<' + email  + '>', CONTACT_ADDRESS)
                 return render(request, 'contact/sent.html')
-            except SMTPRecipientsRefused:
+            except ValidationError:
                 context['warning'] = "Couldn't make sense of that email address" \
                                      "(but leave it blank if you like)."
     else:
@@ -0,0 +1,56 @@
+"""
+Gunicorn settings, read automatically when gunicorn starts in this directory.
+
+The app is loaded and warmed up in the master process before forking, so
+workers start with compiled templates and primed caches, sharing that
+memory copy-on-write. Set GUNICORN_NO_PRELOAD to load the app in each worker
+instead (needed for code changes to be picked up by a HUP), and each worker
+warms itself up before taking requests.
+
+Workers are replaced after a couple of thousand requests (staggered, so they
+don't all restart at once) to put a ceiling on slow leaks. A worker which
+the memory watchdog finds over MEMORY_RSS_LIMIT_MB is also replaced straight
+after its current request if MEMORY_RECYCLE is set. The metrics snapshot
+of each worker which exits is added into the totals for exited workers.
+"""
+#pylint: disable=invalid-name
+
+import os
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+preload_app = 'GUNICORN_NO_PRELOAD' not in os.environ
+# Each thread keeps its own database connection open (see DB_CONN_MAX_AGE)
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+
+def when_ready(server):
+    """Warm up the preloaded app once, before any workers are forked."""
+    if server.cfg.preload_app:
+        #pylint: disable=import-outside-toplevel
+        from puzzle.warmup import prepare_for_fork, warm_up
+        timings = warm_up()
+        prepare_for_fork()
+        server.log.info('Warmed up in %.3fs: %s', sum(timings.values()), ', '.join(timings))
+
+def post_worker_init(worker):
+    """Warm up a worker which loaded the app itself."""
+    if not worker.cfg.preload_app:
+        from puzzle.warmup import warm_up #pylint: disable=import-outside-toplevel
+        timings = warm_up()
+        worker.log.info('Worker %s warmed up in %.3fs', worker.pid, sum(timings.values()))
+
+def child_exit(server, worker):
+    """Add an exited worker's metrics into the totals, so its snapshot file doesn't linger."""
+    # Without preloading, the app (and its settings) only exist in the workers
+    if server.cfg.preload_app:
+        from instrumentation.metrics import fold_snapshots #pylint: disable=import-outside-toplevel
+        fold_snapshots([worker.pid])
+
+def post_request(worker, req, environ, resp): #pylint: disable=unused-argument
+    """Retire the worker gracefully once it has grown past the memory limit."""
+    #pylint: disable=import-outside-toplevel
+    from django.conf import settings
+    from instrumentation.memory import watchdog
+    if settings.MEMORY_RECYCLE and watchdog.over_limit and worker.alive:
+        worker.log.warning('Recycling worker %s: over the memory limit', worker.pid)
+        worker.alive = False
@@ -0,0 +1,8 @@
+"""
+Request timing and metrics for the site.
+
+Middleware records how long each view takes and where that time goes
+(database, templates and any other timed phases), sends a breakdown back in
+the Server-Timing header and aggregates the numbers for Prometheus to scrape
+at /metrics/.
+"""
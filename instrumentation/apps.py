@@ -0,0 +1,34 @@
+"""
+App configuration for request metrics and memory monitoring.
+"""
+
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+class InstrumentationConfig(AppConfig):
+    """Time every database query made on behalf of a request, and watch memory use."""
+    name = 'instrumentation'
+
+    def ready(self):
+        #pylint: disable=import-outside-toplevel
+        from instrumentation.database import count_connection
+        from instrumentation.memory import register_cache, start_tracing
+        from instrumentation.metrics import install_query_timer, registry
+        from puzzle.progress import progress_buffer
+        from visitors.models import log_buffer
+        connection_created.connect(install_query_timer)
+        connection_created.connect(count_connection)
+        start_tracing()
+        register_cache('metrics', lambda: (len(registry.counters) + len(registry.histograms),
+                                           None))
+        register_cache('visitor log buffer', lambda: (len(log_buffer.logs), None))
+        register_cache('solve progress buffer', lambda: (len(progress_buffer.pending), None))
+        register_cache('default cache', get_cache_size)
+
+def get_cache_size():
+    """Entries and bytes in the default cache, if it's held in this process."""
+    from django.core.cache import cache #pylint: disable=import-outside-toplevel
+    entries = getattr(cache, '_cache', None)
+    if not isinstance(entries, dict):
+        return None, 'not held in this process'
+    return len(entries), sum(len(value) for value in list(entries.values()))
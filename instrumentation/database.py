@@ -0,0 +1,68 @@
+"""
+Keep track of database connections.
+
+Counts how often connections are opened and how often requests use one, so
+the difference shows how well persistent connections are being reused, and
+how many are open in each process. If a database has a connection pool
+(Postgres with psycopg 3 and the pool option set), the pool's own statistics
+are added too: checkouts, waits for a free connection, and its size.
+"""
+
+from threading import Lock
+from weakref import WeakSet
+from django.db import connections
+from instrumentation.metrics import registry
+
+POOL_COUNTERS = {
+    'requests_num': 'db_pool_checkouts_total',
+    'requests_queued': 'db_pool_waits_total',
+    'connections_num': 'db_pool_connections_opened_total',
+    'connections_errors': 'db_pool_connection_errors_total',
+    'connections_lost': 'db_pool_connections_lost_total',
+}
+
+POOL_GAUGES = {
+    'pool_size': 'db_pool_connections',
+    'pool_available': 'db_pool_available_connections',
+    'requests_waiting': 'db_pool_waiting_requests',
+}
+
+# Every connection wrapper (one per thread per database) that has ever connected
+wrappers = WeakSet() #pylint: disable=invalid-name
+wrappers_lock = Lock() #pylint: disable=invalid-name
+
+def count_connection(sender, connection, **kwargs): #pylint: disable=unused-argument
+    """Count a newly opened connection, and remember it to see whether it's still open."""
+    registry.inc('db_connections_opened_total', (('database', connection.alias),))
+    with wrappers_lock:
+        wrappers.add(connection)
+
+def get_open_connections():
+    """Number of connections open in this process, by database alias."""
+    with wrappers_lock:
+        open_wrappers = [wrapper for wrapper in wrappers if wrapper.connection is not None]
+    counts = {alias: 0 for alias in connections}
+    for wrapper in open_wrappers:
+        counts[wrapper.alias] = counts.get(wrapper.alias, 0) + 1
+    return counts
+
+def record_pool_stats(alias):
+    """Add a database's pool statistics since the last time to the metrics."""
+    pool = getattr(connections[alias], 'pool', None)
+    if pool is None:
+        return
+    labels = (('database', alias),)
+    stats = pool.pop_stats()
+    for stat, name in POOL_COUNTERS.items():
+        registry.inc(name, labels, stats.get(stat, 0))
+    registry.inc('db_pool_wait_seconds_total', labels, stats.get('requests_wait_ms', 0) / 1000)
+    for stat, name in POOL_GAUGES.items():
+        registry.set(name, labels, stats.get(stat, 0))
+
+def record_connections(timings):
+    """Update the connection metrics at the end of a request."""
+    for alias in sorted(timings.databases):
+        registry.inc('db_connection_checkouts_total', (('database', alias),))
+    for alias, count in get_open_connections().items():
+        registry.set('db_connections_open', (('database', alias),), count)
+        record_pool_stats(alias)
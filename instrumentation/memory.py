@@ -0,0 +1,145 @@
+"""
+Keep an eye on how much memory each worker process is using.
+
+Three pieces:
+
+- A registry of in-process caches, so their sizes can be reported together.
+  Anything which holds on to data between requests should register itself
+  with register_cache.
+- A tracemalloc report of the top allocation sites, and of what has grown
+  since the last snapshot. Tracing only starts if MEMORY_TRACE_FRAMES is set,
+  since it slows everything down.
+- A watchdog which checks the resident set size every few requests and logs
+  a warning when it passes MEMORY_RSS_LIMIT_MB. Under gunicorn it can also
+  have the worker recycled (see gunicorn.conf.py).
+"""
+
+import logging
+import os
+import resource
+import sys
+import tracemalloc
+from threading import Lock
+from django.conf import settings
+
+logger = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+CACHES = {}
+
+def register_cache(name, sizer):
+    """Add an in-process cache to the memory report.
+
+    The sizer is called with no arguments and returns the number of entries in the
+    cache and its approximate size in bytes (or None if that can't be worked out cheaply).
+    """
+    CACHES[name] = sizer
+
+def get_cache_sizes():
+    """Entries and bytes held by each registered cache."""
+    sizes = {}
+    for name, sizer in sorted(CACHES.items()):
+        try:
+            sizes[name] = sizer()
+        except Exception as error: #pylint: disable=broad-except
+            # A broken sizer shouldn't take down the whole report
+            sizes[name] = (None, repr(error))
+    return sizes
+
+def get_rss():
+    """Resident set size of this process in bytes, or its peak if the current size isn't known."""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def start_tracing():
+    """Start tracing allocations if MEMORY_TRACE_FRAMES asks for it."""
+    if settings.MEMORY_TRACE_FRAMES and not tracemalloc.is_tracing():
+        tracemalloc.start(settings.MEMORY_TRACE_FRAMES)
+
+class SnapshotHistory:
+    """The last tracemalloc snapshot taken, to compare the next one with."""
+    def __init__(self):
+        self.lock = Lock()
+        self.snapshot = None
+
+    def take(self, keep=False):
+        """Take a new snapshot, returning it with the previous one.
+
+        The new snapshot only replaces the previous one if keep is set.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ])
+        with self.lock:
+            previous = self.snapshot
+            if keep or previous is None:
+                self.snapshot = snapshot
+        return snapshot, previous
+
+snapshots = SnapshotHistory() #pylint: disable=invalid-name
+
+def format_size(size):
+    """Human-readable number of bytes."""
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+def memory_report(limit=None, keep_snapshot=False):
+    """Text report on this process's memory use."""
+    limit = limit or settings.MEMORY_REPORT_LINES
+    lines = [f'Process {os.getpid()}: RSS {format_size(get_rss())}', '', 'Caches:']
+    for name, (entries, size) in get_cache_sizes().items():
+        size_text = size if isinstance(size, str) else \
+                    format_size(size) if size is not None else 'size unknown'
+        lines.append(f'  {name}: {entries} entries, {size_text}')
+
+    if not tracemalloc.is_tracing():
+        lines += ['', 'Allocation tracing is off. Set MEMORY_TRACE_FRAMES to turn it on.']
+        return '\n'.join(lines) + '\n'
+
+    current, peak = tracemalloc.get_traced_memory()
+    lines += ['', f'Traced: {format_size(current)} now, {format_size(peak)} at peak', '',
+              f'Top {limit} allocation sites:']
+    snapshot, previous = snapshots.take(keep_snapshot)
+    for stat in snapshot.statistics('lineno')[:limit]:
+        lines.append(f'  {format_size(stat.size):>12} {stat.count:>8} blocks  {stat.traceback}')
+
+    if previous is not None and previous is not snapshot:
+        lines += ['', f'Top {limit} changes since the last snapshot:']
+        for stat in snapshot.compare_to(previous, 'lineno')[:limit]:
+            lines.append(f'  {format_size(stat.size_diff):>12} {stat.count_diff:>+8} blocks  '
+                         f'{stat.traceback}')
+    return '\n'.join(lines) + '\n'
+
+class Watchdog:
+    """Check the process size every few requests, and complain if it's over the limit.
+
+    Checked by the metrics middleware after each request. The gunicorn post_request
+    hook then recycles the worker if it's over the limit and MEMORY_RECYCLE is set.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.over_limit = False
+
+    def check(self):
+        """Count a request, returning True if the process has grown past the RSS limit."""
+        limit = settings.MEMORY_RSS_LIMIT_MB
+        self.requests += 1
+        if not limit or self.over_limit or self.requests % settings.MEMORY_CHECK_EVERY:
+            return self.over_limit
+        rss = get_rss()
+        if rss >= limit * 1024 * 1024:
+            logger.warning('Process %d has reached %s after %d requests (limit %d MiB)',
+                           os.getpid(), format_size(rss), self.requests, limit)
+            self.over_limit = True
+        return self.over_limit
+
+watchdog = Watchdog() #pylint: disable=invalid-name
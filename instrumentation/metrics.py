@@ -0,0 +1,295 @@
+"""
+Collect timings for the current request and aggregate them per process.
+
+Timings for a request are gathered in a context variable, so they follow the
+request into worker threads under ASGI. Aggregated metrics are kept in memory
+and every few seconds each process writes a snapshot of its totals to a file
+in METRICS_DIR. The /metrics/ endpoint adds up all the snapshots, so the
+numbers cover every gunicorn worker, including ones which have since exited.
+Gauges are the exception: they describe a process as it is now, so they're
+only added up from snapshots written in the last GAUGE_SECONDS.
+
+Workers come and go (gunicorn replaces them every couple of thousand
+requests), so the snapshots of processes which have exited are added into
+one file of totals and deleted, by gunicorn as each worker exits and by the
+endpoint for any it finds left over.
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import monotonic, perf_counter, time
+from uuid import uuid4
+from django.conf import settings
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Gauges in snapshots older than this probably come from a worker which has exited
+GAUGE_SECONDS = 60
+
+# Snapshots from processes which have exited are added up in this file
+EXITED_FILE = 'metrics-exited.json'
+SNAPSHOT_FILE = re.compile(r'metrics-(\d+)-[0-9a-f]+\.json$')
+
+current_timings = ContextVar('current_timings', default=None) #pylint: disable=invalid-name
+
+class RequestTimings:
+    """Time spent in each phase of a request, plus a count of database queries.
+
+    The aliases of the databases queried are kept too. Set query_log to a list to
+    keep each query's SQL, parameters and duration as well.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.queries = 0
+        self.databases = set()
+        self.query_log = None
+
+    def add(self, phase, duration):
+        """Add some time to a phase."""
+        self.phases[phase] = self.phases.get(phase, 0) + duration
+
+@contextmanager
+def timed(phase):
+    """Context manager to add the time taken by a block of code to a phase of the request."""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, perf_counter() - start)
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper which adds each query to the current request's timings."""
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = perf_counter() - start
+        timings.add('db', duration)
+        timings.queries += 1
+        timings.databases.add(context['connection'].alias)
+        if timings.query_log is not None:
+            timings.query_log.append((sql, params, duration))
+
+def install_query_timer(sender, connection, **kwargs): #pylint: disable=unused-argument
+    """Add the query timer to a newly opened database connection."""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+class Registry:
+    """Counters, histograms and gauges for this process, keyed by metric name and labels."""
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.filename = f'metrics-{os.getpid()}-{uuid4().hex[:8]}.json'
+        self.flushed = monotonic()
+
+    def inc(self, name, labels, value=1):
+        """Add to a counter."""
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        """Record a value in a histogram."""
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def set(self, name, labels, value):
+        """Set a gauge."""
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def snapshot(self):
+        """Plain copy of the metrics, in the form they're stored on disk."""
+        with self.lock:
+            return {'counters': [[name, list(labels), value]
+                                 for (name, labels), value in self.counters.items()],
+                    'histograms': [[name, list(labels), list(buckets), total, count]
+                                   for (name, labels), (buckets, total, count)
+                                   in self.histograms.items()],
+                    'gauges': [[name, list(labels), value]
+                               for (name, labels), value in self.gauges.items()],
+                    'time': time()}
+
+    def flush(self, force=False):
+        """Write this process's totals to METRICS_DIR, if it's been long enough since last time."""
+        if not settings.METRICS_DIR:
+            return
+        if not force and monotonic() - self.flushed < settings.METRICS_FLUSH_SECONDS:
+            return
+        self.flushed = monotonic()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write_snapshot(os.path.join(settings.METRICS_DIR, self.filename), self.snapshot())
+
+registry = Registry() #pylint: disable=invalid-name
+atexit.register(registry.flush, force=True)
+
+def process_exists(pid):
+    """Whether a process is still running on this machine."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def read_snapshot(path):
+    """A snapshot from a file, or None if it can't be read."""
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def write_snapshot(path, snapshot):
+    """Write a snapshot to a file, replacing it in one go."""
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(snapshot, file)
+    os.replace(path + '.tmp', path)
+
+def find_exited(metrics_dir, pids=None):
+    """Snapshot files written by processes which have exited.
+
+    That's the given pids if there are any, otherwise processes which can't be found.
+    """
+    exited = []
+    for filename in os.listdir(metrics_dir):
+        match = SNAPSHOT_FILE.match(filename)
+        if not match or filename == registry.filename:
+            continue
+        pid = int(match.group(1))
+        if (pid in pids) if pids is not None else not process_exists(pid):
+            exited.append(filename)
+    return exited
+
+def fold_snapshots(pids=None):
+    """Add the snapshots of processes which have exited into the totals file, and delete them.
+
+    Returns the number of snapshots folded in.
+    """
+    metrics_dir = settings.METRICS_DIR
+    if not metrics_dir or not os.path.isdir(metrics_dir) or not find_exited(metrics_dir, pids):
+        return 0
+    with open(os.path.join(metrics_dir, 'metrics.lock'), 'a', encoding='utf-8') as lock:
+        # Another process may be folding the same files
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = find_exited(metrics_dir, pids)
+        if not exited:
+            return 0
+        path = os.path.join(metrics_dir, EXITED_FILE)
+        snapshots = [read_snapshot(os.path.join(metrics_dir, filename))
+                     for filename in [EXITED_FILE] + exited]
+        counters, histograms = merge_snapshots([snapshot for snapshot in snapshots if snapshot])
+        # No gauges, since none of these processes are running any more
+        write_snapshot(path, {
+            'counters': [[name, [list(pair) for pair in labels], value]
+                         for (name, labels), value in counters.items()],
+            'histograms': [[name, [list(pair) for pair in labels], buckets, total, count]
+                           for (name, labels), (buckets, total, count) in histograms.items()],
+            'gauges': [], 'time': 0})
+        for filename in exited:
+            try:
+                os.remove(os.path.join(metrics_dir, filename))
+            except FileNotFoundError:
+                pass
+    return len(exited)
+
+def load_snapshots():
+    """Snapshots from every running process which has written one and the totals of those
+    which have exited, with this process's current totals."""
+    fold_snapshots()
+    snapshots = [registry.snapshot()]
+    metrics_dir = settings.METRICS_DIR
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for filename in os.listdir(metrics_dir):
+            if filename.endswith('.json') and filename != registry.filename:
+                snapshot = read_snapshot(os.path.join(metrics_dir, filename))
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+    return snapshots
+
+def merge_snapshots(snapshots):
+    """Add up counters and histograms from several processes."""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(BUCKETS), 0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+def merge_gauges(snapshots):
+    """Add up gauges from the processes which have written a snapshot recently."""
+    gauges = {}
+    for snapshot in snapshots:
+        if snapshot.get('time', 0) < time() - GAUGE_SECONDS:
+            continue
+        for name, labels, value in snapshot.get('gauges', []):
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0) + value
+    return gauges
+
+def format_labels(labels, extra=()):
+    """Prometheus label set from (name, value) pairs."""
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def render_prometheus(counters, histograms, descriptions, gauges=None):
+    """Format merged metrics in the Prometheus text exposition format."""
+    lines = []
+    for kind, values in [('counter', counters), ('gauge', gauges or {})]:
+        for name in sorted({name for name, _ in values}):
+            lines.append(f'# HELP {name} {descriptions.get(name, name)}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f'# HELP {name} {descriptions.get(name, name)}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
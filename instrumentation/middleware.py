@@ -0,0 +1,134 @@
+"""
+Middleware to time each request and record it in the metrics.
+"""
+
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from instrumentation.database import record_connections
+from instrumentation.memory import watchdog
+from instrumentation.metrics import RequestTimings, current_timings, registry
+from instrumentation.profiling import RequestProfile, get_mode
+
+class HybridMiddleware:
+    """Base for middleware which stays sync or async to match the rest of the request chain.
+
+    Subclasses handle requests in handle, or ahandle when the chain is async.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.ahandle(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        """Deal with a request in a sync chain."""
+        raise NotImplementedError
+
+    async def ahandle(self, request):
+        """Deal with a request in an async chain."""
+        raise NotImplementedError
+
+class MetricsMiddleware(HybridMiddleware):
+    """Record latency, query and template time and response size for every view.
+
+    Should go first in MIDDLEWARE, so that the time covers everything else.
+    """
+    def handle(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        record_request(request, response, timings, perf_counter() - start)
+        return response
+
+    async def ahandle(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        record_request(request, response, timings, perf_counter() - start)
+        return response
+
+def get_view_name(request):
+    """Label for the view which handled a request, without the URL's variable parts."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match._func_path #pylint: disable=protected-access
+
+def record_request(request, response, timings, duration):
+    """Add a finished request to the metrics and give its breakdown in Server-Timing."""
+    labels = (('view', get_view_name(request)), ('method', request.method))
+    registry.observe('http_request_duration_seconds', labels, duration)
+    registry.inc('http_requests_total', labels + (('status', str(response.status_code)),))
+    registry.inc('db_queries_total', labels, timings.queries)
+    for phase, phase_duration in timings.phases.items():
+        registry.inc('phase_duration_seconds_total', labels + (('phase', phase),),
+                     phase_duration)
+    if not response.streaming:
+        registry.inc('http_response_bytes_total', labels, len(response.content))
+    record_connections(timings)
+    registry.flush()
+    watchdog.check()
+
+    entries = [f'{phase};dur={phase_duration * 1000:.1f}'
+               for phase, phase_duration in timings.phases.items()]
+    if timings.queries:
+        entries.append(f'queries;desc="{timings.queries} queries"')
+    entries.append(f'total;dur={duration * 1000:.1f}')
+    response['Server-Timing'] = ', '.join(entries)
+
+class ProfilerMiddleware(HybridMiddleware):
+    """Let staff profile any request by adding ?profile=<mode>. See instrumentation.profiling.
+
+    Goes after the authentication middleware, so it knows who's asking.
+    """
+    def handle(self, request):
+        mode = get_mode(request)
+        if mode is None or not request.user.is_staff:
+            return self.get_response(request)
+        timings, token = get_or_set_timings()
+        try:
+            with RequestProfile(mode, request.GET.get('sort'), timings) as profile:
+                self.get_response(request)
+        finally:
+            if token is not None:
+                current_timings.reset(token)
+        return profile.response
+
+    async def ahandle(self, request):
+        mode = get_mode(request)
+        if mode is None or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+        timings, token = get_or_set_timings()
+        try:
+            with RequestProfile(mode, request.GET.get('sort'), timings, async_mode=True) as profile:
+                await self.get_response(request)
+        finally:
+            if token is not None:
+                current_timings.reset(token)
+        return profile.response
+
+def get_or_set_timings():
+    """Timings for the current request, started here if the metrics middleware isn't in use.
+
+    Returns the timings and a token to reset the context variable with, if it was set.
+    """
+    timings = current_timings.get()
+    if timings is not None:
+        return timings, None
+    timings = RequestTimings()
+    return timings, current_timings.set(timings)
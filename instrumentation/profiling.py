@@ -0,0 +1,162 @@
+"""
+Profile a single request on demand, through ProfilerMiddleware.
+
+Staff can add ?profile=<mode> (or an X-Profile header) to any page to get a
+report on that request instead of the page itself:
+
+- cprofile: deterministic profile as text, sorted by cumulative time, or by
+  another pstats key given with &sort=
+- pstats: the same profile as a binary file for snakeviz or pstats
+- flame: sampled stacks in the collapsed format read by flamegraph.pl and
+  speedscope
+- sql: every query with its time, with repeated queries picked out
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+from collections import Counter
+from time import perf_counter
+from django.conf import settings
+from django.http import HttpResponse
+
+MODES = ('cprofile', 'pstats', 'flame', 'sql')
+
+# Frames from these files at the top of a stack mean the thread is just waiting
+IDLE_FILES = ('threading.py', 'selectors.py', 'queue.py', 'thread.py')
+
+def get_mode(request):
+    """Profiling mode asked for by a request, or None."""
+    mode = request.GET.get('profile') or request.META.get('HTTP_X_PROFILE')
+    return mode if mode in MODES else None
+
+def text_response(content, content_type='text/plain; charset=utf-8'):
+    """Report response which no cache should keep."""
+    response = HttpResponse(content, content_type=content_type)
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+class Sampler:
+    """Background thread which samples the stacks of running threads.
+
+    Only the given thread is sampled, or every busy thread if there isn't one.
+    """
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id
+        self.interval = interval or settings.PROFILE_SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        """Take samples until stopped."""
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items(): #pylint: disable=protected-access
+                if thread_id == own_id or \
+                   (self.thread_id is not None and thread_id != self.thread_id):
+                    continue
+                if self.thread_id is None and frame.f_code.co_filename.endswith(IDLE_FILES):
+                    continue
+                self.stacks[self.collapse(frame)] += 1
+
+    @staticmethod
+    def collapse(frame):
+        """One line of a collapsed stack, outermost call first."""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def report(self):
+        """Samples in the collapsed stack format, one stack per line with its count."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+def cprofile_report(profiler, mode, sort):
+    """Report from a finished deterministic profile."""
+    if mode == 'pstats':
+        profiler.create_stats()
+        response = HttpResponse(marshal.dumps(profiler.stats),
+                                content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="request.prof"'
+        response['Cache-Control'] = 'private, no-store'
+        return response
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    try:
+        stats.sort_stats(sort or 'cumulative')
+    except KeyError:
+        stats.sort_stats('cumulative')
+    stats.print_stats(settings.PROFILE_REPORT_LINES)
+    return text_response(output.getvalue())
+
+def sql_report(query_log, duration):
+    """Report on the queries made by a request, with the worst repeats first."""
+    total = sum(query_duration for _, _, query_duration in query_log)
+    lines = [f'{len(query_log)} queries in {total * 1000:.1f}ms '
+             f'(request took {duration * 1000:.1f}ms)', '']
+
+    similar = Counter(sql for sql, _, _ in query_log)
+    exact = Counter((sql, repr(params)) for sql, params, _ in query_log)
+    repeated = [(count, sql) for sql, count in similar.most_common() if count > 1]
+    if repeated:
+        lines.append('Repeated queries:')
+        for count, sql in repeated:
+            duplicates = sum(n - 1 for (other, _), n in exact.items() if other == sql)
+            lines.append(f'  {count}x ({duplicates} exact duplicates) {sql}')
+        lines.append('')
+
+    for i, (sql, params, query_duration) in enumerate(query_log, 1):
+        lines.append(f'#{i} {query_duration * 1000:.2f}ms {sql}')
+        if params:
+            lines.append(f'    params: {params!r}')
+    return text_response('\n'.join(lines) + '\n')
+
+class RequestProfile:
+    """Context manager to profile whatever runs inside it, leaving a report in self.response.
+
+    Under ASGI the sampler looks at every busy thread, since the request moves between them.
+    """
+    def __init__(self, mode, sort, timings, async_mode=False):
+        self.mode = mode
+        self.sort = sort
+        self.timings = timings
+        self.async_mode = async_mode
+        self.profiler = self.sampler = None
+        self.start = None
+        self.response = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        if self.mode in ('cprofile', 'pstats'):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.mode == 'flame':
+            self.sampler = Sampler(None if self.async_mode else threading.get_ident())
+            self.sampler.__enter__()
+        else:
+            self.timings.query_log = []
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.response = cprofile_report(self.profiler, self.mode, self.sort)
+        elif self.sampler is not None:
+            self.sampler.__exit__(*exc_info)
+            self.response = text_response(self.sampler.report())
+        else:
+            self.response = sql_report(self.timings.query_log, perf_counter() - self.start)
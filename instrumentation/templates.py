@@ -0,0 +1,27 @@
+"""
+Template backend which times rendering for the request metrics.
+"""
+
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+from instrumentation.metrics import timed
+
+class TimedTemplate:
+    """Wrap a template so that rendering it counts towards the request's 'render' time."""
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        """Render the template, timing how long it takes."""
+        with timed('render'):
+            return self.template.render(context, request)
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """The standard Django template backend, with timed rendering."""
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
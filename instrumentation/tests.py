@@ -0,0 +1,267 @@
+"""
+Unit tests for request timing and metrics.
+"""
+
+import json
+import marshal
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from threading import Thread
+from time import time
+from django.db import connections
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from instrumentation.memory import Watchdog, memory_report, snapshots
+from instrumentation.metrics import BUCKETS, Registry, fold_snapshots, merge_gauges
+from instrumentation.metrics import merge_snapshots, registry
+from instrumentation.metrics import render_prometheus
+from instrumentation.profiling import sql_report
+from puzzle.tests import create_puzzle_range, get_user
+
+def get_counter(name, **labels):
+    """Current value of a counter in this process."""
+    return registry.counters.get((name, tuple(labels.items())), 0)
+
+class ServerTimingTests(TestCase):
+    """Tests for the per-request timing breakdown."""
+
+    def test_server_timing_header(self):
+        """Check that a puzzle page reports its database, grid, template and total time."""
+        create_puzzle_range()
+        response = self.client.get(reverse('puzzle', args=['super', 1]))
+        phases = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        for phase in ['db', 'grid', 'render', 'log', 'queries', 'total']:
+            self.assertIn(phase, phases)
+
+    def test_request_counted(self):
+        """Check that requests, queries and response bytes are added up per view."""
+        create_puzzle_range()
+        before = get_counter('http_requests_total', view='puzzle', method='GET', status='200')
+        queries = get_counter('db_queries_total', view='puzzle', method='GET')
+        response = self.client.get(reverse('puzzle', args=['super', 1]))
+        self.assertEqual(
+            get_counter('http_requests_total', view='puzzle', method='GET', status='200'),
+            before + 1)
+        self.assertGreater(get_counter('db_queries_total', view='puzzle', method='GET'), queries)
+        self.assertGreaterEqual(get_counter('http_response_bytes_total', view='puzzle',
+                                            method='GET'), len(response.content))
+
+class MetricsEndpointTests(TestCase):
+    """Tests for the Prometheus metrics page."""
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.metrics_dir)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_access(self):
+        """Check that metrics need the token or a staff login."""
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, '# TYPE http_requests_total counter')
+        get_user()
+        self.client.login(username='test', password='password')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_metrics_merged(self):
+        """Check that totals written by other worker processes are added in."""
+        other = Registry()
+        other.inc('http_requests_total', (('view', 'elsewhere'),), 5)
+        other.observe('http_request_duration_seconds', (('view', 'elsewhere'),), 0.02)
+        with override_settings(METRICS_DIR=self.metrics_dir, METRICS_TOKEN='secret'):
+            other.flush(force=True)
+            registry.flush(force=True)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, 'http_requests_total{view="elsewhere"} 5')
+        self.assertContains(response, 'http_request_duration_seconds_count{view="elsewhere"} 1')
+        self.assertEqual(len(os.listdir(self.metrics_dir)), 2)
+
+    def test_exited_workers_folded(self):
+        """Check that snapshots of exited workers are added into one file, which is counted once."""
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True, check=True)
+        pid = int(exited.stdout)
+        for i in range(2):
+            snapshot = {'counters': [['http_requests_total', [['view', 'gone']], 3]],
+                        'histograms': [], 'gauges': [['busy', [], 1]], 'time': time()}
+            with open(os.path.join(self.metrics_dir, f'metrics-{pid}-0000000{i}.json'), 'w',
+                      encoding='utf-8') as file:
+                json.dump(snapshot, file)
+        other = Registry()
+        other.inc('http_requests_total', (('view', 'gone'),), 1)
+        with override_settings(METRICS_DIR=self.metrics_dir, METRICS_TOKEN='secret'):
+            other.flush(force=True)
+            for _ in range(2):
+                response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+                self.assertContains(response, 'http_requests_total{view="gone"} 7')
+            self.assertEqual(fold_snapshots([os.getpid()]), 1)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, 'http_requests_total{view="gone"} 7')
+        self.assertNotContains(response, 'busy')
+        self.assertEqual(sorted(name for name in os.listdir(self.metrics_dir)
+                                if name.endswith('.json')), ['metrics-exited.json'])
+
+    def test_histogram_format(self):
+        """Check that histogram buckets are cumulative and end with +Inf."""
+        snapshot = {'counters': [],
+                    'histograms': [['latency', [['view', 'a']], [1] + [0] * (len(BUCKETS) - 1),
+                                    12.5, 2]]}
+        counters, histograms = merge_snapshots([json.loads(json.dumps(snapshot))] * 2)
+        text = render_prometheus(counters, histograms, {})
+        self.assertIn('latency_bucket{view="a",le="0.005"} 2', text)
+        self.assertIn('latency_bucket{view="a",le="10.0"} 2', text)
+        self.assertIn('latency_bucket{view="a",le="+Inf"} 4', text)
+        self.assertIn('latency_sum{view="a"} 25.0', text)
+
+class ProfilerTests(TestCase):
+    """Tests for on-demand profiling of a single request."""
+
+    def setUp(self):
+        create_puzzle_range()
+        self.url = reverse('puzzle', args=['super', 1])
+
+    def test_profile_needs_staff(self):
+        """Check that anyone else just gets the page."""
+        response = self.client.get(self.url, {'profile': 'cprofile'})
+        self.assertContains(response, 'Crossword #1')
+        get_user()
+        self.client.login(username='test', password='password')
+        response = self.client.get(self.url, HTTP_X_PROFILE='sql')
+        self.assertContains(response, 'Crossword #1')
+
+    def test_cprofile_report(self):
+        """Check that staff get a sorted profile instead of the page."""
+        self.client.login(username='super', password='password')
+        response = self.client.get(self.url, {'profile': 'cprofile', 'sort': 'tottime'})
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertContains(response, 'function calls')
+        self.assertContains(response, 'Ordered by: internal time')
+        self.assertNotContains(response, 'Crossword #1')
+        self.assertIn('no-store', response['Cache-Control'])
+
+    def test_pstats_download(self):
+        """Check that the raw profile can be downloaded for other tools."""
+        self.client.login(username='super', password='password')
+        response = self.client.get(self.url, {'profile': 'pstats'})
+        self.assertIn('attachment', response['Content-Disposition'])
+        stats = marshal.loads(response.content)
+        self.assertTrue(any(name == 'display_puzzle' for _, _, name in stats))
+
+    @override_settings(PROFILE_SAMPLE_INTERVAL=0.0005)
+    def test_flame_report(self):
+        """Check that sampled stacks come back in the collapsed format."""
+        self.client.login(username='super', password='password')
+        response = self.client.get(self.url, {'profile': 'flame'})
+        for line in response.content.decode().splitlines():
+            self.assertRegex(line, r'^\S.*;.* \d+$')
+
+    def test_sql_report(self):
+        """Check that staff can list the queries made for a page."""
+        self.client.login(username='super', password='password')
+        response = self.client.get(self.url, {'profile': 'sql'})
+        self.assertRegex(response.content.decode(), r'^\d+ queries in ')
+        self.assertContains(response, 'puzzle_puzzle')
+
+    def test_sql_duplicates(self):
+        """Check that repeated queries are picked out, separating exact duplicates."""
+        query_log = [('SELECT a WHERE id = %s', (1,), 0.001),
+                     ('SELECT a WHERE id = %s', (2,), 0.001),
+                     ('SELECT a WHERE id = %s', (1,), 0.001),
+                     ('SELECT b', (), 0.002)]
+        report = sql_report(query_log, 0.01).content.decode()
+        self.assertIn('4 queries in 5.0ms', report)
+        self.assertIn('3x (1 exact duplicates) SELECT a WHERE id = %s', report)
+        self.assertIsNone(re.search(r'\dx .*SELECT b', report))
+
+class MemoryTests(TestCase):
+    """Tests for memory reports and the watchdog."""
+
+    def test_memory_report(self):
+        """Check that staff can see the process size and the registered caches."""
+        response = self.client.get(reverse('memory'))
+        self.assertEqual(response.status_code, 403)
+        create_puzzle_range()
+        self.client.login(username='super', password='password')
+        response = self.client.get(reverse('memory'))
+        self.assertContains(response, f'Process {os.getpid()}: RSS ')
+        self.assertContains(response, 'visitor log buffer: ')
+        self.assertContains(response, 'default cache: ')
+
+    def test_allocation_growth(self):
+        """Check that traced allocations and growth between snapshots are reported."""
+        tracemalloc.start(5)
+        try:
+            memory_report(keep_snapshot=True)
+            hoard = [bytearray(100000) for _ in range(10)]
+            report = memory_report(limit=5)
+            self.assertIn('Top 5 allocation sites:', report)
+            self.assertIn('Top 5 changes since the last snapshot:', report)
+            self.assertIn(__file__, report.split('changes since the last snapshot:')[1])
+            del hoard
+        finally:
+            tracemalloc.stop()
+            snapshots.snapshot = None
+
+    def test_watchdog(self):
+        """Check that the watchdog only looks every few requests, and flags a big process."""
+        dog = Watchdog()
+        with override_settings(MEMORY_RSS_LIMIT_MB=1, MEMORY_CHECK_EVERY=3):
+            with self.assertLogs('instrumentation.memory', 'WARNING'):
+                self.assertEqual([dog.check() for _ in range(4)], [False, False, True, True])
+        with override_settings(MEMORY_RSS_LIMIT_MB=1000000, MEMORY_CHECK_EVERY=1):
+            self.assertFalse(Watchdog().check())
+
+class ConnectionStatsTests(TransactionTestCase):
+    """Tests for database connection statistics."""
+    # Outside a transaction, reads may be routed to read replicas
+    databases = '__all__'
+
+    def test_reused_by_threads(self):
+        """Check that each thread opens one connection and reuses it for later requests."""
+        create_puzzle_range()
+        opened = get_counter('db_connections_opened_total', database='default')
+        checkouts = get_counter('db_connection_checkouts_total', database='default')
+        statuses = []
+
+        def worker():
+            client = Client()
+            try:
+                for _ in range(4):
+                    statuses.append(client.get(reverse('puzzle', args=['super', 1])).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [200] * 12)
+        self.assertEqual(get_counter('db_connection_checkouts_total', database='default'),
+                         checkouts + 12)
+        self.assertEqual(get_counter('db_connections_opened_total', database='default'),
+                         opened + 3)
+
+    def test_metrics_output(self):
+        """Check that connection counts are exposed, with gauges only from recent snapshots."""
+        create_puzzle_range()
+        self.client.login(username='super', password='password')
+        response = self.client.get(reverse('metrics'))
+        self.assertContains(response, 'db_connection_checkouts_total{database="default"} ')
+        self.assertContains(response, '# TYPE db_connections_open gauge\n'
+                                      'db_connections_open{database="default"} ')
+
+        old = {'gauges': [['db_connections_open', [['database', 'default']], 2]],
+               'time': time() - 3600}
+        new = {'gauges': [['db_connections_open', [['database', 'default']], 3]], 'time': time()}
+        self.assertEqual(merge_gauges([old, new, new]),
+                         {('db_connections_open', (('database', 'default'),)): 6})
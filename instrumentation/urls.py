@@ -0,0 +1,11 @@
+"""
+Map the metrics URL to its view.
+"""
+
+from django.urls import re_path
+from instrumentation import views
+
+urlpatterns = [ #pylint: disable=invalid-name
+    re_path(r'^$', views.metrics, name='metrics'),
+    re_path(r'^memory/$', views.memory, name='memory'),
+]
@@ -0,0 +1,63 @@
+"""
+Expose the aggregated metrics for Prometheus to scrape, and memory reports for staff.
+"""
+
+from hmac import compare_digest
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from instrumentation.memory import memory_report
+from instrumentation.metrics import load_snapshots, merge_gauges, merge_snapshots
+from instrumentation.metrics import render_prometheus
+
+DESCRIPTIONS = {
+    'http_request_duration_seconds': 'Time taken to respond to a request.',
+    'http_requests_total': 'Number of requests handled.',
+    'http_response_bytes_total': 'Bytes sent in response bodies.',
+    'db_queries_total': 'Number of database queries made.',
+    'phase_duration_seconds_total': 'Time spent in each phase of handling a request.',
+    'db_connections_opened_total': 'Number of new database connections made.',
+    'db_connection_checkouts_total': 'Number of requests which used a database connection.',
+    'db_connections_open': 'Number of database connections currently open.',
+    'db_pool_checkouts_total': 'Number of connections taken from the pool.',
+    'db_pool_waits_total': 'Number of times a connection was waited for.',
+    'db_pool_wait_seconds_total': 'Time spent waiting for a connection from the pool.',
+    'db_pool_connections_opened_total': 'Number of connections opened by the pool.',
+    'db_pool_connection_errors_total': 'Number of failed attempts to open a pool connection.',
+    'db_pool_connections_lost_total': 'Number of pool connections found broken.',
+    'db_pool_connections': 'Number of connections held by the pool.',
+    'db_pool_available_connections': 'Number of idle connections in the pool.',
+    'db_pool_waiting_requests': 'Number of requests waiting for a pool connection.',
+}
+
+def is_authorised(request):
+    """Allow access with the metrics token or to staff users."""
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and compare_digest(header, 'Bearer ' + token):
+        return True
+    return request.user.is_staff
+
+def metrics(request):
+    """Metrics for every worker process, in the Prometheus text format."""
+    if not is_authorised(request):
+        raise PermissionDenied
+    snapshots = load_snapshots()
+    counters, histograms = merge_snapshots(snapshots)
+    return HttpResponse(render_prometheus(counters, histograms, DESCRIPTIONS,
+                                          merge_gauges(snapshots)),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def memory(request):
+    """Memory report for whichever worker process handles the request.
+
+    Add ?snapshot=1 to make this the snapshot later reports show growth from.
+    """
+    if not is_authorised(request):
+        raise PermissionDenied
+    limit = request.GET.get('limit', '')
+    report = memory_report(int(limit) if limit.isdigit() else None,
+                           keep_snapshot='snapshot' in request.GET)
+    response = HttpResponse(report, content_type='text/plain; charset=utf-8')
+    response['Cache-Control'] = 'private, no-store'
+    return response
@@ -3,15 +3,22 @@ Admin views for loading and editing puzzles.
 
 Puzzles and blank grids are viewed as whole units using inline
 elements. Some extra fields are added to upload XML and ipuz files
-instead of relying on manual data entry.
+instead of relying on manual data entry. Saving a blank warns if another
+blank already has the same pattern, turned or flipped, and the blank list
+can be filtered down to those copies.
 """
 
 import json
 from xml.etree import ElementTree
-from django.contrib import admin
-from django.db.models import CharField
+from django.contrib import admin, messages
+from django.db import transaction
+from django.db.models import CharField, Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.forms import TextInput, FileField, ModelForm
-from puzzle.models import Puzzle, Entry, Blank, Block
+from puzzle.analysis import describe_symmetry, get_checked_percent, index_blank, index_puzzle
+from puzzle.analysis import with_analysis
+from puzzle.models import Puzzle, Entry, Blank, Block, GridAnalysis
+from puzzle.prerender import rebuild_for_user
 
 XMLNS = '{http://crossword.info/xml/rectangular-puzzle}'
 
@@ -55,6 +62,33 @@ def import_blank_from_ipuz(ipuz, blank):
                 block = Block(blank=blank, x=x, y=y)
                 block.save()
 
+class GridAnalysisColumns(admin.ModelAdmin):
+    """List blanks or puzzles with the statistics of their grids, fetched in the same query."""
+    analysis_fields = ['words', 'checked', 'unchecked', 'rotational', 'quarter_turn', 'mirror']
+
+    def get_queryset(self, request):
+        """Annotate the list with each grid's analysis, if there is one yet."""
+        return with_analysis(super().get_queryset(request), *self.analysis_fields)
+
+    @admin.display(description='symmetry')
+    def grid_symmetry(self, obj):
+        """Strongest symmetry of the grid."""
+        if obj.grid_words is None:
+            return '-'
+        return describe_symmetry(obj.grid_rotational, obj.grid_quarter_turn, obj.grid_mirror)
+
+    @admin.display(description='words', ordering='grid_words')
+    def grid_word_count(self, obj):
+        """Number of words in the grid."""
+        return obj.grid_words if obj.grid_words is not None else '-'
+
+    @admin.display(description='checked')
+    def grid_checked(self, obj):
+        """Percentage of squares which are checked."""
+        if obj.grid_words is None:
+            return '-'
+        return f'{get_checked_percent(obj.grid_checked, obj.grid_unchecked)}%'
+
 class PuzzleImportForm(ModelForm):
     """Add an XML import field."""
     file_import = FileField(label='Import from XML', required=False)
@@ -67,10 +101,11 @@ class EntryInline(admin.StackedInline):
     model = Entry
     formfield_overrides = {CharField: {'widget': TextInput(attrs={'size':'100'})}}
 
-class PuzzleAdmin(admin.ModelAdmin):
+class PuzzleAdmin(GridAnalysisColumns):
     """Show entries inline and allow import from XML"""
     form = PuzzleImportForm
     inlines = [EntryInline]
+    list_display = ['__str__', 'pub_date', 'grid_symmetry', 'grid_word_count', 'grid_checked']
 
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
@@ -78,6 +113,22 @@ class PuzzleAdmin(admin.ModelAdmin):
         if xml_file:
             import_from_xml(xml_file, obj)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        index_puzzle(form.instance)
+        user = form.instance.user
+        transaction.on_commit(lambda: rebuild_for_user(user))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(lambda: rebuild_for_user(obj.user))
+
+    def delete_queryset(self, request, queryset):
+        users = {obj.user for obj in queryset}
+        super().delete_queryset(request, queryset)
+        for user in users:
+            transaction.on_commit(lambda user=user: rebuild_for_user(user))
+
 class BlankImportForm(ModelForm):
     """Add an ipuz import field."""
     file_import = FileField(label='Import from ipuz', required=False)
@@ -85,15 +136,54 @@ class BlankImportForm(ModelForm):
         model = Blank
         fields = ['display_order']
 
+class DuplicateFilter(admin.SimpleListFilter):
+    """Narrow the blank list down to grids which share their pattern with another blank."""
+    title = 'duplicates'
+    parameter_name = 'duplicated'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Same pattern as another blank')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(copies__gt=1)
+        return queryset
+
 class BlockInline(admin.TabularInline):
     """Show blocks in a table."""
     model = Block
 
-class BlankAdmin(admin.ModelAdmin):
+class BlankAdmin(GridAnalysisColumns):
     """Show blocks inline and allow import from ipuz."""
     form = BlankImportForm
     inlines = [BlockInline]
     save_as = True
+    list_display = ['__str__', 'display_order', 'grid_symmetry', 'grid_word_count',
+                    'grid_checked', 'pattern', 'copies']
+    list_filter = [DuplicateFilter]
+
+    def get_queryset(self, request):
+        same_pattern = (Blank.objects.filter(pattern_hash=OuterRef('pattern_hash'))
+                        .exclude(pattern_hash='').order_by().values('pattern_hash')
+                        .annotate(total=Count('id')).values('total'))
+        return super().get_queryset(request).annotate(
+            copies=Coalesce(Subquery(same_pattern, output_field=IntegerField()), 1))
+
+    def get_ordering(self, request):
+        # Keep the copies of each pattern together when looking for duplicates
+        if request.GET.get(DuplicateFilter.parameter_name) == 'yes':
+            return ['pattern_hash', 'display_order', 'id']
+        return super().get_ordering(request)
+
+    @admin.display(description='pattern', ordering='pattern_hash')
+    def pattern(self, obj):
+        """Start of the hash shared by every copy of the pattern, however it's turned."""
+        return obj.pattern_hash[:8] or '-'
+
+    @admin.display(description='copies', ordering='copies')
+    def copies(self, obj):
+        """Number of blanks with this pattern, including this one."""
+        return obj.copies
 
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
@@ -101,7 +191,29 @@ class BlankAdmin(admin.ModelAdmin):
         if ipuz_file:
             import_blank_from_ipuz(ipuz_file, obj)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        duplicates = index_blank(form.instance)
+        if duplicates:
+            others = ', '.join(str(blank_id) for blank_id in duplicates)
+            plural = 's' if len(duplicates) > 1 else ''
+            self.message_user(request, f'Blank {form.instance.id} has the same pattern as '
+                              f'blank{plural} {others}, turned or flipped.', messages.WARNING)
+
+class GridAnalysisAdmin(admin.ModelAdmin):
+    """Browse grid statistics, which are worked out by analyse_grids rather than edited."""
+    list_display = ['grid_hash', 'size', 'words', 'checked', 'unchecked', 'rotational',
+                    'quarter_turn', 'mirror']
+    list_filter = ['size', 'rotational', 'quarter_turn', 'mirror']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 admin.site.site_header = "Three Pins Administration"
 admin.site.site_title = "Three Pins"
 admin.site.register(Puzzle, PuzzleAdmin)
 admin.site.register(Blank, BlankAdmin)
+admin.site.register(GridAnalysis, GridAnalysisAdmin)
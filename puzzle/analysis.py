@@ -0,0 +1,250 @@
+"""
+Work out the shape of a grid: its symmetry, how well checked it is, and its word lengths.
+
+A grid is packed into one integer, a bit per square, row after row, with an
+empty bit after each row as a guard. Shifting the whole thing by one bit
+lines every square up with its neighbour to the left or right, and shifting
+by a row's width lines it up with the one above or below, with the guards
+stopping words running off the end of one row into the next. So each
+question about the grid is a handful of whole-grid bitwise operations,
+rather than a loop over the squares. The same goes for word lengths, where
+the squares starting a word are whittled down by one letter at a time.
+
+Analyses depend only on the pattern of blocks, so they're stored once per
+pattern under the same hash as the preview images, for blanks and puzzles
+alike. manage.py analyse_grids fills them in for everything stored.
+
+Blank grids also get a pattern hash which is the same for every way round
+the grid can be turned or flipped, so copies of a blank are found with one
+indexed lookup, and the create page offers each pattern only once.
+"""
+
+from django.db.models import OuterRef, Subquery
+from puzzle.models import Blank, Block, Entry, GridAnalysis, Puzzle
+from puzzle.previews import get_blocks, get_grid_hash, get_pattern, hash_pattern
+from puzzle.previews import update_preview
+
+# The ways a square grid can be turned or flipped, as functions of (x, y) and the last index
+TRANSFORMS = [
+    lambda x, y, n: (x, y), lambda x, y, n: (n - y, x),
+    lambda x, y, n: (n - x, n - y), lambda x, y, n: (y, n - x),
+    lambda x, y, n: (n - x, y), lambda x, y, n: (x, n - y),
+    lambda x, y, n: (y, x), lambda x, y, n: (n - y, n - x),
+]
+
+def pack_grid(size, blocks):
+    """Pack the light squares of a grid into an integer, with a guard bit after each row.
+
+    Returns the packed lights and the stride between rows.
+    """
+    stride = size + 1
+    row = (1 << size) - 1
+    squares = sum(row << (y * stride) for y in range(size))
+    for x, y in blocks:
+        squares &= ~(1 << (y * stride + x))
+    return squares, stride
+
+def get_rows(lights, size, stride):
+    """The rows of a packed grid as strings of 0s and 1s."""
+    row = (1 << size) - 1
+    return [format((lights >> (y * stride)) & row, f'0{size}b') for y in range(size)]
+
+def get_symmetry(lights, size, stride):
+    """Whether a grid is the same turned half way round, a quarter of the way round,
+    and flipped left to right."""
+    rows = get_rows(lights, size, stride)
+    rotational = rows == [line[::-1] for line in reversed(rows)]
+    quarter_turn = rotational and rows == [''.join(line[x] for line in reversed(rows))
+                                           for x in range(size)]
+    mirror = all(line == line[::-1] for line in rows)
+    return rotational, quarter_turn, mirror
+
+def count_lengths(lights, shift, lengths):
+    """Add the words running in one direction to a count of words of each length.
+
+    Shift is the distance in bits to the next square along.
+    """
+    starts = lights & ~(lights << shift)
+    length = 1
+    while starts:
+        # Words which carry on for at least one more letter
+        longer = starts & (lights >> (length * shift))
+        if length > 1 and starts != longer:
+            lengths[length] = lengths.get(length, 0) + (starts & ~longer).bit_count()
+        starts = longer
+        length += 1
+
+def analyse_grid(size, blocks):
+    """Statistics for a grid, given the (x, y) squares which are blocks."""
+    lights, stride = pack_grid(size, blocks)
+    in_across = lights & ((lights << 1) | (lights >> 1))
+    in_down = lights & ((lights << stride) | (lights >> stride))
+    lengths = {}
+    count_lengths(lights, 1, lengths)
+    count_lengths(lights, stride, lengths)
+    rotational, quarter_turn, mirror = get_symmetry(lights, size, stride)
+    return {'size': size, 'lights': lights.bit_count(), 'words': sum(lengths.values()),
+            'checked': (in_across & in_down).bit_count(),
+            'unchecked': (in_across ^ in_down).bit_count(),
+            'rotational': rotational, 'quarter_turn': quarter_turn, 'mirror': mirror,
+            'lengths': {str(length): lengths[length] for length in sorted(lengths)}}
+
+def get_pattern_hash(size, blocks):
+    """Identify a pattern of blocks whichever way round it's turned or flipped.
+
+    That's the hash of the first of its eight orientations in sort order.
+    """
+    last = size - 1
+    patterns = [get_pattern(size, {transform(x, y, last) for x, y in blocks})
+                for transform in TRANSFORMS]
+    return hash_pattern(size, min(patterns))
+
+def store_analyses(grids):
+    """Make sure there's an analysis for each of a dict of grid hashes to (size, blocks)."""
+    existing = set(GridAnalysis.objects.filter(grid_hash__in=grids)
+                   .values_list('grid_hash', flat=True))
+    GridAnalysis.objects.bulk_create(
+        [GridAnalysis(grid_hash=grid_hash, **analyse_grid(size, blocks))
+         for grid_hash, (size, blocks) in grids.items() if grid_hash not in existing],
+        ignore_conflicts=True, batch_size=500)
+
+def load_blanks():
+    """Every blank grid in the order they're offered on the create page, each with its set
+    of blocks and its hashes worked out afresh, without saving anything."""
+    blanks = list(Blank.objects.order_by('display_order', 'id'))
+    blocks = {blank.id: set() for blank in blanks}
+    for blank_id, x, y in Block.objects.values_list('blank_id', 'x', 'y'):
+        blocks[blank_id].add((x, y))
+    for blank in blanks:
+        blank.blocks = blocks[blank.id]
+        blank.stored_hashes = (blank.grid_hash, blank.pattern_hash)
+        blank.grid_hash = get_grid_hash(blank.size, blank.blocks)
+        blank.pattern_hash = get_pattern_hash(blank.size, blank.blocks)
+    return blanks
+
+def analyse_blanks():
+    """Bring the analyses and pattern hashes of every blank grid up to date.
+
+    Returns the blanks as load_blanks does.
+    """
+    blanks = load_blanks()
+    store_analyses({blank.grid_hash: (blank.size, blank.blocks) for blank in blanks})
+    Blank.objects.bulk_update(
+        [blank for blank in blanks
+         if blank.stored_hashes != (blank.grid_hash, blank.pattern_hash)],
+        ['grid_hash', 'pattern_hash'])
+    return blanks
+
+def get_distinct_blanks():
+    """The blanks to offer on the create page: the first of each pattern, however it's turned.
+
+    Only reads from the database, so it's safe to call while serving a page.
+    """
+    seen = set()
+    distinct = []
+    for blank in load_blanks():
+        if blank.pattern_hash not in seen:
+            seen.add(blank.pattern_hash)
+            distinct.append(blank)
+    return distinct
+
+def get_analyses(blanks):
+    """The analysis of each of a list of blanks, worked out on the spot for any not stored yet."""
+    stored = GridAnalysis.objects.in_bulk([blank.grid_hash for blank in blanks],
+                                          field_name='grid_hash')
+    return [stored.get(blank.grid_hash) or
+            GridAnalysis(grid_hash=blank.grid_hash, **analyse_grid(blank.size, blank.blocks))
+            for blank in blanks]
+
+def index_blank(blank):
+    """Bring a blank's hashes and analysis up to date after its blocks have changed.
+
+    Returns the ids of any other blanks with the same pattern, however it's turned.
+    """
+    blocks = set(Block.objects.filter(blank=blank).values_list('x', 'y'))
+    blank.grid_hash = get_grid_hash(blank.size, blocks)
+    blank.pattern_hash = get_pattern_hash(blank.size, blocks)
+    Blank.objects.filter(id=blank.id).update(grid_hash=blank.grid_hash,
+                                             pattern_hash=blank.pattern_hash)
+    store_analyses({blank.grid_hash: (blank.size, blocks)})
+    return list(Blank.objects.filter(pattern_hash=blank.pattern_hash).exclude(id=blank.id)
+                .order_by('id').values_list('id', flat=True))
+
+def index_puzzle(obj):
+    """Bring a puzzle's grid hash, preview and analysis up to date after its entries change.
+
+    Returns the hash of the grid.
+    """
+    entries = list(Entry.objects.filter(puzzle=obj).order_by('y', 'x'))
+    grid_hash = update_preview(obj, entries)
+    store_analyses({grid_hash: (obj.size, get_blocks(obj, entries))})
+    return grid_hash
+
+def get_duplicate_clusters():
+    """Lists of the ids of blanks sharing a pattern, however it's turned, for every
+    pattern with more than one blank."""
+    clusters = {}
+    blanks = Blank.objects.exclude(pattern_hash='').order_by('pattern_hash', 'id')
+    for blank_id, pattern_hash in blanks.values_list('id', 'pattern_hash'):
+        clusters.setdefault(pattern_hash, []).append(blank_id)
+    return [ids for ids in clusters.values() if len(ids) > 1]
+
+def analyse_puzzles(chunk_size=200):
+    """Bring the analyses of every puzzle up to date, a chunk at a time.
+
+    Puzzles without a grid hash yet get one, along with their preview.
+    Returns the number of puzzles checked.
+    """
+    checked = 0
+    last_id = 0
+    while True:
+        chunk = list(Puzzle.objects.filter(id__gt=last_id).order_by('id')
+                     .prefetch_related('entry_set')[:chunk_size])
+        if not chunk:
+            return checked
+        grids = {}
+        for obj in chunk:
+            entries = sorted(obj.entry_set.all(), key=lambda entry: (entry.y, entry.x))
+            blocks = get_blocks(obj, entries)
+            grid_hash = get_grid_hash(obj.size, blocks)
+            if obj.grid_hash != grid_hash:
+                update_preview(obj, entries)
+            grids[grid_hash] = (obj.size, blocks)
+        store_analyses(grids)
+        checked += len(chunk)
+        last_id = chunk[-1].id
+
+def describe_symmetry(rotational, quarter_turn, mirror):
+    """Name the strongest symmetry a grid has."""
+    if quarter_turn:
+        return 'Quarter-turn symmetry'
+    if rotational:
+        return 'Rotational symmetry'
+    if mirror:
+        return 'Mirror symmetry'
+    return 'Asymmetric'
+
+def get_checked_percent(checked, unchecked):
+    """Percentage of the squares in words which are checked."""
+    in_words = checked + unchecked
+    return round(100 * checked / in_words) if in_words else 0
+
+def describe_analysis(analysis):
+    """A line summing up a grid's analysis, like 'Rotational symmetry, 28 words of 4-13
+    letters, 64% checked'."""
+    if analysis is None:
+        return ''
+    symmetry = describe_symmetry(analysis.rotational, analysis.quarter_turn, analysis.mirror)
+    lengths = [int(length) for length in analysis.lengths]
+    words = f'{analysis.words} words'
+    if lengths:
+        shortest, longest = min(lengths), max(lengths)
+        words += f' of {shortest}' + (f'-{longest}' if longest > shortest else '') + ' letters'
+    checked = get_checked_percent(analysis.checked, analysis.unchecked)
+    return f'{symmetry}, {words}, {checked}% checked'
+
+def with_analysis(queryset, *fields):
+    """Annotate blanks or puzzles with fields from their grid's analysis, prefixed 'grid_'."""
+    analyses = GridAnalysis.objects.filter(grid_hash=OuterRef('grid_hash'))
+    return queryset.annotate(**{f'grid_{field}': Subquery(analyses.values(field)[:1])
+                                for field in fields})
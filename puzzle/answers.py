@@ -0,0 +1,70 @@
+"""
+Look up the answers a setter has used before.
+
+Each entry's letters (its answer without spaces, hyphens or apostrophes, as
+it goes in the grid) and their count are generated columns, which the
+database fills in whenever an entry is written, and both are indexed. So
+checking a new puzzle's answers for reuse is a handful of index lookups, and
+finding past answers to fit a pattern only reads the index entries of that
+length, however big the catalogue gets.
+"""
+
+from re import fullmatch, sub
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from puzzle.models import Entry
+
+LETTERS_LIKE = '"puzzle_entry"."letters" LIKE %s'
+
+def get_letters(answer):
+    """An answer's letters as they go in the grid."""
+    return sub("[' -]", '', answer).upper()
+
+def find_reused_answers(user, answers, exclude_number=None):
+    """Which of the given answers a user has used before, with the puzzles and clues.
+
+    Answers which aren't filled in yet are ignored. Returns a dict of letters
+    to a list of past uses, oldest puzzle first.
+    """
+    letters = {get_letters(answer) for answer in answers} - {''}
+    letters = {word for word in letters if fullmatch('[A-Z]+', word)}
+    if not user.is_authenticated or not letters:
+        return {}
+    entries = Entry.objects.filter(puzzle__user=user, letters__in=letters)
+    if exclude_number is not None:
+        entries = entries.exclude(puzzle__number=exclude_number)
+    reused = {}
+    for row in entries.order_by('puzzle__number', 'id').values('letters', 'answer', 'clue',
+                                                               'puzzle__number'):
+        reused.setdefault(row['letters'], []).append(
+            {'number': row['puzzle__number'], 'clue': row['clue'],
+             'answer': row['answer'].upper()})
+    return reused
+
+def get_like_pattern(pattern):
+    """Turn a pattern like ?A?E into one for SQL LIKE, or None if it isn't valid.
+
+    Unknown letters can be written as ?, . or _.
+    """
+    pattern = pattern.upper()
+    if not fullmatch(r'[A-Z?._]{1,30}', pattern):
+        return None
+    return sub(r'[?.]', '_', pattern)
+
+def match_answers(user, pattern, limit=50):
+    """A user's past answers fitting a pattern, with the puzzles they were used in."""
+    like = get_like_pattern(pattern)
+    if like is None or not user.is_authenticated:
+        return []
+    entries = (Entry.objects.filter(puzzle__user=user, length=len(like))
+               .alias(matched=RawSQL(LETTERS_LIKE, [like], output_field=BooleanField()))
+               .filter(matched=True))
+    matches = {}
+    for row in entries.order_by('letters', 'puzzle__number').values('letters', 'puzzle__number'):
+        if row['letters'] not in matches:
+            if len(matches) == limit:
+                break
+            matches[row['letters']] = []
+        if row['puzzle__number'] not in matches[row['letters']]:
+            matches[row['letters']].append(row['puzzle__number'])
+    return [{'letters': letters, 'numbers': numbers} for letters, numbers in matches.items()]
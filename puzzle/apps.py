@@ -0,0 +1,13 @@
+"""
+Application configuration for puzzles.
+"""
+
+from django.apps import AppConfig
+
+class PuzzleConfig(AppConfig):
+    """Hook up signal handlers once the models are loaded."""
+    name = 'puzzle'
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel,unused-import
+        from puzzle import caching
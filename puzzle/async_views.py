@@ -0,0 +1,52 @@
+"""
+Asynchronous versions of the read-only puzzle pages.
+
+Under ASGI these replace their counterparts in views.py, so that a worker can
+get on with other requests while one is waiting on the database. Everything a
+page needs is fetched up front with the async ORM, so that rendering never
+goes back to the database from the event loop.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.gzip import gzip_page
+from puzzle.caching import HOME_DESCRIPTION, HOME_TITLE, get_home_page, get_latest_puzzle
+from puzzle.construction import adisplay_puzzle, get_puzzle_title, get_solution_title
+from puzzle.feeds import PuzzleFeed
+from puzzle.models import Puzzle
+from puzzle.prerender import serve_prerendered
+from visitors.models import aqueue_request
+
+@gzip_page
+async def latest(request):
+    """Show the latest published puzzle."""
+    if not (await request.auser()).is_authenticated:
+        content = await sync_to_async(get_home_page)()
+        await aqueue_request(request)
+        return HttpResponse(content)
+    obj = await sync_to_async(get_latest_puzzle)()
+    return await adisplay_puzzle(request, obj, HOME_TITLE, HOME_DESCRIPTION, 'puzzle/puzzle.html')
+
+@serve_prerendered(log_visit=True)
+@gzip_page
+async def puzzle(request, author, number):
+    """Show a puzzle by puzzle number."""
+    obj = await aget_object_or_404(Puzzle.objects.select_related('user'),
+                                   user__username=author, number=number)
+    title, description = get_puzzle_title(obj)
+    return await adisplay_puzzle(request, obj, title, description, 'puzzle/puzzle.html')
+
+@serve_prerendered(log_visit=True)
+@gzip_page
+async def solution(request, author, number):
+    """Show a solution by puzzle number."""
+    obj = await aget_object_or_404(Puzzle.objects.select_related('user'),
+                                   user__username=author, number=number)
+    title = get_solution_title(obj)
+    return await adisplay_puzzle(request, obj, title, title, 'puzzle/solution.html')
+
+async def rss(request):
+    """RSS feed of new puzzles, with the items fetched before the feed is built."""
+    items = [obj async for obj in PuzzleFeed.get_queryset()]
+    return PuzzleFeed(items)(request)
@@ -0,0 +1,296 @@
+"""
+Benchmark the expensive parts of the site against a synthetic catalogue.
+
+Each scenario is timed over a number of runs, and one extra run apiece counts
+its database queries and measures its peak memory allocation. Results can be
+saved as a baseline and later runs compared against it, flagging anything
+that has become slower, hungrier or chattier with the database.
+Run through manage.py benchmark, which sets up a throwaway database first.
+"""
+
+import json
+import platform
+import tracemalloc
+from io import BytesIO
+from random import Random
+from statistics import median
+from time import perf_counter
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from puzzle.admin import import_from_xml
+from puzzle.analysis import analyse_blanks, analyse_grid
+from puzzle.answers import find_reused_answers, match_answers
+from puzzle.construction import create_grid, create_thumbnail, get_clues
+from puzzle.construction import get_ipuz_entries, get_puzzle_version, save_puzzle
+from puzzle.drafts import get_draft, patch_draft
+from puzzle.models import Puzzle, Blank, Preview
+from puzzle.previews import get_blocks, update_preview
+from puzzle.printing import create_print_pdf, write_booklet
+from puzzle.progress import progress_buffer
+from puzzle.search import search_clues
+from puzzle.synthetic import make_ipuz, make_xml
+
+SCENARIOS = {}
+
+# Memory changes smaller than this are just noise
+MEMORY_SLACK = 16 * 1024
+
+def scenario(name):
+    """Register a benchmark scenario.
+
+    The decorated function does any setup and returns a function to be timed.
+    """
+    def register(setup):
+        SCENARIOS[name] = setup
+        return setup
+    return register
+
+class Environment:
+    """Sample objects from the catalogue for the scenarios to work on."""
+    def __init__(self, seed=0):
+        published = Puzzle.objects.filter(user__is_staff=True, pub_date__lte=timezone.now())
+        self.puzzle = published.select_related('user').order_by('-pub_date').first()
+        self.user = self.puzzle.user
+        self.blank = Blank.objects.order_by('id').first()
+        data = make_ipuz(Random(seed))
+        self.ipuz = json.dumps(data)
+        self.xml = make_xml(data)
+        self.client = Client()
+
+    def get_page(self, url):
+        """Function to fetch a page afresh, making sure it was served successfully."""
+        def fetch():
+            cache.clear()
+            response = self.client.get(url)
+            if response.status_code != 200:
+                raise AssertionError(f'{url} returned {response.status_code}')
+            return response
+        return fetch
+
+def rolled_back(function):
+    """Wrap a function which changes the database so that every run starts from the same data."""
+    def run():
+        with transaction.atomic():
+            function()
+            transaction.set_rollback(True)
+    return run
+
+@scenario('create_grid')
+def bench_create_grid(env):
+    """Build the grid for a puzzle."""
+    return lambda: create_grid(env.puzzle, 15)
+
+@scenario('get_clues')
+def bench_get_clues(env):
+    """List the across and down clues for a puzzle."""
+    grid = create_grid(env.puzzle, 15)
+    return lambda: (get_clues(env.puzzle, grid, False), get_clues(env.puzzle, grid, True))
+
+@scenario('create_thumbnail')
+def bench_create_thumbnail(env):
+    """Draw a blank grid for the create page."""
+    return lambda: create_thumbnail(env.blank, 10)
+
+@scenario('save_puzzle')
+def bench_save_puzzle(env):
+    """Save a puzzle from the editor over an existing one."""
+    return rolled_back(lambda: save_puzzle(env.user, env.puzzle.number, env.ipuz, True))
+
+@scenario('import_from_xml')
+def bench_import_from_xml(env):
+    """Import a puzzle from Crossword Compiler XML."""
+    def import_xml():
+        puz = Puzzle.objects.create(user=env.user, number=1000000)
+        import_from_xml(BytesIO(env.xml), puz)
+    return rolled_back(import_xml)
+
+@scenario('view_latest')
+def bench_view_latest(env):
+    """Serve the home page."""
+    return env.get_page(reverse('latest'))
+
+@scenario('view_puzzle')
+def bench_view_puzzle(env):
+    """Serve a puzzle page."""
+    return env.get_page(reverse('puzzle', args=[env.user.username, env.puzzle.number]))
+
+@scenario('view_solution')
+def bench_view_solution(env):
+    """Serve a solution page."""
+    return env.get_page(reverse('solution', args=[env.user.username, env.puzzle.number]))
+
+@scenario('view_ipuz')
+def bench_view_ipuz(env):
+    """Serve a puzzle as ipuz."""
+    url = reverse('ipuz', args=[env.user.username, env.puzzle.number])
+    return env.get_page(f'{url}?v={get_puzzle_version(env.puzzle)}')
+
+@scenario('view_archive')
+def bench_view_archive(env):
+    """Serve the archive of all setters and puzzles."""
+    return env.get_page(reverse('users'))
+
+@scenario('view_create')
+def bench_view_create(env):
+    """Serve the create page, with every blank grid."""
+    return env.get_page(reverse('create'))
+
+@scenario('view_rss')
+def bench_view_rss(env):
+    """Serve the RSS feed."""
+    return env.get_page(reverse('rss'))
+
+@scenario('view_sitemap')
+def bench_view_sitemap(env):
+    """Serve the sitemap of puzzle pages."""
+    return env.get_page(reverse('sitemap-section', kwargs={'section': 'puzzles'}))
+
+@scenario('view_puzzle_list')
+def bench_view_puzzle_list(env):
+    """Serve a page of the puzzle listing API."""
+    return env.get_page(reverse('puzzle-list') + '?limit=200')
+
+@scenario('search_clues')
+def bench_search_clues(env): #pylint: disable=unused-argument
+    """Search every clue for two words together."""
+    return lambda: search_clues('old bird')
+
+@scenario('view_search')
+def bench_view_search(env):
+    """Serve a page of clue search results."""
+    return env.get_page(reverse('search') + '?q=sailor')
+
+@scenario('find_reused_answers')
+def bench_find_reused_answers(env):
+    """Check a new puzzle's answers against everything its setter has used before."""
+    answers = [entry['answer'] for entry in get_ipuz_entries(json.loads(env.ipuz))]
+    return lambda: find_reused_answers(env.user, answers)
+
+@scenario('match_answers')
+def bench_match_answers(env):
+    """Find a setter's past answers fitting a pattern."""
+    return lambda: match_answers(env.user, '?A?E')
+
+@scenario('flush_progress')
+def bench_flush_progress(env):
+    """Write out a full batch of solvers' progress in one upsert."""
+    puzzle_ids = list(Puzzle.objects.order_by('id').values_list('id', flat=True)[:200])
+    def flush():
+        for puzzle_id in puzzle_ids:
+            progress_buffer.add(env.user.id, puzzle_id, b'ABC.' * 45)
+        progress_buffer.flush()
+    return rolled_back(flush)
+
+@scenario('patch_draft')
+def bench_patch_draft(env):
+    """Autosave a few squares and a clue from the composer, instead of saving the puzzle."""
+    draft = get_draft(env.user, env.puzzle.number)
+    draft, _ = patch_draft(env.user, env.puzzle.number, draft.version,
+                           [{'path': [], 'value': json.loads(env.ipuz)}])
+    patch = [{'path': ['solution', 0, x], 'value': 'Q'} for x in range(3)] + \
+            [{'path': ['clues', 'Across', 0, 'clue'], 'value': 'Changed'}]
+    return rolled_back(lambda: patch_draft(env.user, env.puzzle.number, draft.version, patch))
+
+@scenario('update_preview')
+def bench_update_preview(env):
+    """Draw and store the preview images for a puzzle's grid."""
+    def draw():
+        Preview.objects.all().delete()
+        update_preview(env.puzzle)
+    return rolled_back(draw)
+
+@scenario('analyse_grid')
+def bench_analyse_grid(env):
+    """Work out the symmetry, checking and word lengths of a puzzle's grid."""
+    blocks = get_blocks(env.puzzle)
+    return lambda: analyse_grid(env.puzzle.size, blocks)
+
+@scenario('analyse_blanks')
+def bench_analyse_blanks(env): #pylint: disable=unused-argument
+    """Bring the analyses of every blank grid up to date."""
+    return analyse_blanks
+
+@scenario('print_pdf')
+def bench_print_pdf(env):
+    """Lay out and write a puzzle as a page of PDF."""
+    return lambda: create_print_pdf(env.puzzle)
+
+@scenario('print_booklet')
+def bench_print_booklet(env): #pylint: disable=unused-argument
+    """Stream a booklet of 50 published puzzles to PDF."""
+    puzzles = (Puzzle.objects.filter(pub_date__lte=timezone.now()).select_related('user')
+               .prefetch_related('entry_set').order_by('id')[:50])
+    return lambda: write_booklet(puzzles.iterator(chunk_size=50), BytesIO())
+
+def measure(function, iterations):
+    """Time a function, count its queries and measure its peak memory allocation."""
+    function()
+    with CaptureQueriesContext(connection) as queries:
+        function()
+    # Count now, as later requests will clear the query log
+    query_count = len(queries)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    times = []
+    for _ in range(iterations):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return {'median': median(times), 'min': min(times), 'queries': query_count, 'memory': peak}
+
+def run_benchmarks(names=None, iterations=20, seed=0):
+    """Run some or all of the scenarios against the current database."""
+    env = Environment(seed)
+    results = {}
+    for name, setup in SCENARIOS.items():
+        if names and name not in names:
+            continue
+        results[name] = measure(setup(env), iterations)
+    return results
+
+def get_environment_info(**catalogue):
+    """Details of the machine and data a set of results came from."""
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'database': connection.vendor, **catalogue}
+
+def compare_results(results, baseline, threshold=0.2):
+    """List the regressions from a baseline.
+
+    Times and memory must grow by more than the threshold fraction to count.
+    Query counts are exact, so any increase is a regression.
+    Returns a list of (scenario, measure, baseline value, new value) tuples.
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if result['median'] > old['median'] * (1 + threshold):
+            regressions.append((name, 'median', old['median'], result['median']))
+        if result['queries'] > old['queries']:
+            regressions.append((name, 'queries', old['queries'], result['queries']))
+        if result['memory'] > old['memory'] * (1 + threshold) + MEMORY_SLACK:
+            regressions.append((name, 'memory', old['memory'], result['memory']))
+    return regressions
+
+def format_results(results, baseline=None):
+    """Table of results, with the change from the baseline if there is one."""
+    baseline = baseline or {}
+    lines = [f'{"scenario":<20} {"median ms":>10} {"min ms":>10} {"queries":>8} '
+             f'{"peak KiB":>10} {"vs baseline":>12}']
+    for name, result in results.items():
+        change = ''
+        if name in baseline and baseline[name]['median']:
+            change = f'{(result["median"] / baseline[name]["median"] - 1) * 100:+.1f}%'
+        lines.append(f'{name:<20} {result["median"] * 1000:>10.2f} {result["min"] * 1000:>10.2f} '
+                     f'{result["queries"]:>8} {result["memory"] / 1024:>10.1f} {change:>12}')
+    return '\n'.join(lines)
@@ -0,0 +1,208 @@
+"""
+Caching for pages built from the whole puzzle catalogue.
+
+Anything derived from the set of published puzzles (sitemaps, listings and
+so on) is cached under a catalogue version number. Saving or deleting a
+puzzle bumps the version, and cached entries never outlive the next
+scheduled publication, so a puzzle going live is picked up on time even
+though nothing was saved at that moment. The version lives in the cache
+when that's shared between processes. Otherwise each process would only
+see its own bumps, so the version is kept in the database and each process
+checks it every CATALOGUE_VERSION_SECONDS.
+
+The home page is cached the same way for anonymous visitors, since it only
+shows the latest puzzle. The blank grid thumbnails on the create page don't
+depend on the catalogue, so they're cached until a blank grid is changed
+instead. Each pattern is only offered once, however many blanks have it
+turned or flipped, and each thumbnail is drawn once per pattern of blocks.
+"""
+
+from functools import wraps
+from math import ceil
+from time import time
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import patch_response_headers
+from puzzle.analysis import describe_analysis, get_analyses, get_distinct_blanks
+from puzzle.construction import draw_grid_svg, get_puzzle_context
+from puzzle.models import Puzzle, Blank, Block, CatalogueVersion
+from puzzle.prerender import anonymous_request
+
+VERSION_KEY = 'catalogue-version'
+THUMBNAILS_KEY = 'create-thumbnails'
+# Backends which keep a separate cache in each process
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                'django.core.cache.backends.dummy.DummyCache')
+BLANK_STATS_KEY = 'create-blank-stats'
+HOME_TITLE = 'Three Pins - A cryptic crossword outlet'
+HOME_DESCRIPTION = 'A free interactive site dedicated to amateur cryptic crosswords. ' \
+                   'Solve online or on paper.'
+
+def cache_is_shared():
+    """Whether the cache is shared between processes, rather than private to each one."""
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES
+
+def get_stored_version():
+    """The catalogue version kept in the database, starting it if there isn't one yet."""
+    stored, _ = CatalogueVersion.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+        id=1, defaults={'version': int(time() * 1000)})
+    return stored.version
+
+def catalogue_version():
+    """Current version of the published catalogue, used to key cache entries."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        if cache_is_shared():
+            # Start from the clock so a version lost from the cache is never reused
+            cache.add(VERSION_KEY, int(time() * 1000), None)
+            version = cache.get(VERSION_KEY)
+        else:
+            # Other processes can't bump this one's cache, so check the database now and then
+            version = get_stored_version()
+            cache.set(VERSION_KEY, version, settings.CATALOGUE_VERSION_SECONDS)
+    return version
+
+def bump_catalogue_version():
+    """Invalidate everything cached against the current catalogue version."""
+    if not cache_is_shared():
+        if not CatalogueVersion.objects.filter(id=1).update(version=F('version') + 1):
+            get_stored_version()
+        cache.delete(VERSION_KEY)
+        return
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        catalogue_version()
+
+@receiver(post_save, sender=Puzzle, dispatch_uid='puzzle-catalogue-save')
+@receiver(post_delete, sender=Puzzle, dispatch_uid='puzzle-catalogue-delete')
+def invalidate_catalogue(**kwargs): #pylint: disable=unused-argument
+    """Bump the version straight away, and again once the change is visible to other requests.
+
+    The second bump stops a page rendered mid-transaction from being cached as current.
+    """
+    bump_catalogue_version()
+    transaction.on_commit(bump_catalogue_version)
+
+def catalogue_timeout():
+    """Seconds until cached catalogue data must be thrown away.
+
+    That's the configured maximum, or sooner if a scheduled puzzle is due to be published.
+    """
+    timeout = settings.CATALOGUE_CACHE_TIMEOUT
+    now = timezone.now()
+    upcoming = Puzzle.objects.filter(pub_date__gt=now).order_by('pub_date')
+    next_date = upcoming.values_list('pub_date', flat=True).first()
+    if next_date:
+        timeout = min(timeout, ceil((next_date - now).total_seconds()))
+    return max(timeout, 1)
+
+def cache_catalogue_data(name, build):
+    """Get something built from the catalogue from the cache, building it if it's not there."""
+    key = f'catalogue-data:{catalogue_version()}:{name}'
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, catalogue_timeout())
+    return data
+
+def get_latest_puzzle():
+    """The latest published puzzle, with its user."""
+    return cache_catalogue_data('latest', lambda: Puzzle.objects.select_related('user').filter(
+        user__is_staff=True, pub_date__lte=timezone.now()).latest('pub_date'))
+
+def render_home_page():
+    """The home page as anonymous visitors see it."""
+    obj = get_latest_puzzle()
+    context = get_puzzle_context(obj, AnonymousUser(), HOME_TITLE, HOME_DESCRIPTION)
+    return render_to_string('puzzle/puzzle.html', context, anonymous_request(reverse('latest')))
+
+def get_home_page():
+    """The home page for anonymous visitors, which is the same until the catalogue changes."""
+    return cache_catalogue_data('home-page', render_home_page)
+
+def get_thumbnails():
+    """SVG thumbnails of the blank grids, in the order they're offered on the create page.
+
+    Thumbnails are also cached under the hash of their pattern, so changing one
+    blank only draws that one again.
+    """
+    thumbs = cache.get(THUMBNAILS_KEY)
+    if thumbs is None:
+        blanks = get_distinct_blanks()
+        keys = ['thumbnail:' + blank.grid_hash for blank in blanks]
+        drawn = cache.get_many(keys)
+        missing = {key: draw_grid_svg(blank.size, blank.blocks, 10)
+                   for key, blank in zip(keys, blanks) if key not in drawn}
+        cache.set_many(missing, None)
+        drawn.update(missing)
+        thumbs = [drawn[key] for key in keys]
+        cache.set(THUMBNAILS_KEY, thumbs, None)
+    return thumbs
+
+def get_blank_stats():
+    """A line describing each blank grid, in the same order as the thumbnails."""
+    stats = cache.get(BLANK_STATS_KEY)
+    if stats is None:
+        stats = [describe_analysis(analysis) for analysis in get_analyses(get_distinct_blanks())]
+        cache.set(BLANK_STATS_KEY, stats, None)
+    return stats
+
+@receiver(post_save, sender=Blank, dispatch_uid='blank-thumbnails-save')
+@receiver(post_delete, sender=Blank, dispatch_uid='blank-thumbnails-delete')
+@receiver(post_save, sender=Block, dispatch_uid='block-thumbnails-save')
+@receiver(post_delete, sender=Block, dispatch_uid='block-thumbnails-delete')
+def invalidate_thumbnails(**kwargs): #pylint: disable=unused-argument
+    """Redraw the thumbnails once a change to a blank grid is visible to other requests."""
+    cache.delete_many([THUMBNAILS_KEY, BLANK_STATS_KEY])
+    transaction.on_commit(lambda: cache.delete_many([THUMBNAILS_KEY, BLANK_STATS_KEY]))
+
+def get_page_key(request):
+    """Cache key for a catalogue page, which changes with the catalogue version."""
+    return f'catalogue-page:{catalogue_version()}:{request.get_host()}{request.get_full_path()}'
+
+def store_page(key, response):
+    """Cache a freshly built catalogue page, if it's a complete, uncompressed one."""
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    if response.status_code != 200 or response.has_header('Content-Encoding'):
+        return response
+    timeout = catalogue_timeout()
+    patch_response_headers(response, timeout)
+    cache.set(key, response, timeout)
+    return response
+
+def cache_catalogue_page(view):
+    """Decorator to cache a page which is the same for every visitor until the catalogue changes.
+
+    The cache key ignores Accept-Encoding, so compress outside it, with gzip_page on top.
+    Works with both ordinary and asynchronous views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_cached_view(request, *args, **kwargs):
+            key = await sync_to_async(get_page_key)(request)
+            response = await cache.aget(key)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+                response = await sync_to_async(store_page)(key, response)
+            return response
+        return async_cached_view
+
+    @wraps(view)
+    def cached_view(request, *args, **kwargs):
+        key = get_page_key(request)
+        response = cache.get(key)
+        if response is None:
+            response = store_page(key, view(request, *args, **kwargs))
+        return response
+    return cached_view
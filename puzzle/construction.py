@@ -6,24 +6,32 @@ SVG thumbnails, and ipuz format for saving.
 """
 
 import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from re import sub, split
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth import get_user_model
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db.models import Q
 from django.shortcuts import render
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.html import escape
+from instrumentation.metrics import timed
 from puzzle.models import Puzzle, Entry, Block, default_pub_date
-from visitors.models import save_request
+from visitors.models import aqueue_request, save_request
 
-def create_grid(obj, size):
+def create_grid(obj, size, entries=None):
     """Create a 2D array describing each square of the puzzle.
 
     Each square gets a row, column, and type attribute.
     Numbered squares get a number, and light squares get a letter for the solution.
     The topmost row and leftmost column get extra markup to help render borders around the grid.
+    Entries are fetched from the database unless they've already been loaded, in row order.
     """
-    entries = Entry.objects.filter(puzzle=obj).order_by('y', 'x')
+    if entries is None:
+        entries = Entry.objects.filter(puzzle=obj).order_by('y', 'x')
     grid = []
     number = 1
 
@@ -58,13 +66,20 @@ def create_grid(obj, size):
     # All done!
     return grid
 
-def create_thumbnail(blank, square_size):
-    """Create an SVG of the blank grid."""
-    blocks = Block.objects.filter(blank=blank.id)
-    svg = f'<svg width="{blank.size * square_size}" height="{blank.size * square_size}">'
-    for y in range(blank.size):
-        for x in range(blank.size):
-            if any(b.x == x and b.y == y for b in blocks):
+def draw_grid_svg(size, blocks, square_size, standalone=False):
+    """Create an SVG of a grid's pattern, given the (x, y) squares which are blocks.
+
+    A standalone SVG has the namespace and view box it needs to be served as a file
+    of its own and scaled to any size.
+    """
+    width = size * square_size
+    svg = f'<svg width="{width}" height="{width}">'
+    if standalone:
+        svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{width}" '
+               f'viewBox="0 0 {width} {width}">')
+    for y in range(size):
+        for x in range(size):
+            if (x, y) in blocks:
                 fill = '0,0,0'
             else:
                 fill = '255,255,255'
@@ -74,47 +89,226 @@ def create_thumbnail(blank, square_size):
     svg += '</svg>'
     return svg
 
-def get_clues(obj, grid, down):
+def create_thumbnail(blank, square_size):
+    """Create an SVG of the blank grid."""
+    blocks = set(Block.objects.filter(blank=blank.id).values_list('x', 'y'))
+    return draw_grid_svg(blank.size, blocks, square_size)
+
+def get_clues(obj, grid, down, entries=None):
     """Get an array of across or down clues. Numeration is generated from the answer text."""
-    entries = Entry.objects.filter(puzzle=obj, down=down).order_by('y', 'x')
+    if entries is None:
+        entries = Entry.objects.filter(puzzle=obj, down=down).order_by('y', 'x')
+    else:
+        entries = [entry for entry in entries if entry.down == down]
     clues = []
     for entry in entries:
-        numeration = sub(r'[^ -]+', lambda m: str(len(m.group(0))), sub("'", '', entry.answer))
-        numeration = sub(' ', ',', numeration)
         clues.append({'number': grid[entry.y][entry.x]['number'], 'clue': entry.clue,
-                      'numeration': numeration, 'x': entry.x, 'y': entry.y})
+                      'numeration': get_numeration(entry.answer), 'x': entry.x, 'y': entry.y})
     return clues
 
+def get_numeration(answer):
+    """Word lengths for an answer, like '3,4' or '4-3'."""
+    numeration = sub(r'[^ -]+', lambda m: str(len(m.group(0))), sub("'", '', answer))
+    return sub(' ', ',', numeration)
+
+def get_puzzle_version(obj):
+    """Identify the current version of a puzzle, changing whenever it's edited."""
+    return f'{obj.id}-{obj.modified.strftime("%Y%m%d%H%M%S%f")}'
+
+def create_ipuz(obj):
+    """Convert a puzzle in the database to compact ipuz JSON, much as the composer would save it."""
+    grid = create_grid(obj, obj.size)
+    puzzle = []
+    solution = []
+    for row in grid:
+        puzzle.append([])
+        solution.append([])
+        for square in row:
+            if 'block' in square['type']:
+                puzzle[-1].append('#')
+                solution[-1].append('#')
+            else:
+                puzzle[-1].append(square['number'] or 0)
+                solution[-1].append(square['letter'] or 0)
+
+    clues = {}
+    for direction in [{'name': 'Across', 'down': False}, {'name': 'Down', 'down': True}]:
+        clues[direction['name']] = [{'number': c['number'], 'clue': c['clue'],
+                                     'enumeration': c['numeration']}
+                                    for c in get_clues(obj, grid, direction['down'])]
+
+    ipuz = {'version': 'http://ipuz.org/v2', 'kind': ['http://ipuz.org/crossword#1'],
+            'dimensions': {'width': obj.size, 'height': obj.size}, 'showenumerations': True,
+            'title': 'Crossword #' + str(obj.number), 'author': obj.user.username,
+            'puzzle': puzzle, 'clues': clues, 'solution': solution}
+    if obj.pub_date <= timezone.now():
+        ipuz['date'] = timezone.localtime(obj.pub_date).strftime('%m/%d/%Y')
+    return json.dumps(ipuz, separators=(',', ':'))
+
 def get_date_string(obj):
     """Helper to give the publish date in a nice British format."""
     return timezone.localtime(obj.pub_date).strftime('%d %b %Y')
 
-def display_puzzle(request, obj, title, description, template):
-    """Main helper to render a puzzle which has been pulled out of the database."""
-    now = timezone.now()
-    if obj.pub_date > now and request.user != obj.user and not request.user.is_staff:
-        raise PermissionDenied
+def get_preview_url(obj):
+    """Absolute URL of the PNG preview of a puzzle's grid, or None if it hasn't been drawn."""
+    if not obj.grid_hash:
+        return None
+    return settings.SITE_URL + reverse('preview', args=[obj.grid_hash, 'png'])
 
-    grid = create_grid(obj, 15)
-    across_clues = get_clues(obj, grid, False)
-    down_clues = get_clues(obj, grid, True)
+def build_puzzle_context(obj, title, description, entries, prev_puzzle, next_puzzle):
+    """Assemble the context for a puzzle page from data already fetched from the database."""
+    with timed('grid'):
+        grid = create_grid(obj, 15, entries)
+        across_clues = get_clues(obj, grid, False, entries)
+        down_clues = get_clues(obj, grid, True, entries)
+    return {'title': title, 'description': description, 'number': obj.number,
+            'author': obj.user.username, 'grid': grid,
+            'across_clues': across_clues, 'down_clues': down_clues,
+            'date': get_date_string(obj) if obj.pub_date <= timezone.now() else None,
+            'preview_url': get_preview_url(obj),
+            'next_puzzle': next_puzzle.number if next_puzzle else None,
+            'prev_puzzle': prev_puzzle.number if prev_puzzle else None}
 
+def get_neighbour_queries(obj, user):
+    """Querysets for the previous and next puzzles which a user is allowed to see."""
     prev_puzzle = Puzzle.objects.filter(user=obj.user, number__lt=obj.number).order_by('-number')
     next_puzzle = Puzzle.objects.filter(user=obj.user, number__gt=obj.number).order_by('number')
-    if not request.user == obj.user:
+    if not user == obj.user:
+        now = timezone.now()
         prev_puzzle = prev_puzzle.filter(pub_date__lte=now)
         next_puzzle = next_puzzle.filter(pub_date__lte=now)
+    return prev_puzzle, next_puzzle
+
+def get_puzzle_context(obj, user, title, description):
+    """Gather everything needed to render a puzzle page as seen by a particular user."""
+    entries = list(Entry.objects.filter(puzzle=obj).order_by('y', 'x'))
+    prev_puzzle, next_puzzle = get_neighbour_queries(obj, user)
+    return build_puzzle_context(obj, title, description, entries,
+                                prev_puzzle.first(), next_puzzle.first())
+
+async def aget_puzzle_context(obj, user, title, description):
+    """Asynchronous version of get_puzzle_context."""
+    entries = [entry async for entry in Entry.objects.filter(puzzle=obj).order_by('y', 'x')]
+    prev_puzzle, next_puzzle = get_neighbour_queries(obj, user)
+    return build_puzzle_context(obj, title, description, entries,
+                                await prev_puzzle.afirst(), await next_puzzle.afirst())
+
+def get_puzzle_title(obj):
+    """Page title and description for a puzzle."""
+    number = str(obj.number)
+    author = obj.user.username
+    title = 'Crossword #' + number + ' | ' + author + ' | Three Pins'
+    description = 'Crossword #' + number + 'by ' + author + ', first published on ' + \
+                  get_date_string(obj) + '.'
+    return title, description
 
-    save_request(request)
+def get_solution_title(obj):
+    """Page title for a puzzle's solution, which doubles as its description."""
+    return 'Solution #' + str(obj.number) + ' | ' + obj.user.username + ' | Three Pins'
 
-    context = {'title': title, 'description': description, 'number': obj.number,
-               'author': obj.user.username, 'grid': grid,
-               'across_clues': across_clues, 'down_clues': down_clues,
-               'date': get_date_string(obj) if obj.pub_date <= now else None,
-               'next_puzzle': next_puzzle[0].number if next_puzzle else None,
-               'prev_puzzle': prev_puzzle[0].number if prev_puzzle else None}
+def get_archive_list():
+    """List every user with published puzzles, and those puzzles, for the archive page."""
+    user_model = get_user_model()
+    user_list = []
+    for user in user_model.objects.all().order_by('username'):
+        objs = Puzzle.objects.filter(user=user, pub_date__lte=timezone.now()).order_by('-number')
+        if objs:
+            puzzle_list = []
+            for puz in objs:
+                puzzle_list.append({'number': puz.number, 'date': get_date_string(puz),
+                                    'preview': puz.grid_hash})
+            user_list.append({'name': user.username, 'puzzles': puzzle_list})
+    return user_list
+
+def display_puzzle(request, obj, title, description, template):
+    """Main helper to render a puzzle which has been pulled out of the database."""
+    if obj.pub_date > timezone.now() and request.user != obj.user and not request.user.is_staff:
+        raise PermissionDenied
+
+    context = get_puzzle_context(obj, request.user, title, description)
+    with timed('log'):
+        save_request(request)
     return render(request, template, context)
 
+async def adisplay_puzzle(request, obj, title, description, template):
+    """Asynchronous version of display_puzzle, for use under ASGI.
+
+    The puzzle must come with its user already loaded. Visits are logged in batches,
+    since a write per request would hold up the event loop's database thread.
+    """
+    user = await request.auser()
+    if obj.pub_date > timezone.now() and user != obj.user and not user.is_staff:
+        raise PermissionDenied
+
+    context = await aget_puzzle_context(obj, user, title, description)
+    # Templates must find the user already loaded, not go back to the database for it
+    request.user = user
+    with timed('log'):
+        await aqueue_request(request)
+    return render(request, template, context)
+
+LISTING_FIELDS = {
+    'author': lambda puz: puz['user__username'],
+    'number': lambda puz: puz['number'],
+    'pub_date': lambda puz: puz['pub_date'].isoformat(),
+    'modified': lambda puz: puz['modified'].isoformat(),
+    'url': lambda puz: reverse('puzzle', args=[puz['user__username'], puz['number']]),
+    'ipuz': lambda puz: reverse('ipuz', args=[puz['user__username'], puz['number']]),
+}
+
+def encode_cursor(puz):
+    """Bookmark a position in the puzzle listing, just after the given puzzle."""
+    return urlsafe_b64encode(f'{puz["pub_date"].isoformat()}|{puz["id"]}'.encode()).decode()
+
+def decode_cursor(cursor):
+    """Recover the publish date and ID from a listing bookmark."""
+    try:
+        pub_date, puzzle_id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        pub_date = parse_datetime(pub_date)
+        puzzle_id = int(puzzle_id)
+    except ValueError as err:
+        raise ValidationError('Invalid cursor') from err
+    if pub_date is None:
+        raise ValidationError('Invalid cursor')
+    return pub_date, puzzle_id
+
+def parse_listing_date(value):
+    """Read a date or date/time filter, in the site's time zone unless specified."""
+    date = parse_datetime(value) or parse_datetime(value + 'T00:00:00')
+    if date is None:
+        raise ValidationError(f'Invalid date: {value}')
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+def get_puzzle_listing(params, limit):
+    """One page of published puzzles, newest first, using keyset pagination.
+
+    Filters and the position to continue from are taken from the query parameters.
+    Returns the page of rows, each holding just the requested fields, and a cursor for the
+    next page, or None on the last one.
+    """
+    fields = params.get('fields', 'author,number,pub_date,url').split(',')
+    unknown = set(fields) - set(LISTING_FIELDS)
+    if unknown:
+        raise ValidationError(f'Unknown fields: {", ".join(sorted(unknown))}')
+
+    objs = Puzzle.objects.filter(pub_date__lte=timezone.now())
+    if 'setter' in params:
+        objs = objs.filter(user__username=params['setter'])
+    if 'since' in params:
+        objs = objs.filter(pub_date__gte=parse_listing_date(params['since']))
+    if 'until' in params:
+        objs = objs.filter(pub_date__lt=parse_listing_date(params['until']))
+    if 'cursor' in params:
+        pub_date, puzzle_id = decode_cursor(params['cursor'])
+        objs = objs.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=puzzle_id))
+
+    rows = list(objs.order_by('-pub_date', '-id')
+                .values('id', 'number', 'pub_date', 'modified', 'user__username')[:limit + 1])
+    cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [{field: LISTING_FIELDS[field](puz) for field in fields} for puz in rows[:limit]], cursor
+
 def get_or_create_user(request):
     """Authenticate or create the user specified in the POST information."""
     username = request.POST['username']
@@ -166,26 +360,36 @@ def get_answer(puzzle_data, clue, down, pos):
 
     return answer
 
+def get_ipuz_entries(puzzle_data):
+    """Extract the fields of each entry from parsed ipuz data."""
+    entries = []
+    for direction in [{'name': 'Across', 'down': False}, {'name': 'Down', 'down': True}]:
+        for entry in puzzle_data['clues'][direction['name']]:
+            pos = get_start_position(puzzle_data['puzzle'], entry['number'])
+            answer = get_answer(puzzle_data, entry, direction['down'], pos)
+            entries.append({'clue': escape(entry['clue']), 'answer': answer,
+                            'x': pos['x'], 'y': pos['y'], 'down': direction['down']})
+    return entries
+
 def save_puzzle(user, number, ipuz, public):
-    """Save a puzzle in ipuz format to the database."""
+    """Save a puzzle in ipuz format to the database.
+
+    A puzzle saved over an existing one keeps its row, so anything attached to
+    it, like solvers' progress, survives the edit. Only its entries are replaced.
+    """
     puzzle_data = json.loads(ipuz)
     pub_date = timezone.now() if public else default_pub_date()
 
-    # Remove any old data
-    existing = Puzzle.objects.filter(user=user, number=number)
-    if existing:
-        existing[0].delete()
-
-    # Create a new puzzle
-    puz = Puzzle(user=user, number=number, pub_date=pub_date,
-                 size=puzzle_data['dimensions']['width'])
+    puz = Puzzle.objects.filter(user=user, number=number).first()
+    if puz is None:
+        puz = Puzzle(user=user, number=number)
+    puz.pub_date = pub_date
+    puz.size = puzzle_data['dimensions']['width']
     puz.save()
+    Entry.objects.filter(puzzle=puz).delete()
 
-    # Extract entries from the ipuz data
-    for direction in [{'name': 'Across', 'down': False}, {'name': 'Down', 'down': True}]:
-        for entry in puzzle_data['clues'][direction['name']]:
-            pos = get_start_position(puzzle_data['puzzle'], entry['number'])
-            answer = get_answer(puzzle_data, entry, direction['down'], pos)
-            entry = Entry(puzzle=puz, clue=escape(entry['clue']), answer=answer,
-                          x=pos['x'], y=pos['y'], down=direction['down'])
-            entry.save()
+    for fields in get_ipuz_entries(puzzle_data):
+        entry = Entry(puzzle=puz, **fields)
+        entry.save()
+
+    return puz
@@ -0,0 +1,121 @@
+"""
+Autosave drafts from the composer on the server, a few changes at a time.
+
+The composer keeps its draft in local storage as ipuz, and sends the server
+patches against the last version it knows about rather than the whole
+puzzle: a list of {"path": [...], "value": ...} operations, each setting one
+square of the puzzle or solution grid, one clue, or a whole clue list (an
+empty path replaces the whole draft, for the first upload). Applying them
+means changing a few items of the stored JSON, with none of the parsing and
+rebuilding that saving a puzzle does, and the puzzle itself is untouched
+until the setter saves it.
+
+Each change bumps the draft's version, and a patch against an out of date
+version is refused so the composer can catch up and send its changes again.
+"""
+
+import json
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from puzzle.models import Draft
+
+MAX_OPERATIONS = 1000
+MAX_DRAFT_SIZE = 64 * 1024
+DRAFT_KEYS = {'puzzle', 'solution', 'clues'}
+
+def check_ipuz(ipuz):
+    """Make sure a whole draft looks enough like ipuz to be patched later."""
+    if not isinstance(ipuz, dict) or not DRAFT_KEYS <= set(ipuz) or \
+       not isinstance(ipuz['clues'], dict) or \
+       not all(isinstance(ipuz['clues'].get(direction), list) for direction in ['Across', 'Down']):
+        raise ValidationError('Draft must be ipuz with puzzle, solution and clues')
+
+def get_container(ipuz, path):
+    """Follow a path to the list or dict holding the item it ends with."""
+    target = ipuz
+    for depth, key in enumerate(path[:-1]):
+        if depth == 0 and key not in DRAFT_KEYS:
+            raise ValidationError(f'Drafts can\'t change {key}')
+        if isinstance(target, dict) and isinstance(key, str) and key in target:
+            target = target[key]
+        elif isinstance(target, list) and isinstance(key, int) and 0 <= key < len(target):
+            target = target[key]
+        else:
+            raise ValidationError(f'No such path {path}')
+    return target
+
+def apply_patch(ipuz, operations):
+    """Apply a list of operations to a draft, returning the changed draft."""
+    if not isinstance(operations, list) or len(operations) > MAX_OPERATIONS:
+        raise ValidationError('Patch must be a list of operations')
+    for operation in operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get('path'), list) or \
+           'value' not in operation:
+            raise ValidationError('Operations need a path and a value')
+        path, value = operation['path'], operation['value']
+        if not path:
+            check_ipuz(value)
+            ipuz = value
+            continue
+        if ipuz is None:
+            raise ValidationError('Nothing to patch yet')
+        container = get_container(ipuz, path)
+        key = path[-1]
+        if len(path) == 1 and key not in DRAFT_KEYS:
+            raise ValidationError(f'Drafts can\'t change {key}')
+        if isinstance(container, dict) and isinstance(key, str) and (key in container or
+                                                                     len(path) == 1):
+            container[key] = value
+        elif isinstance(container, list) and isinstance(key, int) and 0 <= key < len(container):
+            container[key] = value
+        elif isinstance(container, list) and key == len(container):
+            container.append(value)
+        else:
+            raise ValidationError(f'No such path {path}')
+    check_ipuz(ipuz)
+    if len(json.dumps(ipuz)) > MAX_DRAFT_SIZE:
+        raise ValidationError('Draft is too big')
+    return ipuz
+
+def load_draft(user, number):
+    """The version and contents of the user's draft of a puzzle, without creating one."""
+    draft = Draft.objects.filter(user=user, number=number).values('version', 'ipuz').first()
+    return (draft['version'], draft['ipuz']) if draft else (0, None)
+
+def get_draft(user, number):
+    """The user's draft of a puzzle (or a new puzzle if number is None), creating it if need be."""
+    draft = Draft.objects.filter(user=user, number=number).first()
+    if draft is None:
+        try:
+            with transaction.atomic():
+                draft = Draft.objects.create(user=user, number=number)
+        except IntegrityError:
+            # Someone else got there first
+            draft = Draft.objects.get(user=user, number=number)
+    return draft
+
+def patch_draft(user, number, version, operations):
+    """Apply a patch made against a version of a draft.
+
+    Returns the draft and whether the patch was applied. If the draft has moved on
+    from the version the patch was made against, it's returned unchanged.
+    """
+    draft = get_draft(user, number)
+    if draft.version != version:
+        return draft, False
+    ipuz = apply_patch(draft.ipuz, operations)
+    if not Draft.objects.filter(id=draft.id, version=version).update(
+            ipuz=ipuz, version=F('version') + 1, modified=timezone.now()):
+        # Changed since it was read
+        draft.refresh_from_db()
+        return draft, False
+    draft.ipuz = ipuz
+    draft.version = version + 1
+    return draft, True
+
+def clear_draft(user, number):
+    """Empty a draft once it's been saved or thrown away, keeping its version going."""
+    Draft.objects.filter(user=user, number=number, ipuz__isnull=False).update(
+        ipuz=None, version=F('version') + 1, modified=timezone.now())
@@ -3,6 +3,8 @@ Generate an RSS feed of published crosswords from staff users.
 
 Uses the built-in feed framework. There's no attempt to send the actual
 crossword, it's just a message indicating that a new one is available.
+The items can be fetched beforehand, so the feed can be built without
+touching the database (as the asynchronous view does).
 """
 
 from django.contrib.syndication.views import Feed
@@ -18,9 +20,20 @@ class PuzzleFeed(Feed):
     link = 'http://www.threepins.org'
     description = 'A cryptic crossword outlet.'
 
+    def __init__(self, items=None):
+        super().__init__()
+        self.prefetched = items
+
+    @staticmethod
+    def get_queryset():
+        """The latest few published puzzles, with their users."""
+        return Puzzle.objects.filter(user__is_staff=True, pub_date__lte=timezone.now()) \
+                             .select_related('user').order_by('-pub_date')[:5]
+
     def items(self):
-        return Puzzle.objects.filter(user__is_staff=True,
-                                     pub_date__lte=timezone.now()).order_by('-pub_date')[:5]
+        if self.prefetched is not None:
+            return self.prefetched
+        return self.get_queryset()
 
     def item_title(self, item):
         return 'Crossword #' + str(item.number)
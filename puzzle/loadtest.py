@@ -0,0 +1,316 @@
+"""
+Replay a realistic mix of traffic against a running copy of the site.
+
+Each virtual user works through a weighted random choice of actions: mostly
+the home page and puzzles, then the archive, RSS feed, create page and saving
+new puzzles (which fetches the create page for a CSRF token first, as a
+browser would). Actions are written as generators of requests, so the same
+scripts can be driven from a pool of threads or from asyncio tasks.
+Run through manage.py loadtest.
+"""
+
+import asyncio
+import gzip
+import json
+import re
+import socket
+import threading
+from collections import namedtuple
+from random import Random
+from time import monotonic, perf_counter
+from urllib.parse import urlencode, urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+from django.core.servers.basehttp import ThreadedWSGIServer
+from puzzle.synthetic import make_ipuz
+
+DEFAULT_MIX = {'latest': 30, 'puzzle': 40, 'archive': 10, 'rss': 8, 'create': 7, 'save': 5}
+
+Request = namedtuple('Request', ['kind', 'method', 'path', 'fields'])
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+Result = namedtuple('Result', ['kind', 'status', 'latency', 'error'])
+
+CSRF_FIELD = re.compile(rb'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+def parse_mix(text):
+    """Traffic mix from a string like 'latest=30,puzzle=40'."""
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f'Unknown request type {kind!r}')
+        mix[kind] = int(weight)
+    return mix
+
+def build_request(host, request, cookies):
+    """Raw HTTP for a request, asking the server to close the connection afterwards."""
+    headers = {'Host': host, 'User-Agent': 'three-pins-loadtest', 'Accept-Encoding': 'gzip',
+               'Connection': 'close'}
+    if cookies:
+        headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in cookies.items())
+    body = b''
+    if request.fields is not None:
+        body = urlencode(request.fields).encode('utf-8')
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        headers['Content-Length'] = str(len(body))
+        headers['Referer'] = f'http://{host}/create/'
+    lines = [f'{request.method} {request.path} HTTP/1.1'] + \
+            [f'{name}: {value}' for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+def parse_response(data):
+    """Status, headers and (decompressed) body of a raw HTTP response."""
+    head, _, body = data.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = []
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers.append((name.strip().lower(), value.strip()))
+    if ('content-encoding', 'gzip') in headers:
+        body = gzip.decompress(body)
+    return Response(int(lines[0].split()[1]), headers, body)
+
+class VirtualUser:
+    """One simulated visitor, with their own cookies and choice of what to do next."""
+    def __init__(self, index, mix, puzzle_paths, seed):
+        self.index = index
+        self.rng = Random(f'{seed}-{index}')
+        self.kinds = list(mix)
+        self.weights = list(mix.values())
+        self.puzzle_paths = puzzle_paths
+        self.seed = seed
+        self.cookies = {}
+
+    def update_cookies(self, response):
+        """Keep any cookies the server sets."""
+        for name, value in response.headers:
+            if name == 'set-cookie':
+                cookie, _, _ = value.partition(';')
+                key, _, cookie_value = cookie.partition('=')
+                self.cookies[key.strip()] = cookie_value.strip()
+
+    def next_action(self):
+        """Generator for the next action, which yields requests and is sent their responses."""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == 'puzzle' and not self.puzzle_paths:
+            kind = 'latest'
+        return getattr(self, 'action_' + kind)()
+
+    def action_latest(self):
+        """Visit the home page."""
+        yield Request('latest', 'GET', '/', None)
+
+    def action_puzzle(self):
+        """Visit a published puzzle, sometimes going on to its solution."""
+        path = self.rng.choice(self.puzzle_paths)
+        yield Request('puzzle', 'GET', path, None)
+        if self.rng.random() < 0.2:
+            yield Request('puzzle', 'GET', path + 'solution/', None)
+
+    def action_archive(self):
+        """Browse the archive."""
+        yield Request('archive', 'GET', '/archive/', None)
+
+    def action_rss(self):
+        """Poll the RSS feed."""
+        yield Request('rss', 'GET', '/rss/', None)
+
+    def action_create(self):
+        """Load the create page."""
+        yield Request('create', 'GET', '/create/', None)
+
+    def action_save(self):
+        """Save a new puzzle from the create page, signing up on the first save."""
+        response = yield Request('create', 'GET', '/create/', None)
+        match = CSRF_FIELD.search(response.body)
+        if match is None:
+            raise ValueError('No CSRF token on the create page')
+        username = f'loadtest{self.seed}x{self.index}'
+        fields = {'csrfmiddlewaretoken': match.group(1).decode('ascii'),
+                  'username': username, 'password': 'loadtest', 'email': '',
+                  'visibility': 'public', 'author': '', 'number': '',
+                  'ipuz': json.dumps(make_ipuz(self.rng))}
+        yield Request('save', 'POST', '/save/', fields)
+
+class Target:
+    """The site under test, and a record of every request made to it."""
+    def __init__(self, url, timeout=30):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.netloc = parts.netloc
+        self.timeout = timeout
+        self.results = []
+        self.lock = threading.Lock()
+
+    def record(self, request, status, start, error=None):
+        """Note how a request went."""
+        if error is None and status >= 400:
+            error = f'HTTP {status}'
+        with self.lock:
+            self.results.append(Result(request.kind, status, perf_counter() - start, error))
+
+    def fetch(self, request, cookies):
+        """Make a request from a thread."""
+        start = perf_counter()
+        try:
+            with socket.create_connection((self.host, self.port), self.timeout) as sock:
+                sock.sendall(build_request(self.netloc, request, cookies))
+                chunks = []
+                while chunk := sock.recv(65536):
+                    chunks.append(chunk)
+            response = parse_response(b''.join(chunks))
+        except (OSError, ValueError, IndexError, EOFError) as error:
+            self.record(request, 0, start, repr(error))
+            return None
+        self.record(request, response.status, start)
+        return response
+
+    async def afetch(self, request, cookies):
+        """Make a request from an asyncio task."""
+        start = perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            try:
+                writer.write(build_request(self.netloc, request, cookies))
+                await writer.drain()
+                data = await asyncio.wait_for(reader.read(), self.timeout)
+            finally:
+                writer.close()
+            response = parse_response(data)
+        except (OSError, ValueError, IndexError, EOFError, asyncio.TimeoutError) as error:
+            self.record(request, 0, start, repr(error))
+            return None
+        self.record(request, response.status, start)
+        return response
+
+    def find_puzzles(self):
+        """Paths of published puzzles, from the site's own listing API."""
+        response = self.fetch(Request('setup', 'GET', '/api/puzzles/?limit=200', None), {})
+        self.results.clear()
+        if response is None or response.status != 200:
+            return []
+        return [puz['url'] for puz in json.loads(response.body)['results']]
+
+def run_action_sync(user, target):
+    """Work through one action from a thread, stopping at the first failure."""
+    action = user.next_action()
+    response = None
+    try:
+        while True:
+            request = action.send(response)
+            response = target.fetch(request, user.cookies)
+            if response is None or response.status >= 400:
+                return
+            user.update_cookies(response)
+    except (StopIteration, ValueError):
+        return
+
+async def run_action_async(user, target):
+    """Work through one action from an asyncio task, stopping at the first failure."""
+    action = user.next_action()
+    response = None
+    try:
+        while True:
+            request = action.send(response)
+            response = await target.afetch(request, user.cookies)
+            if response is None or response.status >= 400:
+                return
+            user.update_cookies(response)
+    except (StopIteration, ValueError):
+        return
+
+def run_load_test(url, concurrency=10, duration=30, requests=None, mode='threads',
+                  mix=None, seed=0, timeout=30):
+    """Throw traffic at a site until the time or request count runs out.
+
+    Returns the results of every request and the time taken.
+    """
+    target = Target(url, timeout)
+    puzzle_paths = target.find_puzzles()
+    users = [VirtualUser(i, mix or DEFAULT_MIX, puzzle_paths, seed) for i in range(concurrency)]
+    deadline = monotonic() + duration
+
+    def finished():
+        return monotonic() >= deadline or (requests is not None and
+                                           len(target.results) >= requests)
+
+    start = perf_counter()
+    if mode == 'asyncio':
+        async def run_user(user):
+            while not finished():
+                await run_action_async(user, target)
+
+        async def run_all():
+            await asyncio.gather(*(run_user(user) for user in users))
+        asyncio.run(run_all())
+    else:
+        def run_user(user):
+            while not finished():
+                run_action_sync(user, target)
+
+        threads = [threading.Thread(target=run_user, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return target.results, perf_counter() - start
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of some sorted values."""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+def summarise(results, elapsed):
+    """Throughput, error rate and latency percentiles, overall and for each kind of request."""
+    def stats(group):
+        latencies = sorted(result.latency for result in group)
+        errors = sum(1 for result in group if result.error)
+        return {'requests': len(group), 'errors': errors,
+                'error_rate': errors / len(group) if group else 0,
+                'throughput': len(group) / elapsed if elapsed else 0,
+                'p50': percentile(latencies, 0.5), 'p90': percentile(latencies, 0.9),
+                'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99),
+                'max': latencies[-1] if latencies else 0}
+
+    summary = {'elapsed': elapsed, 'all': stats(results), 'kinds': {}}
+    for kind in sorted({result.kind for result in results}):
+        summary['kinds'][kind] = stats([result for result in results if result.kind == kind])
+    errors = {}
+    for result in results:
+        if result.error:
+            errors[result.error] = errors.get(result.error, 0) + 1
+    summary['error_counts'] = errors
+    return summary
+
+def format_summary(summary):
+    """Report on a load test as a table."""
+    total = summary['all']
+    lines = [f'{total["requests"]} requests in {summary["elapsed"]:.1f}s '
+             f'({total["throughput"]:.1f} req/s), {total["error_rate"] * 100:.2f}% errors', '',
+             f'{"":<10} {"requests":>8} {"req/s":>8} {"errors":>7} {"p50 ms":>8} {"p90 ms":>8} '
+             f'{"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}']
+    for name, stats in [('all', total)] + list(summary['kinds'].items()):
+        lines.append(f'{name:<10} {stats["requests"]:>8} {stats["throughput"]:>8.1f} '
+                     f'{stats["errors"]:>7} ' +
+                     ' '.join(f'{stats[key] * 1000:>8.1f}'
+                              for key in ['p50', 'p90', 'p95', 'p99', 'max']))
+    for error, count in sorted(summary['error_counts'].items(), key=lambda item: -item[1]):
+        lines.append(f'{count:>6} x {error}')
+    return '\n'.join(lines)
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler which doesn't log every request to the console."""
+    def log_message(self, format, *args): #pylint: disable=redefined-builtin
+        pass
+
+def serve_in_background(application, port=0):
+    """Serve a WSGI application from a background thread. Returns the server.
+
+    Each request gets its own thread, which closes its database connections when it's done.
+    """
+    server = make_server('127.0.0.1', port, application, ThreadedWSGIServer,
+                         QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
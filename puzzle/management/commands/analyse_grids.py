@@ -0,0 +1,23 @@
+"""
+Work out the statistics of every stored blank grid and puzzle, and list
+blanks which are copies of each other.
+"""
+
+from django.core.management.base import BaseCommand
+from puzzle.analysis import analyse_blanks, analyse_puzzles, get_duplicate_clusters
+
+class Command(BaseCommand):
+    """Bring the stored grid analyses up to date."""
+    help = 'Analyse the symmetry, checking and word lengths of every blank grid and puzzle.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Puzzles to load from the database at a time.')
+
+    def handle(self, *args, **options):
+        blanks = analyse_blanks()
+        puzzles = analyse_puzzles(options['chunk_size'])
+        self.stdout.write(f'Analysed {len(blanks)} blank grids and {puzzles} puzzles.')
+        for ids in get_duplicate_clusters():
+            self.stdout.write('Blanks with the same pattern: ' +
+                              ', '.join(str(blank_id) for blank_id in ids))
@@ -0,0 +1,20 @@
+"""
+Draw preview images for published puzzles which don't have one yet.
+"""
+
+from django.core.management.base import BaseCommand
+from puzzle.previews import backfill
+
+class Command(BaseCommand):
+    """Bring the stored grid previews up to date."""
+    help = 'Draw preview images for published puzzles which are missing them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Number of worker processes to draw with.')
+        parser.add_argument('--force', action='store_true',
+                            help='Check every published puzzle, even if it has a preview.')
+
+    def handle(self, *args, **options):
+        checked, removed = backfill(max(options['processes'], 1), options['force'])
+        self.stdout.write(f'Checked {checked} puzzles, removed {removed} unused previews.')
@@ -0,0 +1,77 @@
+"""
+Run the benchmark suite against a synthetic catalogue in a throwaway database.
+"""
+
+import json
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from puzzle.benchmarks import SCENARIOS, compare_results, format_results
+from puzzle.benchmarks import get_environment_info, run_benchmarks
+from puzzle.models import Puzzle
+from puzzle.synthetic import generate_catalogue
+
+class Command(BaseCommand):
+    """Time the expensive parts of the site and compare them with a saved baseline."""
+    help = 'Benchmark grid building, saving, importing and the main views on synthetic data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000,
+                            help='Number of users in the synthetic catalogue.')
+        parser.add_argument('--puzzles', type=int, default=20000,
+                            help='Number of puzzles in the synthetic catalogue.')
+        parser.add_argument('--blanks', type=int, default=300,
+                            help='Number of blank grids in the synthetic catalogue.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for generating the catalogue.')
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Timed runs per scenario.')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=sorted(SCENARIOS), metavar='NAME',
+                            help='Only run this scenario. May be repeated.')
+        parser.add_argument('--baseline', help='Compare with results saved in this file.')
+        parser.add_argument('--save', help='Save the results to this file as a new baseline.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Fractional slowdown or memory growth counted as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error if anything has regressed.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the benchmark database, to skip generating it next time '
+                                 '(with SQLite, the file NAME.test next to the database).')
+
+    def handle(self, *args, **options):
+        catalogue = {key: options[key] for key in ['users', 'puzzles', 'blanks', 'seed']}
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+            if baseline['environment'] != get_environment_info(**catalogue):
+                self.stderr.write('Warning: baseline came from a different machine or catalogue.')
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                           keepdb=options['keepdb'])
+        try:
+            if Puzzle.objects.count() != options['puzzles']:
+                call_command('flush', interactive=False, verbosity=0)
+                self.stdout.write('Generating catalogue...')
+                generate_catalogue(**catalogue)
+            with override_settings(PRERENDER_ROOT=None, DEBUG=False):
+                results = run_benchmarks(options['scenarios'], options['iterations'],
+                                         options['seed'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        self.stdout.write(format_results(results, baseline and baseline['results']))
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as file:
+                json.dump({'environment': get_environment_info(**catalogue),
+                           'results': results}, file, indent=2)
+
+        if baseline:
+            regressions = compare_results(results, baseline['results'], options['threshold'])
+            for name, measure, old, new in regressions:
+                self.stdout.write(f'REGRESSION {name} {measure}: {old:.6g} -> {new:.6g}')
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} regressions found.')
@@ -0,0 +1,76 @@
+"""
+Load test a running copy of the site with a realistic mix of traffic.
+"""
+
+import json
+from django.core.management.base import BaseCommand, CommandError
+from puzzle.loadtest import DEFAULT_MIX, format_summary, parse_mix, run_load_test
+from puzzle.loadtest import serve_in_background, summarise
+from puzzle.models import Puzzle
+from puzzle.synthetic import generate_catalogue
+
+class Command(BaseCommand):
+    """Replay reads, page loads and saves with many clients at once and report on the results."""
+    help = 'Load test the site, either at --url or served from this process with --serve.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help='Address of the running site to test.')
+        parser.add_argument('--serve', action='store_true',
+                            help='Serve three_pins.wsgi from this process and test that instead. '
+                                 'It shares the CPU with the load generator, so expect lower '
+                                 'figures than from a separate server.')
+        parser.add_argument('--port', type=int, default=0,
+                            help='Port to serve on with --serve (default: any free port).')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Number of simulated users making requests at once.')
+        parser.add_argument('--duration', type=float, default=30,
+                            help='Seconds to keep the load up for.')
+        parser.add_argument('--requests', type=int,
+                            help='Stop after this many requests, if it comes before the duration.')
+        parser.add_argument('--mode', choices=['threads', 'asyncio'], default='threads',
+                            help='Make concurrent requests from threads or asyncio tasks.')
+        parser.add_argument('--mix', type=parse_mix,
+                            help='Weights for each type of request, e.g. "latest=30,puzzle=40". '
+                                 f'Types are {", ".join(DEFAULT_MIX)}.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for choosing requests and generating saved puzzles.')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Seconds to wait for each response.')
+        parser.add_argument('--generate', type=int, metavar='PUZZLES',
+                            help='With --serve, fill an empty database with this many synthetic '
+                                 'puzzles first.')
+        parser.add_argument('--json', help='Also write the summary to this file.')
+
+    def handle(self, *args, **options):
+        url = options['url']
+        server = None
+        if options['serve']:
+            if options['generate'] and not Puzzle.objects.exists():
+                self.stdout.write('Generating catalogue...')
+                generate_catalogue(users=max(options['generate'] // 10, 1),
+                                   puzzles=options['generate'], blanks=50)
+            from three_pins.wsgi import application #pylint: disable=import-outside-toplevel
+            server = serve_in_background(application, options['port'])
+            url = f'http://127.0.0.1:{server.server_port}'
+        elif options['generate']:
+            raise CommandError('--generate only works with --serve.')
+
+        self.stdout.write(f'Testing {url} with {options["concurrency"]} {options["mode"]} '
+                          f'clients for up to {options["duration"]:g}s...')
+        try:
+            results, elapsed = run_load_test(
+                url, options['concurrency'], options['duration'], options['requests'],
+                options['mode'], options['mix'], options['seed'], options['timeout'])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        if not results:
+            raise CommandError(f'No requests were made. Is the site running at {url}?')
+        summary = summarise(results, elapsed)
+        self.stdout.write(format_summary(summary))
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as file:
+                json.dump(summary, file, indent=2)
@@ -0,0 +1,30 @@
+"""
+Pre-render published puzzles, solutions and the archive to static files.
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from puzzle.prerender import prerender_enabled, rebuild
+
+class Command(BaseCommand):
+    """Bring the pre-rendered pages under PRERENDER_ROOT up to date."""
+    help = 'Pre-render published puzzles whose content or neighbours have changed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', metavar='USERNAME',
+                            help='Only rebuild puzzles by this user. May be repeated.')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Number of worker processes to render with.')
+        parser.add_argument('--force', action='store_true',
+                            help='Render every page, even if it looks up to date.')
+
+    def handle(self, *args, **options):
+        if not prerender_enabled():
+            raise CommandError('Set PRERENDER_ROOT to say where pre-rendered pages should go.')
+
+        users = None
+        if options['users']:
+            users = list(get_user_model().objects.filter(username__in=options['users']))
+
+        written, removed = rebuild(users, max(options['processes'], 1), options['force'])
+        self.stdout.write(f'Rendered {len(written)} pages, removed {len(removed)} puzzles.')
@@ -0,0 +1,39 @@
+"""
+Print a run of puzzles to one PDF, a page each.
+"""
+
+import sys
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from django.utils import timezone
+from puzzle.models import Entry, Puzzle
+from puzzle.printing import write_booklet
+
+class Command(BaseCommand):
+    """Write a booklet of published puzzles, a page per puzzle."""
+    help = 'Write published puzzles to a PDF booklet, one puzzle per page.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write the PDF to, or - for standard output.')
+        parser.add_argument('--user', action='append', dest='users', metavar='USERNAME',
+                            help='Only print puzzles by this user. May be repeated.')
+        parser.add_argument('--first', type=int, help='Lowest puzzle number to print.')
+        parser.add_argument('--last', type=int, help='Highest puzzle number to print.')
+
+    def handle(self, *args, **options):
+        puzzles = Puzzle.objects.filter(pub_date__lte=timezone.now()).select_related('user')
+        if options['users']:
+            puzzles = puzzles.filter(user__username__in=options['users'])
+        if options['first'] is not None:
+            puzzles = puzzles.filter(number__gte=options['first'])
+        if options['last'] is not None:
+            puzzles = puzzles.filter(number__lte=options['last'])
+        puzzles = puzzles.order_by('user__username', 'number').prefetch_related(
+            Prefetch('entry_set', queryset=Entry.objects.order_by('y', 'x')))
+
+        if options['output'] == '-':
+            pages = write_booklet(puzzles.iterator(chunk_size=100), sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as stream:
+                pages = write_booklet(puzzles.iterator(chunk_size=100), stream)
+        self.stderr.write(f'Printed {pages} puzzles.')
@@ -0,0 +1,46 @@
+"""
+Wait for scheduled puzzles and warm everything up as they go live.
+"""
+
+from datetime import timedelta
+from time import sleep
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from puzzle.publishing import get_released, get_upcoming, get_wait, prepare, release
+
+class Command(BaseCommand):
+    """Prepare for scheduled puzzles, then pre-render and cache their pages when they go live."""
+    help = 'Warm up the caches and pre-rendered pages as scheduled puzzles are published.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, waking up for each scheduled puzzle.')
+        parser.add_argument('--lead', type=float, default=60,
+                            help='Seconds before publication to prepare a puzzle.')
+        parser.add_argument('--interval', type=float, default=300,
+                            help='Longest to sleep before checking the schedule again.')
+
+    def handle(self, *args, **options):
+        lead = options['lead']
+        # Catch anything that went live while the worker was starting up
+        since = timezone.now() - timedelta(seconds=lead)
+        prepared = None
+        while True:
+            now = timezone.now()
+            released = get_released(since, now)
+            if released:
+                paths = release(released)
+                self.stdout.write(f'Published {len(released)} puzzles, '
+                                  f'warmed up {len(paths)} pages.')
+            since = now
+
+            next_date, upcoming = get_upcoming(now)
+            if next_date is not None and next_date != prepared and \
+               (next_date - now).total_seconds() <= lead:
+                prepare(upcoming)
+                prepared = next_date
+                self.stdout.write(f'Prepared {len(upcoming)} puzzles due at {next_date}.')
+
+            if not options['loop']:
+                break
+            sleep(get_wait(timezone.now(), next_date, lead, options['interval']))
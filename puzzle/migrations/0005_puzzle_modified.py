@@ -0,0 +1,26 @@
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def copy_pub_date(apps, schema_editor): #pylint: disable=unused-argument
+    """Existing puzzles were last touched when they were published."""
+    puzzle_model = apps.get_model('puzzle', 'Puzzle')
+    puzzle_model.objects.update(modified=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0004_auto_20161014_1421'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzle',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='last modified'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_pub_date, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0005_puzzle_modified'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=models.Index(fields=['pub_date', 'id'], name='puzzle_puzz_pub_dat_abb0d3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=models.Index(fields=['user', 'pub_date', 'id'], name='puzzle_puzz_user_id_6a71d6_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def create_counters(apps, schema_editor): #pylint: disable=unused-argument
+    """Start each user's counter from their highest puzzle number."""
+    puzzle_model = apps.get_model('puzzle', 'Puzzle')
+    counter_model = apps.get_model('puzzle', 'PuzzleCounter')
+    last_numbers = puzzle_model.objects.order_by().values('user').annotate(last=Max('number'))
+    counter_model.objects.bulk_create(
+        [counter_model(user_id=row['user'], last_number=row['last']) for row in last_numbers],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('puzzle', '0006_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuzzleCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_number', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=models.Index(fields=['number'], name='puzzle_puzz_number_82f056_idx'),
+        ),
+        migrations.RunPython(create_counters, migrations.RunPython.noop),
+    ]
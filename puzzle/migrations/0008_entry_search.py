@@ -0,0 +1,60 @@
+# Full-text search index on entries, which each database keeps up to date itself
+
+from django.db import migrations
+
+
+POSTGRES_FORWARDS = [
+    "CREATE INDEX puzzle_entry_search ON puzzle_entry "
+    "USING GIN (to_tsvector('english', clue || ' ' || answer))",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS puzzle_entry_search",
+]
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE puzzle_entry_fts USING fts5(clue, answer, content='puzzle_entry', "
+    "content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER puzzle_entry_fts_insert AFTER INSERT ON puzzle_entry BEGIN "
+    "INSERT INTO puzzle_entry_fts(rowid, clue, answer) VALUES (new.id, new.clue, new.answer); "
+    "END",
+    "CREATE TRIGGER puzzle_entry_fts_delete AFTER DELETE ON puzzle_entry BEGIN "
+    "INSERT INTO puzzle_entry_fts(puzzle_entry_fts, rowid, clue, answer) "
+    "VALUES ('delete', old.id, old.clue, old.answer); "
+    "END",
+    "CREATE TRIGGER puzzle_entry_fts_update AFTER UPDATE ON puzzle_entry BEGIN "
+    "INSERT INTO puzzle_entry_fts(puzzle_entry_fts, rowid, clue, answer) "
+    "VALUES ('delete', old.id, old.clue, old.answer); "
+    "INSERT INTO puzzle_entry_fts(rowid, clue, answer) VALUES (new.id, new.clue, new.answer); "
+    "END",
+    "INSERT INTO puzzle_entry_fts(puzzle_entry_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS puzzle_entry_fts_insert",
+    "DROP TRIGGER IF EXISTS puzzle_entry_fts_delete",
+    "DROP TRIGGER IF EXISTS puzzle_entry_fts_update",
+    "DROP TABLE IF EXISTS puzzle_entry_fts",
+]
+
+
+def run_for_vendor(postgres, sqlite):
+    """Migration function running whichever statements suit the database."""
+    def run(apps, schema_editor): #pylint: disable=unused-argument
+        vendor = schema_editor.connection.vendor
+        statements = {'postgresql': postgres, 'sqlite': sqlite}.get(vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0007_puzzle_counter'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_for_vendor(POSTGRES_FORWARDS, SQLITE_FORWARDS),
+                             run_for_vendor(POSTGRES_BACKWARDS, SQLITE_BACKWARDS)),
+    ]
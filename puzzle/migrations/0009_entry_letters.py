@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:22
+
+from importlib import import_module
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# SQLite rebuilds the entry table to add generated columns, losing the triggers
+# which keep the search index up to date, so they're put back afterwards
+search = import_module('puzzle.migrations.0008_entry_search') #pylint: disable=invalid-name
+SQLITE_TRIGGERS = [statement for statement in search.SQLITE_FORWARDS
+                   if statement.startswith('CREATE TRIGGER')]
+SQLITE_DROP_TRIGGERS = [statement for statement in search.SQLITE_BACKWARDS
+                        if statement.startswith('DROP TRIGGER')]
+drop_triggers = search.run_for_vendor([], SQLITE_DROP_TRIGGERS) #pylint: disable=invalid-name
+create_triggers = search.run_for_vendor([], SQLITE_TRIGGERS) #pylint: disable=invalid-name
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0008_entry_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_triggers, create_triggers),
+        migrations.AddField(
+            model_name='entry',
+            name='length',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Length(django.db.models.functions.text.Upper(django.db.models.functions.text.Replace(django.db.models.functions.text.Replace(django.db.models.functions.text.Replace('answer', models.Value(' ')), models.Value('-')), models.Value("'")))), output_field=models.IntegerField()),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='letters',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Upper(django.db.models.functions.text.Replace(django.db.models.functions.text.Replace(django.db.models.functions.text.Replace('answer', models.Value(' ')), models.Value('-')), models.Value("'"))), output_field=models.CharField(max_length=30)),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['letters'], name='puzzle_entr_letters_22a38c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['length', 'letters'], name='puzzle_entr_length_4fc8f5_idx'),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
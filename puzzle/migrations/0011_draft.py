@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0010_solve_progress'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Draft',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField(blank=True, null=True)),
+                ('ipuz', models.JSONField(blank=True, null=True)),
+                ('version', models.IntegerField(default=0)),
+                ('modified', models.DateTimeField(auto_now=True, verbose_name='last modified')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('number__isnull', False)), fields=('user', 'number'), name='unique_puzzle_draft'), models.UniqueConstraint(condition=models.Q(('number__isnull', True)), fields=('user',), name='unique_new_puzzle_draft')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0011_draft'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Preview',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grid_hash', models.CharField(max_length=40, unique=True)),
+                ('size', models.IntegerField()),
+                ('svg', models.TextField()),
+                ('png', models.BinaryField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='puzzle',
+            name='grid_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0012_previews'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GridAnalysis',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grid_hash', models.CharField(max_length=40, unique=True)),
+                ('size', models.IntegerField()),
+                ('lights', models.IntegerField()),
+                ('words', models.IntegerField()),
+                ('checked', models.IntegerField(help_text='Squares in both an across and a down word')),
+                ('unchecked', models.IntegerField(help_text='Squares in only one word')),
+                ('rotational', models.BooleanField(help_text='Same when turned half way round')),
+                ('quarter_turn', models.BooleanField(help_text='Same when turned a quarter of the way round')),
+                ('mirror', models.BooleanField(help_text='Same when flipped left to right')),
+                ('lengths', models.JSONField(help_text='Number of words of each length')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'grid analyses',
+            },
+        ),
+        migrations.AddField(
+            model_name='blank',
+            name='grid_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0013_grid_analysis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blank',
+            name='pattern_hash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=40),
+        ),
+    ]
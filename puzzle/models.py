@@ -6,12 +6,19 @@ is unused but included in the hopes of making future extension easier.
 """
 
 from datetime import datetime
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max, Q, Value
+from django.db.models.functions import Length, Replace, Upper
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 BOOL_DOWN = ((True, 'Down'), (False, 'Across'))
+
+# An answer's letters as they go in the grid, without spaces, hyphens or apostrophes
+ANSWER_LETTERS = Upper(Replace(Replace(Replace('answer', Value(' ')), Value('-')), Value("'")))
 PUZZLE_TYPES = ((0, 'Blocked'), (1, 'Barred'))
 
 def default_user():
@@ -22,9 +29,8 @@ def default_user():
 
 def default_number():
     """Default puzzle number is one greater than the last used."""
-    if Puzzle.objects.count():
-        return Puzzle.objects.latest('number').number + 1
-    return 0
+    last = Puzzle.objects.order_by('-number').values_list('number', flat=True).first()
+    return last + 1 if last is not None else 0
 
 def default_pub_date():
     """Default publish date is way off in the future."""
@@ -40,9 +46,15 @@ class Puzzle(models.Model):
     type = models.IntegerField(default=0, choices=PUZZLE_TYPES, editable=False)
     instructions = models.TextField(blank=True, null=True, editable=False)
     comments = models.TextField(blank=True)
+    modified = models.DateTimeField('last modified', auto_now=True)
+    # Identifies the pattern of blocks, and so the preview images, once they've been drawn
+    grid_hash = models.CharField(max_length=40, blank=True, default='', editable=False)
 
     class Meta:
         unique_together = (('user', 'number'),)
+        indexes = [models.Index(fields=['pub_date', 'id']),
+                   models.Index(fields=['user', 'pub_date', 'id']),
+                   models.Index(fields=['number'])]
 
     def __str__(self):
         return str(self.user.username + ' #' + str(self.number))
@@ -51,6 +63,39 @@ class Puzzle(models.Model):
         """Link to go from the puzzle's admin page to the puzzle itself."""
         return reverse('puzzle', args=[self.user.username, self.number])
 
+class PuzzleCounter(models.Model):
+    """The last puzzle number given out to each user, so the next can be found in one step."""
+    user = models.OneToOneField(get_user_model(), models.CASCADE, primary_key=True)
+    last_number = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.last_number}'
+
+def allocate_number(user):
+    """Give out the next puzzle number for a user.
+
+    The counter row stays locked until the surrounding transaction ends, so concurrent
+    saves by the same user queue up for it rather than picking the same number.
+    """
+    with transaction.atomic():
+        if not PuzzleCounter.objects.filter(user=user).update(last_number=F('last_number') + 1):
+            # First time, so carry on from the user's existing puzzles
+            last = Puzzle.objects.filter(user=user).aggregate(last=Max('number'))['last'] or 0
+            try:
+                with transaction.atomic():
+                    PuzzleCounter.objects.create(user=user, last_number=last + 1)
+            except IntegrityError:
+                # Someone else got there first
+                PuzzleCounter.objects.filter(user=user).update(last_number=F('last_number') + 1)
+        return PuzzleCounter.objects.get(user=user).last_number
+
+@receiver(post_save, sender='puzzle.Puzzle', dispatch_uid='puzzle-counter')
+def update_counter(instance, **kwargs): #pylint: disable=unused-argument
+    """Move a user's counter past any number they've chosen for themselves."""
+    PuzzleCounter.objects.filter(user_id=instance.user_id,
+                                 last_number__lt=instance.number).update(
+                                     last_number=instance.number)
+
 class Entry(models.Model):
     """Individual clue/answer entries within a puzzle."""
     puzzle = models.ForeignKey(Puzzle, models.CASCADE)
@@ -59,17 +104,104 @@ class Entry(models.Model):
     x = models.IntegerField()
     y = models.IntegerField()
     down = models.BooleanField('direction', choices=BOOL_DOWN, default=False)
+    # Kept up to date by the database, so answers can be looked up however they were saved
+    letters = models.GeneratedField(expression=ANSWER_LETTERS,
+                                    output_field=models.CharField(max_length=30), db_persist=True)
+    length = models.GeneratedField(expression=Length(ANSWER_LETTERS),
+                                   output_field=models.IntegerField(), db_persist=True)
 
     class Meta:
         verbose_name_plural = 'entries'
+        indexes = [models.Index(fields=['letters']),
+                   models.Index(fields=['length', 'letters'])]
 
     def __str__(self):
         return self.answer
 
+class SolveProgress(models.Model):
+    """A logged in solver's letters so far, one byte per light in reading order, '.' if empty."""
+    user = models.ForeignKey(get_user_model(), models.CASCADE)
+    puzzle = models.ForeignKey(Puzzle, models.CASCADE)
+    letters = models.BinaryField(max_length=900)
+    modified = models.DateTimeField('last modified')
+
+    class Meta:
+        unique_together = (('user', 'puzzle'),)
+        verbose_name_plural = 'solve progress'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.puzzle_id}'
+
+class Draft(models.Model):
+    """Unsaved changes from the composer, so they can be picked up again on another device.
+
+    There's one per user for a new puzzle (with no number) and one per puzzle being edited.
+    The version goes up with every change and never goes back, even when the draft is cleared.
+    """
+    user = models.ForeignKey(get_user_model(), models.CASCADE)
+    number = models.IntegerField(blank=True, null=True)
+    ipuz = models.JSONField(blank=True, null=True)
+    version = models.IntegerField(default=0)
+    modified = models.DateTimeField('last modified', auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'number'], condition=Q(number__isnull=False),
+                                    name='unique_puzzle_draft'),
+            models.UniqueConstraint(fields=['user'], condition=Q(number__isnull=True),
+                                    name='unique_new_puzzle_draft'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.number if self.number is not None else "new"}'
+
+class CatalogueVersion(models.Model):
+    """Version of the published catalogue, for processes which don't share a cache."""
+    version = models.BigIntegerField()
+
+    def __str__(self):
+        return str(self.version)
+
+class Preview(models.Model):
+    """Images of a pattern of blocks, shared by every puzzle with that grid."""
+    grid_hash = models.CharField(max_length=40, unique=True)
+    size = models.IntegerField()
+    svg = models.TextField()
+    png = models.BinaryField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.grid_hash
+
+class GridAnalysis(models.Model):
+    """Statistics for a pattern of blocks, shared by every blank and puzzle with that grid."""
+    grid_hash = models.CharField(max_length=40, unique=True)
+    size = models.IntegerField()
+    lights = models.IntegerField()
+    words = models.IntegerField()
+    checked = models.IntegerField(help_text='Squares in both an across and a down word')
+    unchecked = models.IntegerField(help_text='Squares in only one word')
+    rotational = models.BooleanField(help_text='Same when turned half way round')
+    quarter_turn = models.BooleanField(help_text='Same when turned a quarter of the way round')
+    mirror = models.BooleanField(help_text='Same when flipped left to right')
+    lengths = models.JSONField(help_text='Number of words of each length')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'grid analyses'
+
+    def __str__(self):
+        return self.grid_hash
+
 class Blank(models.Model):
     """Blank grids to use as templates when creating new puzzles online."""
     size = models.IntegerField(default=15, editable=False)
     display_order = models.IntegerField(default=100)
+    # Identifies the pattern of blocks, and so its analysis, once it's been worked out
+    grid_hash = models.CharField(max_length=40, blank=True, default='', editable=False)
+    # The same for every blank with this pattern, however it's turned or flipped
+    pattern_hash = models.CharField(max_length=40, blank=True, default='', editable=False,
+                                    db_index=True)
     def __str__(self):
         return str(self.id)
 
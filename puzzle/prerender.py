@@ -0,0 +1,279 @@
+"""
+Pre-render published puzzles to static files.
+
+Published puzzles only change when they are edited or when a neighbouring
+puzzle appears or disappears, so there's no need to build them afresh on
+every request. Pages are written under PRERENDER_ROOT in a tree mirroring
+their URLs (setter/<author>/<number>/index.html, plus a gzipped copy), which
+is also the layout WhiteNoise expects if the directory is ever served
+directly. Each page has a fingerprint alongside it so that a rebuild only
+touches pages whose content would actually differ.
+
+Pre-rendered pages are served to anonymous visitors only. Logged in users
+see their own navigation and edit links, so they always get the dynamic page.
+"""
+
+import gzip
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache, wraps
+from hashlib import sha1
+import django
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.http import HttpResponse
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+from puzzle.construction import get_archive_list, get_puzzle_context
+from puzzle.construction import get_puzzle_title, get_solution_title
+from puzzle.models import Puzzle
+from visitors.models import aqueue_request, save_request
+
+FINGERPRINT_FILE = '.fingerprint'
+
+def prerender_enabled():
+    """Pre-rendering is switched on by giving it somewhere to put the files."""
+    return bool(settings.PRERENDER_ROOT)
+
+def get_page_dir(path):
+    """Directory holding the pre-rendered copy of the page at a URL path."""
+    return os.path.join(settings.PRERENDER_ROOT, *path.strip('/').split('/'))
+
+def read_fingerprint(path):
+    """Fingerprint of the existing pre-rendered page, or None if there isn't one."""
+    try:
+        with open(os.path.join(get_page_dir(path), FINGERPRINT_FILE), encoding='ascii') as file:
+            return file.read()
+    except OSError:
+        return None
+
+def replace_file(filename, data):
+    """Write a file in one step, so a request never sees it half written."""
+    temp = f'{filename}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as file:
+        file.write(data)
+    os.replace(temp, filename)
+
+def write_page(path, html, fingerprint):
+    """Store a rendered page and its fingerprint."""
+    page_dir = get_page_dir(path)
+    os.makedirs(page_dir, exist_ok=True)
+    data = html.encode('utf-8')
+    replace_file(os.path.join(page_dir, 'index.html'), data)
+    replace_file(os.path.join(page_dir, 'index.html.gz'), gzip.compress(data, mtime=0))
+    replace_file(os.path.join(page_dir, FINGERPRINT_FILE), fingerprint.encode('ascii'))
+
+def anonymous_request(path):
+    """A request for the page as an anonymous visitor would make it."""
+    request = RequestFactory().get(path)
+    request.user = AnonymousUser()
+    return request
+
+@cache
+def get_build_fingerprint():
+    """Hash the templates and the static file manifest, which change with each deployment.
+
+    Pages link to hashed static file names and are built from the templates, so
+    a deployment which changes either has to render everything again.
+    """
+    build_hash = sha1()
+    manifest = os.path.join(settings.STATIC_ROOT, 'staticfiles.json')
+    template_files = sorted(os.path.join(root, name)
+                            for engine in engines.all() for template_dir in engine.template_dirs
+                            for root, _, names in os.walk(template_dir) for name in names)
+    for filename in [manifest] + template_files:
+        try:
+            with open(filename, 'rb') as file:
+                build_hash.update(file.read())
+        except OSError:
+            continue
+    return build_hash.hexdigest()
+
+def get_fingerprint(*parts):
+    """Hash everything which affects the content of a page, including the build itself."""
+    return sha1(repr((get_build_fingerprint(),) + parts).encode('utf-8')).hexdigest()
+
+def get_published(users=None):
+    """Published puzzles with their published neighbours, optionally limited to some users.
+
+    Returns a list of (puzzle, previous number, next number) tuples.
+    """
+    objs = Puzzle.objects.filter(pub_date__lte=timezone.now()).select_related('user')
+    if users is not None:
+        objs = objs.filter(user__in=users)
+    objs = list(objs.order_by('user', 'number'))
+
+    published = []
+    for i, obj in enumerate(objs):
+        prev_obj = objs[i - 1] if i > 0 and objs[i - 1].user_id == obj.user_id else None
+        next_obj = objs[i + 1] if i + 1 < len(objs) and objs[i + 1].user_id == obj.user_id \
+                   else None
+        published.append((obj, prev_obj.number if prev_obj else None,
+                           next_obj.number if next_obj else None))
+    return published
+
+def get_puzzle_pages(obj, prev_number, next_number):
+    """URL path and fingerprint of the puzzle and solution pages for a published puzzle."""
+    fingerprint = get_fingerprint(obj.id, obj.modified.isoformat(), obj.pub_date.isoformat(),
+                                  obj.grid_hash, prev_number, next_number)
+    author = obj.user.username
+    return [(reverse('puzzle', args=[author, obj.number]), fingerprint),
+            (reverse('solution', args=[author, obj.number]), fingerprint)]
+
+def get_neighbours(obj):
+    """A puzzle with the numbers of its published neighbours, as listed by get_published."""
+    published = Puzzle.objects.filter(user=obj.user, pub_date__lte=timezone.now())
+    prev_obj = published.filter(number__lt=obj.number).order_by('-number').first()
+    next_obj = published.filter(number__gt=obj.number).order_by('number').first()
+    return obj, prev_obj.number if prev_obj else None, next_obj.number if next_obj else None
+
+def render_puzzle(puzzle_id):
+    """Render the puzzle and solution pages for one puzzle. Returns the paths written."""
+    obj = Puzzle.objects.select_related('user').get(id=puzzle_id)
+    anon = AnonymousUser()
+    paths = []
+    for (path, fingerprint), template in zip(get_puzzle_pages(*get_neighbours(obj)),
+                                             ['puzzle/puzzle.html', 'puzzle/solution.html']):
+        if template == 'puzzle/puzzle.html':
+            title, description = get_puzzle_title(obj)
+        else:
+            title = description = get_solution_title(obj)
+        context = get_puzzle_context(obj, anon, title, description)
+        write_page(path, render_to_string(template, context, anonymous_request(path)),
+                   fingerprint)
+        paths.append(path)
+    return paths
+
+def render_puzzle_batch(puzzle_ids):
+    """Render a batch of puzzles in a worker process."""
+    return [path for puzzle_id in puzzle_ids for path in render_puzzle(puzzle_id)]
+
+def init_worker():
+    """Make sure Django is ready in a freshly started worker process."""
+    django.setup()
+
+def render_archive():
+    """Render the archive page if the list of published puzzles has changed."""
+    path = reverse('users')
+    user_list = get_archive_list()
+    fingerprint = get_fingerprint(user_list)
+    if read_fingerprint(path) == fingerprint:
+        return []
+    html = render_to_string('puzzle/users.html', {'user_list': user_list}, anonymous_request(path))
+    write_page(path, html, fingerprint)
+    return [path]
+
+def get_author_dir(author):
+    """Directory holding all of an author's pre-rendered puzzles."""
+    return os.path.dirname(get_page_dir(reverse('puzzle', args=[author, 0])))
+
+def remove_stale(live_paths, users=None):
+    """Delete pre-rendered puzzles which are no longer published. Returns the paths removed."""
+    if users is not None:
+        authors = [user.username for user in users]
+    else:
+        setter_dir = os.path.dirname(get_author_dir('x'))
+        authors = os.listdir(setter_dir) if os.path.isdir(setter_dir) else []
+
+    removed = []
+    for author in authors:
+        author_dir = get_author_dir(author)
+        if not os.path.isdir(author_dir):
+            continue
+        for number in os.listdir(author_dir):
+            path = reverse('puzzle', args=[author, number])
+            if path not in live_paths:
+                shutil.rmtree(os.path.join(author_dir, number), ignore_errors=True)
+                removed.append(path)
+    return removed
+
+def rebuild(users=None, processes=1, force=False):
+    """Bring the pre-rendered pages up to date.
+
+    Only puzzles whose fingerprint has changed are rendered, unless force is set.
+    The rebuild can be limited to particular users' puzzles, and spread across
+    several processes for a full rebuild. Returns the paths written and removed.
+    """
+    live_paths = set()
+    stale_ids = []
+    for obj, prev_number, next_number in get_published(users):
+        pages = get_puzzle_pages(obj, prev_number, next_number)
+        live_paths.update(path for path, _ in pages)
+        if force or any(read_fingerprint(path) != fingerprint for path, fingerprint in pages):
+            stale_ids.append(obj.id)
+
+    if processes > 1 and len(stale_ids) > 1:
+        # Connections can't be shared with the worker processes
+        connections.close_all()
+        batches = [stale_ids[i::processes] for i in range(processes)]
+        with ProcessPoolExecutor(processes, initializer=init_worker) as pool:
+            written = [path for paths in pool.map(render_puzzle_batch, batches) for path in paths]
+    else:
+        written = render_puzzle_batch(stale_ids)
+
+    written += render_archive()
+    return written, remove_stale(live_paths, users)
+
+def rebuild_for_user(user):
+    """Post-publish hook to refresh a user's puzzles and the archive after a save."""
+    if prerender_enabled():
+        rebuild(users=[user])
+
+def read_prerendered(request):
+    """Response holding the pre-rendered copy of the requested page, or None if there isn't one."""
+    gzipped = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    filename = os.path.join(get_page_dir(request.path),
+                            'index.html.gz' if gzipped else 'index.html')
+    try:
+        with open(filename, 'rb') as file:
+            response = HttpResponse(file.read())
+    except OSError:
+        return None
+
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding, Cookie'
+    return response
+
+def is_prerenderable(request):
+    """Whether a request could be answered from a pre-rendered page, before checking the user."""
+    return prerender_enabled() and request.method == 'GET' and not request.GET
+
+def serve_prerendered(log_visit=False):
+    """Decorator to serve anonymous visitors the pre-rendered copy of a page if there is one.
+
+    Anything else falls back to the view itself. Set log_visit for views which
+    would normally record the request in the visitor log. Works with both
+    ordinary and asynchronous views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_prerendered_view(request, *args, **kwargs):
+                if is_prerenderable(request) and not (await request.auser()).is_authenticated:
+                    response = await sync_to_async(read_prerendered,
+                                                   thread_sensitive=False)(request)
+                    if response is not None:
+                        if log_visit:
+                            await aqueue_request(request)
+                        return response
+                return await view(request, *args, **kwargs)
+            return async_prerendered_view
+
+        @wraps(view)
+        def prerendered_view(request, *args, **kwargs):
+            if is_prerenderable(request) and not request.user.is_authenticated:
+                response = read_prerendered(request)
+                if response is not None:
+                    if log_visit:
+                        save_request(request)
+                    return response
+            return view(request, *args, **kwargs)
+        return prerendered_view
+    return decorator
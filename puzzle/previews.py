@@ -0,0 +1,128 @@
+"""
+Draw preview images of puzzles' grids for social media cards and the archive.
+
+A preview shows only the pattern of blocks, never any answers, so puzzles
+sharing a grid share a preview: each one is stored once, under a hash of
+the pattern, as an SVG for the archive and a PNG for sites which don't show
+SVG. A puzzle keeps the hash of its grid, so a preview is only drawn when a
+puzzle is saved with a grid nobody has used before, and editing the clues
+never redraws anything. Preview URLs contain the hash, so they can be cached
+forever. The PNG is written by hand, since it's only ever black and white
+squares.
+
+Puzzles saved before previews existed, or imported through the admin, can
+be brought up to date with manage.py backfill_previews.
+"""
+
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from django.db import connections
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from puzzle.construction import create_grid, draw_grid_svg
+from puzzle.models import Preview, Puzzle
+from puzzle.prerender import init_worker
+
+SVG_SQUARE = 10
+PNG_SQUARE = 20
+
+def get_blocks(obj, entries=None):
+    """The (x, y) squares of a puzzle which are blocks."""
+    grid = create_grid(obj, obj.size, entries)
+    return {(square['col'], square['row']) for row in grid for square in row
+            if 'block' in square['type']}
+
+def get_pattern(size, blocks):
+    """A grid's pattern of blocks as a string, with # for a block and . for a light."""
+    return ''.join('#' if (x, y) in blocks else '.' for y in range(size) for x in range(size))
+
+def hash_pattern(size, pattern):
+    """Hash a pattern of blocks from get_pattern."""
+    return sha1(f'{size}:{pattern}'.encode('ascii')).hexdigest()
+
+def get_grid_hash(size, blocks):
+    """Identify a pattern of blocks."""
+    return hash_pattern(size, get_pattern(size, blocks))
+
+def png_chunk(kind, data):
+    """One chunk of a PNG file, with its length and checksum."""
+    return struct.pack('>I', len(data)) + kind + data + \
+           struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+def draw_grid_png(size, blocks, square_size):
+    """Create a greyscale PNG of a grid's pattern, with a one pixel border round every square."""
+    width = size * square_size + 1
+    rows = []
+    for y in range(size):
+        line = b''.join(b'\x00' * square_size if (x, y) in blocks else
+                        b'\x00' + b'\xff' * (square_size - 1) for x in range(size)) + b'\x00'
+        # Each row of pixels starts with a filter byte of 0 (none)
+        rows.append(b'\x00' + b'\x00' * width)
+        rows += [b'\x00' + line] * (square_size - 1)
+    rows.append(b'\x00' + b'\x00' * width)
+    header = struct.pack('>IIBBBBB', width, width, 8, 0, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) +
+            png_chunk(b'IDAT', zlib.compress(b''.join(rows), 9)) + png_chunk(b'IEND', b''))
+
+def update_preview(obj, entries=None):
+    """Make sure a puzzle's preview matches its grid, drawing it if nobody has yet.
+
+    Returns the hash of the grid.
+    """
+    blocks = get_blocks(obj, entries)
+    grid_hash = get_grid_hash(obj.size, blocks)
+    if not Preview.objects.filter(grid_hash=grid_hash).exists():
+        # Another puzzle may be drawing the same grid at the same time
+        Preview.objects.bulk_create([Preview(
+            grid_hash=grid_hash, size=obj.size,
+            svg=draw_grid_svg(obj.size, blocks, SVG_SQUARE, standalone=True),
+            png=draw_grid_png(obj.size, blocks, PNG_SQUARE))], ignore_conflicts=True)
+    if obj.grid_hash != grid_hash:
+        Puzzle.objects.filter(id=obj.id).update(grid_hash=grid_hash)
+        obj.grid_hash = grid_hash
+    return grid_hash
+
+def update_preview_batch(puzzle_ids):
+    """Bring the previews for a batch of puzzles up to date in a worker process.
+
+    Returns the number of puzzles checked.
+    """
+    objs = list(Puzzle.objects.filter(id__in=puzzle_ids).prefetch_related('entry_set'))
+    for obj in objs:
+        entries = sorted(obj.entry_set.all(), key=lambda entry: (entry.y, entry.x))
+        update_preview(obj, entries)
+    return len(objs)
+
+def backfill(processes=1, force=False, batch_size=200):
+    """Draw previews for published puzzles which don't have one.
+
+    With force, every published puzzle's grid is checked again. Work is spread
+    across several processes if asked. Previews which no puzzle uses any more
+    are deleted. Returns the number of puzzles checked and previews deleted.
+    """
+    puzzles = Puzzle.objects.filter(pub_date__lte=timezone.now())
+    if not force:
+        puzzles = puzzles.exclude(Exists(Preview.objects.filter(grid_hash=OuterRef('grid_hash'))))
+    puzzle_ids = list(puzzles.order_by('id').values_list('id', flat=True))
+    batches = [puzzle_ids[i:i + batch_size] for i in range(0, len(puzzle_ids), batch_size)]
+
+    if processes > 1 and len(batches) > 1:
+        # Connections can't be shared with the worker processes
+        connections.close_all()
+        with ProcessPoolExecutor(processes, initializer=init_worker) as pool:
+            checked = sum(pool.map(update_preview_batch, batches))
+    else:
+        checked = sum(update_preview_batch(batch) for batch in batches)
+
+    used = Puzzle.objects.filter(grid_hash=OuterRef('grid_hash'))
+    unused = Preview.objects.exclude(Exists(used))
+    removed, _ = unused.delete()
+    return checked, removed
+
+def get_preview_image(grid_hash, extension):
+    """The SVG or PNG of a stored preview, or None if there isn't one."""
+    field = 'svg' if extension == 'svg' else 'png'
+    data = Preview.objects.filter(grid_hash=grid_hash).values_list(field, flat=True).first()
+    return bytes(data) if isinstance(data, memoryview) else data
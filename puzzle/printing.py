@@ -0,0 +1,269 @@
+"""
+Render puzzles for printing, as SVG or PDF.
+
+A puzzle is laid out once as a list of shapes on an A4 page: the title, the
+grid squares and their numbers, and the clues wrapped into two columns
+underneath, shrinking the text until they fit. The shapes are then written
+out as SVG, or as a page of PDF. PDF is written by hand with the standard
+Helvetica fonts, so nothing needs installing, and a PdfWriter only ever holds
+one page at a time, which lets a booklet of any number of puzzles be streamed
+straight out to a file.
+"""
+
+import zlib
+from html import unescape
+from io import BytesIO
+from django.utils import timezone
+from django.utils.html import strip_tags
+from puzzle.construction import create_grid, get_clues, get_date_string
+from puzzle.models import Entry
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 40
+TITLE_SIZE = 14
+GRID_WIDTH = 300
+MAX_SQUARE = 22
+COLUMN_GAP = 20
+COLUMN_WIDTH = (PAGE_WIDTH - 2 * MARGIN - COLUMN_GAP) / 2
+FONT_SIZES = [9, 8.5, 8, 7.5, 7, 6.5, 6]
+# Helvetica's average character width, as a fraction of the font size
+CHAR_WIDTH = 0.52
+# Space between lines of clues, and for the clue numbers, as fractions of the font size
+LEADING = 1.25
+NUMBER_WIDTH = 2
+
+def get_clue_text(clue):
+    """Plain text of a clue, which is stored as HTML."""
+    return unescape(strip_tags(f'{clue["clue"]} ({clue["numeration"]})'))
+
+def wrap_text(text, width, size):
+    """Split text into lines which fit a width in points."""
+    max_chars = max(int(width / (size * CHAR_WIDTH)), 1)
+    lines = []
+    line = ''
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > max_chars:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}' if line else word
+    if line:
+        lines.append(line)
+    return lines or ['']
+
+def get_clue_rows(across, down, width, size):
+    """Lines of the clues as (number, text) rows, wrapped to fit a column.
+
+    Headings have a number of None, and lines carried over from the line above
+    have an empty one.
+    """
+    rows = []
+    for heading, clues in [('Across', across), ('Down', down)]:
+        if rows:
+            rows.append(('', ''))
+        rows.append((None, heading))
+        for clue in clues:
+            lines = wrap_text(get_clue_text(clue), width, size)
+            rows.append((str(clue['number']), lines[0]))
+            rows += [('', line) for line in lines[1:]]
+    return rows
+
+def place_clue_rows(rows, top, size, lines_per_column):
+    """Shapes for rows of clues, filling the first column before running on to the second."""
+    shapes = []
+    for index, (number, text) in enumerate(rows):
+        column, line = divmod(index, lines_per_column)
+        x = MARGIN + column * (COLUMN_WIDTH + COLUMN_GAP)
+        y = top + (line + 1) * (size * LEADING)
+        if number is None:
+            shapes.append(('text', x, y, size, text, True))
+            continue
+        if number:
+            shapes.append(('text', x, y, size, number, True))
+        if text:
+            shapes.append(('text', x + size * NUMBER_WIDTH, y, size, text, False))
+    return shapes
+
+def layout_clues(across, down, top, size, overflow=False):
+    """Lay out the clues in two columns below the grid.
+
+    Returns None if they don't fit, unless overflow is set, when the second
+    column just runs on down the page.
+    """
+    rows = get_clue_rows(across, down, COLUMN_WIDTH - size * NUMBER_WIDTH, size)
+    lines_per_column = int((PAGE_HEIGHT - MARGIN - top) / (size * LEADING))
+    if len(rows) > 2 * lines_per_column:
+        if not overflow:
+            return None
+        lines_per_column = (len(rows) + 1) // 2
+    return place_clue_rows(rows, top, size, lines_per_column)
+
+def get_print_title(obj):
+    """Heading for the printed puzzle, with its date once it's published."""
+    title = f'Crossword #{obj.number} by {obj.user.username}'
+    if obj.pub_date <= timezone.now():
+        title += ', ' + get_date_string(obj)
+    return title
+
+def layout_grid(grid, size, top):
+    """Shapes for the squares of the grid and their numbers, centred across the page.
+
+    Returns the shapes and the height of the grid.
+    """
+    square = min(GRID_WIDTH / size, MAX_SQUARE)
+    left = (PAGE_WIDTH - square * size) / 2
+    shapes = []
+    for row in grid:
+        for cell in row:
+            x, y = left + cell['col'] * square, top + cell['row'] * square
+            shapes.append(('rect', x, y, square, square, cell['type'] == 'block'))
+            if cell['number']:
+                shapes.append(('text', x + 1.5, y + square * 0.3, square * 0.28,
+                               str(cell['number']), False))
+    return shapes, square * size
+
+def get_print_layout(obj, entries=None):
+    """Shapes to draw a puzzle on a page: ('rect', x, y, w, h, filled) or
+    ('text', x, baseline y, size, text, bold), measured in points from the top left."""
+    if entries is None:
+        entries = list(Entry.objects.filter(puzzle=obj).order_by('y', 'x'))
+    grid = create_grid(obj, obj.size, entries)
+    top = MARGIN + TITLE_SIZE * 2
+    grid_shapes, grid_height = layout_grid(grid, obj.size, top)
+    shapes = [('text', MARGIN, MARGIN + TITLE_SIZE, TITLE_SIZE, get_print_title(obj), True)]
+    shapes += grid_shapes
+
+    across = get_clues(obj, grid, False, entries)
+    down = get_clues(obj, grid, True, entries)
+    clue_top = top + grid_height + TITLE_SIZE
+    for size in FONT_SIZES:
+        clue_shapes = layout_clues(across, down, clue_top, size)
+        if clue_shapes is not None:
+            return shapes + clue_shapes
+    # Better to lose the last few clues off the bottom of the page than the whole puzzle
+    return shapes + layout_clues(across, down, clue_top, FONT_SIZES[-1], overflow=True)
+
+def escape_xml(text):
+    """Make text safe to put in SVG."""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def render_svg(shapes):
+    """Draw shapes as an SVG document the size of a page."""
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="210mm" height="297mm" '
+           f'viewBox="0 0 {PAGE_WIDTH} {PAGE_HEIGHT}" '
+           f'font-family="Helvetica, Arial, sans-serif">')
+    svg += f'<rect width="{PAGE_WIDTH}" height="{PAGE_HEIGHT}" style="fill:rgb(255,255,255)" />'
+    for kind, x, y, *rest in shapes:
+        if kind == 'rect':
+            width, height, filled = rest
+            fill = '0,0,0' if filled else '255,255,255'
+            svg += f'<rect x="{x:g}" y="{y:g}" width="{width:g}" height="{height:g}" '
+            svg += f'style="fill:rgb({fill});stroke-width:0.5;stroke:rgb(0,0,0)" />'
+        else:
+            size, text, bold = rest
+            weight = ' font-weight="bold"' if bold else ''
+            svg += f'<text x="{x:g}" y="{y:g}" font-size="{size:g}"{weight}>'
+            svg += f'{escape_xml(text)}</text>'
+    svg += '</svg>'
+    return svg
+
+def escape_pdf(text):
+    """Encode text for a PDF string in one of the standard fonts."""
+    data = text.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+def render_pdf_page(shapes):
+    """Draw shapes as the content stream of a PDF page."""
+    ops = [b'0.5 w']
+    for kind, x, y, *rest in shapes:
+        if kind == 'rect':
+            width, height, filled = rest
+            fill = b'0 g' if filled else b'1 g'
+            ops.append(fill + f' {x:g} {PAGE_HEIGHT - y - height:g} {width:g} {height:g} re B'
+                       .encode('ascii'))
+        else:
+            size, text, bold = rest
+            font = b'/F2' if bold else b'/F1'
+            ops.append(b'0 g BT ' + font + f' {size:g} Tf {x:g} {PAGE_HEIGHT - y:g} Td ('
+                       .encode('ascii') + escape_pdf(text) + b') Tj ET')
+    return b'\n'.join(ops)
+
+class PdfWriter:
+    """Write a PDF to a binary stream a page at a time.
+
+    Objects 1 to 4 are the catalogue, the page tree and the two fonts, which are
+    written at the end once every page is known. Only the pages' object numbers
+    and the offset of each object are kept until then.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.offsets = {}
+        self.pages = []
+        self.position = 0
+        self.next_id = 5
+        self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def write(self, data):
+        """Write some bytes, keeping track of where in the file we are."""
+        self.stream.write(data)
+        self.position += len(data)
+
+    def write_object(self, object_id, body):
+        """Write out a numbered object."""
+        self.offsets[object_id] = self.position
+        self.write(f'{object_id} 0 obj\n'.encode('ascii') + body + b'\nendobj\n')
+
+    def add_page(self, content):
+        """Write out a page with the given content stream."""
+        content = zlib.compress(content)
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.write_object(content_id, f'<< /Length {len(content)} /Filter /FlateDecode >>\n'
+                          .encode('ascii') + b'stream\n' + content + b'\nendstream')
+        self.write_object(page_id, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode('ascii'))
+        self.pages.append(page_id)
+
+    def close(self):
+        """Finish off the document with the page tree and cross-reference table."""
+        for font_id, font in [(3, 'Helvetica'), (4, 'Helvetica-Bold')]:
+            self.write_object(font_id, (f'<< /Type /Font /Subtype /Type1 /BaseFont /{font} '
+                                        f'/Encoding /WinAnsiEncoding >>').encode('ascii'))
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.pages)
+        self.write_object(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>'
+                          .encode('ascii'))
+        self.write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref = self.position
+        lines = [f'xref\n0 {self.next_id}\n', '0000000000 65535 f \n']
+        lines += [f'{self.offsets[object_id]:010d} 00000 n \n'
+                  for object_id in range(1, self.next_id)]
+        self.write(''.join(lines).encode('ascii'))
+        self.write(f'trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'
+                   .encode('ascii'))
+
+def create_print_svg(obj):
+    """An SVG of a puzzle to print."""
+    return render_svg(get_print_layout(obj))
+
+def create_print_pdf(obj):
+    """A one page PDF of a puzzle to print."""
+    stream = BytesIO()
+    write_booklet([obj], stream)
+    return stream.getvalue()
+
+def write_booklet(puzzles, stream):
+    """Write a PDF with a page for each puzzle, returning the number of pages.
+
+    Puzzles can come from an iterator, and each page is written out before the next
+    puzzle is laid out, so the whole booklet is never held in memory.
+    """
+    writer = PdfWriter(stream)
+    for puz in puzzles:
+        # Use the entries if they've been prefetched along with the puzzles
+        entries = sorted(puz.entry_set.all(), key=lambda entry: (entry.y, entry.x))
+        writer.add_page(render_pdf_page(get_print_layout(puz, entries)))
+    writer.close()
+    return len(writer.pages)
@@ -0,0 +1,169 @@
+"""
+Keep logged in solvers' progress on the server, so it follows them between devices.
+
+Progress is the same string of letters the grid keeps in local storage, one
+per light in reading order with '.' for an empty square, stored a byte per
+square. The grid sends it a few seconds after the solver stops typing, and
+the server holds the latest state for each solver and puzzle in memory,
+writing them all out in one bulk upsert once there are enough of them or
+they're old enough (PROGRESS_BATCH_SIZE and PROGRESS_BATCH_SECONDS). So a
+solver typing a whole answer costs one request, and any number of solvers
+cost a write per batch. A background thread in each worker writes out a
+batch which has waited long enough even if nobody sends any more progress,
+and a solver loading a puzzle has their waiting progress written out first.
+
+Progress waiting in one worker's buffer isn't visible to other workers until
+it's written out, but since the grid keeps its own copy in local storage,
+the worst that can happen is another device being a few seconds behind.
+"""
+
+import atexit
+import logging
+from re import fullmatch
+from threading import Lock, Thread
+from time import monotonic, sleep
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from puzzle.models import Puzzle, SolveProgress
+
+logger = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+MAX_UPDATES = 20
+
+def pack_letters(letters, size):
+    """Check a string of letters from the grid and pack it into bytes, or return None."""
+    if not isinstance(letters, str) or not fullmatch(r'[A-Z.]+', letters) or \
+       len(letters) > size * size:
+        return None
+    return letters.encode('ascii')
+
+def unpack_letters(packed):
+    """The string of letters for the grid from packed bytes."""
+    return bytes(packed).decode('ascii')
+
+class ProgressBuffer:
+    """Collect the latest progress for each solver and puzzle, and write it out in batches."""
+    def __init__(self):
+        self.lock = Lock()
+        # Keeps batches in order, so older progress never overwrites newer
+        self.flush_lock = Lock()
+        self.pending = {}
+        self.started = monotonic()
+        self.timer = None
+
+    def add(self, user_id, puzzle_id, packed):
+        """Queue up some progress, replacing anything queued for the same puzzle.
+
+        Returns True if the batch is due to be written out.
+        """
+        with self.lock:
+            if not self.pending:
+                self.started = monotonic()
+            self.pending[(user_id, puzzle_id)] = (packed, timezone.now())
+            # Started here rather than at import, so it runs in each forked worker
+            if self.timer is None or not self.timer.is_alive():
+                self.timer = Thread(target=self.run_timer, name='progress-flush', daemon=True)
+                self.timer.start()
+            return len(self.pending) >= settings.PROGRESS_BATCH_SIZE or self.is_old()
+
+    def is_old(self):
+        """Whether the oldest progress waiting has waited long enough. Call with the lock held."""
+        return bool(self.pending) and \
+               monotonic() - self.started >= settings.PROGRESS_BATCH_SECONDS
+
+    def run_timer(self):
+        """Write out progress once it has waited long enough, even if no more arrives."""
+        while True:
+            sleep(max(settings.PROGRESS_BATCH_SECONDS / 2, 0.1))
+            with self.lock:
+                due = self.is_old()
+            if not due:
+                continue
+            try:
+                self.flush()
+            except Exception: #pylint: disable=broad-except
+                logger.exception('Failed to write out solve progress')
+            finally:
+                # This thread's connection would otherwise stay open for good
+                connection.close()
+
+    def get(self, user_id, puzzle_id):
+        """Progress waiting to be written out, if there is any."""
+        with self.lock:
+            pending = self.pending.get((user_id, puzzle_id))
+        return pending[0] if pending else None
+
+    def flush(self):
+        """Write out everything queued so far in one upsert."""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if pending:
+                self.write(pending)
+
+    @staticmethod
+    def write(pending):
+        """Upsert a batch of progress."""
+        # Skip puzzles deleted in the meantime, which would fail the whole batch
+        puzzle_ids = {puzzle_id for _, puzzle_id in pending}
+        puzzle_ids = set(Puzzle.objects.filter(id__in=puzzle_ids).values_list('id', flat=True))
+        SolveProgress.objects.bulk_create(
+            [SolveProgress(user_id=user_id, puzzle_id=puzzle_id, letters=packed, modified=modified)
+             for (user_id, puzzle_id), (packed, modified) in pending.items()
+             if puzzle_id in puzzle_ids],
+            update_conflicts=True, unique_fields=['user', 'puzzle'],
+            update_fields=['letters', 'modified'], batch_size=500)
+
+progress_buffer = ProgressBuffer() #pylint: disable=invalid-name
+atexit.register(progress_buffer.flush)
+
+def get_solvable_puzzles(user, keys):
+    """Look up puzzles by (author, number), keeping those the user can see."""
+    if not keys:
+        return {}
+    match = Q()
+    for author, number in keys:
+        match |= Q(user__username=author, number=number)
+    puzzles = Puzzle.objects.filter(match).filter(Q(pub_date__lte=timezone.now()) | Q(user=user))
+    puzzles = puzzles.select_related('user').only('number', 'size', 'user__username')
+    return {(puz.user.username, puz.number): puz for puz in puzzles}
+
+def save_progress(user, updates):
+    """Queue up progress from the grid, a list of dicts with author, number and letters.
+
+    Returns how many updates were accepted. Anything for a puzzle the user can't
+    see, or with letters which don't make sense, is ignored.
+    """
+    parsed = []
+    for update in updates[:MAX_UPDATES]:
+        try:
+            parsed.append(((str(update['author']), int(update['number'])), update.get('letters')))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            continue
+    puzzles = get_solvable_puzzles(user, {key for key, _ in parsed})
+    saved = 0
+    due = False
+    for key, letters in parsed:
+        puz = puzzles.get(key)
+        packed = pack_letters(letters, puz.size) if puz else None
+        if packed is not None:
+            due = progress_buffer.add(user.id, puz.id, packed) or due
+            saved += 1
+    if due:
+        progress_buffer.flush()
+    return saved
+
+def load_progress(user, author, number):
+    """The user's latest progress in a puzzle as a string of letters, or None."""
+    puzzles = get_solvable_puzzles(user, [(author, number)])
+    puz = puzzles.get((author, number))
+    if puz is None:
+        return None
+    if progress_buffer.get(user.id, puz.id) is not None:
+        # Write it out now, in case this worker goes away before the batch is due
+        progress_buffer.flush()
+    packed = SolveProgress.objects.filter(user=user, puzzle=puz).values_list(
+        'letters', flat=True).first()
+    return unpack_letters(packed) if packed is not None else None
@@ -0,0 +1,102 @@
+"""
+Get the site ready for scheduled puzzles as they go live.
+
+Nothing happens at a puzzle's publication date by itself: cached catalogue
+pages simply expire, and the first visitors afterwards pay for rebuilding
+them all at once. The publish worker (manage.py publish_worker) sleeps
+until the next publication date instead. A little beforehand it prepares
+whatever can't give the puzzle away early, like its ipuz data and preview
+image. Once the puzzle is live it pre-renders the new pages and warms the
+home page, archive, RSS feed, sitemaps and listing, so the rush of visitors
+finds them all ready.
+
+Warming only helps the web workers if they share the worker's cache, so
+set CACHE_BACKEND to something other than the default in-process cache.
+"""
+
+import logging
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from puzzle.caching import bump_catalogue_version, get_home_page
+from puzzle.construction import create_ipuz, get_puzzle_version
+from puzzle.models import Puzzle, default_pub_date
+from puzzle.prerender import prerender_enabled, rebuild
+from puzzle.previews import update_preview
+from puzzle.sitemaps import SITEMAPS
+from puzzle.warmup import warm_up
+
+logger = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+def get_upcoming(now):
+    """The next publication date after now, and the puzzles due then, or (None, [])."""
+    scheduled = Puzzle.objects.filter(pub_date__gt=now, pub_date__lt=default_pub_date())
+    next_date = scheduled.order_by('pub_date').values_list('pub_date', flat=True).first()
+    if next_date is None:
+        return None, []
+    return next_date, list(Puzzle.objects.filter(pub_date=next_date).select_related('user'))
+
+def prepare(puzzles):
+    """Get ready for puzzles which are about to go live, without showing them to anyone yet."""
+    for obj in puzzles:
+        update_preview(obj)
+        cache.set('ipuz:' + get_puzzle_version(obj), create_ipuz(obj), 60 * 60 * 24)
+
+def get_warm_paths():
+    """Paths of the catalogue pages which are cached for every anonymous visitor."""
+    paths = [reverse('rss'), reverse('sitemap'), reverse('puzzle-list')]
+    paths += [reverse('sitemap-section', args=[section]) for section in SITEMAPS]
+    return paths
+
+def fetch(path):
+    """Request a page as an anonymous visitor, straight from its view, so it gets cached."""
+    host = settings.SITE_URL.split('://')[-1].split('/')[0]
+    request = RequestFactory(HTTP_HOST=host).get(path)
+    match = resolve(path)
+    view = match.func
+    if iscoroutinefunction(view):
+        return async_to_sync(view)(request, *match.args, **match.kwargs)
+    return view(request, *match.args, **match.kwargs)
+
+def get_released(since, now):
+    """Puzzles published after since, up to and including now."""
+    return list(Puzzle.objects.filter(pub_date__gt=since, pub_date__lte=now)
+                .select_related('user').order_by('pub_date', 'id'))
+
+def release(puzzles):
+    """Warm everything up for puzzles which have just gone live.
+
+    Returns the paths of the pages which were pre-rendered or cached.
+    """
+    if not puzzles:
+        return []
+    bump_catalogue_version()
+    paths = []
+    if prerender_enabled():
+        written, _ = rebuild(users={obj.user for obj in puzzles})
+        paths += written
+    warm_up()
+    get_home_page()
+    paths.append(reverse('latest'))
+    for path in get_warm_paths():
+        try:
+            if fetch(path).status_code == 200:
+                paths.append(path)
+        except Exception: #pylint: disable=broad-except
+            logger.exception('Failed to warm up %s', path)
+    return paths
+
+def get_wait(now, next_date, lead, interval):
+    """Seconds to sleep before the worker next has something to do.
+
+    That's when the next puzzle needs preparing, then when it goes live, but
+    never more than interval, so newly scheduled puzzles are noticed.
+    """
+    if next_date is None:
+        return interval
+    until_live = (next_date - now).total_seconds()
+    if until_live > lead:
+        return min(until_live - lead, interval)
+    return min(max(until_live, 0), interval)
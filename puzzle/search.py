@@ -0,0 +1,84 @@
+"""
+Full-text search over the clues and answers of published puzzles.
+
+Postgres matches against a GIN index of each entry's clue and answer, and
+SQLite against an FTS5 table (see migration 0008). Both are kept up to date
+by the database itself, so entries are searchable as soon as they're saved,
+whether by save_puzzle, the admin importers or a bulk load. Any other
+database falls back to a substring match, which reads every entry.
+
+Results come newest entry first, since the primary key and the FTS5 index
+can both be read in that order and stop at the end of the page, without
+sorting every match. Pages continue from the last entry ID seen, so fetching
+one costs the same however far in it is.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from functools import reduce
+from operator import and_
+from re import findall
+from django.core.exceptions import ValidationError
+from django.db import connections, router
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from puzzle.construction import get_numeration
+from puzzle.models import Entry
+
+POSTGRES_MATCH = ("to_tsvector('english', \"puzzle_entry\".\"clue\" || ' ' || "
+                  "\"puzzle_entry\".\"answer\") @@ plainto_tsquery('english', %s)")
+SQLITE_MATCH = 'SELECT rowid FROM puzzle_entry_fts WHERE puzzle_entry_fts MATCH %s'
+
+def get_terms(query):
+    """Words to search for, ignoring punctuation and anything which could upset the index."""
+    return findall(r'\w+', query.lower())
+
+def encode_cursor(entry_id):
+    """Bookmark a position in the results, just after the given entry."""
+    return urlsafe_b64encode(str(entry_id).encode()).decode()
+
+def decode_cursor(cursor):
+    """Recover the entry ID from a results bookmark."""
+    try:
+        return int(urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, DecodeError) as err:
+        raise ValidationError('Invalid cursor') from err
+
+def match_entries(entries, terms):
+    """Narrow down entries to those whose clue or answer contains every term."""
+    vendor = connections[router.db_for_read(Entry)].vendor
+    if vendor == 'postgresql':
+        return entries.alias(matched=RawSQL(POSTGRES_MATCH, [' '.join(terms)],
+                                            output_field=BooleanField())).filter(matched=True)
+    if vendor == 'sqlite':
+        fts_query = ' '.join(f'"{term}"' for term in terms)
+        return entries.filter(id__in=RawSQL(SQLITE_MATCH, [fts_query]))
+    return entries.filter(reduce(and_, [Q(clue__icontains=term) | Q(answer__icontains=term)
+                                        for term in terms]))
+
+def search_clues(query, cursor=None, limit=20):
+    """One page of entries from published puzzles matching a query, most recent first.
+
+    Returns the results and a cursor for the next page, if there is one.
+    """
+    terms = get_terms(query)
+    if not terms:
+        return [], None
+    entries = Entry.objects.filter(puzzle__pub_date__lte=timezone.now())
+    entries = match_entries(entries, terms)
+    if cursor:
+        entries = entries.filter(id__lt=decode_cursor(cursor))
+    rows = list(entries.order_by('-id')
+                .values('id', 'clue', 'answer', 'down', 'puzzle__number', 'puzzle__pub_date',
+                        'puzzle__user__username')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last['id'])
+    results = [{'clue': row['clue'], 'answer': row['answer'].upper(),
+                'numeration': get_numeration(row['answer']),
+                'direction': 'down' if row['down'] else 'across',
+                'author': row['puzzle__user__username'], 'number': row['puzzle__number'],
+                'pub_date': row['puzzle__pub_date']} for row in rows[:limit]]
+    return results, next_cursor
@@ -0,0 +1,37 @@
+"""
+Sitemaps listing every published puzzle and solution.
+
+Crawlers can pick up the whole catalogue from one cached document instead of
+following the previous/next links from puzzle to puzzle. Each section is split
+into pages so that large catalogues are fetched in chunks.
+"""
+
+from django.contrib.sitemaps import Sitemap
+from django.urls import reverse
+from django.utils import timezone
+from puzzle.models import Puzzle
+
+class PuzzleSitemap(Sitemap):
+    """Links to published puzzles."""
+    #pylint: disable=missing-docstring
+
+    limit = 2000
+    url_name = 'puzzle'
+
+    def items(self):
+        return Puzzle.objects.filter(pub_date__lte=timezone.now()).select_related('user') \
+                             .only('number', 'modified', 'user__username') \
+                             .order_by('pub_date', 'id')
+
+    def location(self, item): #pylint: disable=arguments-differ
+        return reverse(self.url_name, args=[item.user.username, item.number])
+
+    def lastmod(self, item):
+        return item.modified
+
+class SolutionSitemap(PuzzleSitemap):
+    """Links to the solutions of published puzzles."""
+    url_name = 'solution'
+    priority = 0.2
+
+SITEMAPS = {'puzzles': PuzzleSitemap, 'solutions': SolutionSitemap}
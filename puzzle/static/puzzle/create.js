@@ -165,10 +165,35 @@ var GridCreator = (function() {
 var Suggestor = (function() {
 	var box;
 	var wordList = null;
+	var pastAnswersUrl;
 	var re;
 	var pattern;
 	var requestId = 0;
 
+	var showPastAnswers = function(answers) {
+		if (!answers.length)
+			return;
+
+		var used = answers.map(function(answer) {
+			return answer.letters + ' (#' + answer.numbers.join(', #') + ')';
+		});
+		var warning = document.createElement('span');
+		ClassShim.addClass(warning, 'warning');
+		warning.textContent = 'YOU\'VE USED: ' + used.join(', ');
+		warning.appendChild(document.createElement('br'));
+		box.insertBefore(warning, box.firstChild);
+	};
+
+	var loadPastAnswers = function(req) {
+		var xhttp = new XMLHttpRequest();
+		xhttp.onload = function() {
+			if (req == requestId && xhttp.status == 200)
+				showPastAnswers(JSON.parse(xhttp.responseText).answers);
+		};
+		xhttp.open('GET', pastAnswersUrl + '?pattern=' + encodeURIComponent(pattern));
+		xhttp.send();
+	};
+
 	var appendClearButton = function(clearHandler) {
 		var clearButton = document.createElement('span');
 		clearButton.textContent = '--CLEAR--';
@@ -234,6 +259,8 @@ var Suggestor = (function() {
 
 				re = new RegExp('^' + pattern.replace(/./g, '$&\\W?') + '$', 'gim');
 				var count = appendSuggestions(max, requestId, clickHandler);
+				if (pastAnswersUrl)
+					loadPastAnswers(requestId);
 
 				if (count == 0) {
 					var warning = document.createElement('span');
@@ -257,10 +284,19 @@ var Suggestor = (function() {
 			xhttp.send();
 		},
 
-		// Test hook
+		setPastAnswersUrl: function(url) {
+			pastAnswersUrl = url;
+		},
+
+		// Test hooks
 		_setWordList: function(w) {
 			wordList = w.split('$');
 		},
+
+		_showPastAnswers: function(suggestionBox, answers) {
+			box = suggestionBox;
+			showPastAnswers(answers);
+		},
 	};
 })();
 
@@ -504,12 +540,18 @@ var Display = (function() {
 			clearGridBox();
 			document.getElementById('blanks').style.display = 'inline-block';
 			document.getElementById('choose-grid-message').style.display = 'block';
+			document.getElementById('grid-stats').textContent = '';
 		},
 
 		hideBlanks: function() {
 			clearGridBox();
 			document.getElementById('blanks').style.display = 'none';
 			document.getElementById('choose-grid-message').style.display = 'none';
+			document.getElementById('grid-stats').textContent = '';
+		},
+
+		showGridStats: function(text) {
+			document.getElementById('grid-stats').textContent = text;
 		},
 
 		showEditControls: function() {
@@ -543,8 +585,174 @@ var Display = (function() {
 })();
 
 
+/* Autosave the draft on the server, sending only what has changed since the last version it has. */
+var DraftSync = function(url, csrfToken, number, versionName) {
+	var DELAY = 3000;
+	var MAX_DELAY = 15000;
+	var synced = null;
+	var version = 0;
+	var pending = null;
+	var inFlight = false;
+	var firstQueued = null;
+	var timer = null;
+
+	var diffGrid = function(name, before, after, patch) {
+		if (before.length != after.length)
+			return false;
+
+		for (var y = 0; y < after.length; y++) {
+			if (before[y].length != after[y].length)
+				return false;
+			for (var x = 0; x < after[y].length; x++) {
+				if (before[y][x] !== after[y][x])
+					patch.push({path: [name, y, x], value: after[y][x]});
+			}
+		}
+
+		return true;
+	};
+
+	var diff = function(before, after) {
+		if (!before)
+			return [{path: [], value: after}];
+
+		var patch = [];
+		if (!diffGrid('puzzle', before.puzzle, after.puzzle, patch) ||
+			!diffGrid('solution', before.solution, after.solution, patch))
+			return [{path: [], value: after}];
+
+		['Across', 'Down'].forEach(function(direction) {
+			var oldClues = before.clues[direction];
+			var newClues = after.clues[direction];
+			if (oldClues.length != newClues.length) {
+				patch.push({path: ['clues', direction], value: newClues});
+				return;
+			}
+
+			for (var i = 0; i < newClues.length; i++) {
+				if (JSON.stringify(oldClues[i]) !== JSON.stringify(newClues[i]))
+					patch.push({path: ['clues', direction, i], value: newClues[i]});
+			}
+		});
+
+		return patch;
+	};
+
+	var post = function(data, callback) {
+		data.append('csrfmiddlewaretoken', csrfToken);
+		data.append('number', number || '');
+		var xhttp = new XMLHttpRequest();
+		xhttp.onload = function() {
+			var ok = xhttp.status == 200 || xhttp.status == 409;
+			callback(xhttp.status, ok ? JSON.parse(xhttp.responseText) : null);
+		};
+		xhttp.onerror = function() {
+			callback(0, null);
+		};
+		xhttp.open('POST', url);
+		xhttp.send(data);
+	};
+
+	var setVersion = function(newVersion) {
+		version = newVersion;
+		if (window.localStorage)
+			localStorage.setItem(versionName, version);
+	};
+
+	var send = function() {
+		window.clearTimeout(timer);
+		timer = null;
+		firstQueued = null;
+		if (inFlight || pending === null)
+			return;
+
+		var target = pending;
+		var patch = diff(synced, target);
+		pending = null;
+		if (!patch.length)
+			return;
+
+		var data = new FormData();
+		data.append('version', version);
+		data.append('patch', JSON.stringify(patch));
+		inFlight = true;
+		post(data, function(status, response) {
+			inFlight = false;
+			if (status == 200) {
+				synced = target;
+				setVersion(response.version);
+			} else if (status == 409) {
+				// Changed somewhere else since, so patch the latest version instead
+				synced = response.ipuz;
+				version = response.version;
+				pending = pending || target;
+				send();
+				return;
+			} else {
+				pending = pending || target;
+				return;
+			}
+
+			if (pending !== null)
+				send();
+		});
+	};
+
+	this.getLocalVersion = function() {
+		return window.localStorage ? +localStorage.getItem(versionName) || 0 : 0;
+	};
+
+	this.load = function(callback) {
+		var xhttp = new XMLHttpRequest();
+		xhttp.onload = function() {
+			if (xhttp.status != 200)
+				return;
+
+			var response = JSON.parse(xhttp.responseText);
+			synced = response.ipuz;
+			version = response.version;
+			callback(response.ipuz, response.version);
+		};
+		xhttp.open('GET', url + '?number=' + (number || ''));
+		xhttp.send();
+	};
+
+	this.queue = function(ipuz) {
+		var now = Date.now();
+		pending = ipuz;
+		if (firstQueued === null)
+			firstQueued = now;
+
+		window.clearTimeout(timer);
+		timer = window.setTimeout(send, Math.max(0, Math.min(DELAY, firstQueued + MAX_DELAY - now)));
+	};
+
+	this.discard = function() {
+		window.clearTimeout(timer);
+		pending = null;
+		if (window.localStorage)
+			localStorage.removeItem(versionName);
+
+		var data = new FormData();
+		data.append('csrfmiddlewaretoken', csrfToken);
+		data.append('number', number || '');
+		data.append('discard', '1');
+		if (navigator.sendBeacon)
+			navigator.sendBeacon(url, data);
+		else
+			post(data, function() {});
+	};
+
+	window.addEventListener('pagehide', send);
+
+	// Test hook
+	this._diff = diff;
+};
+
+
 var Storage = (function() {
 	var storageName = 'create';
+	var draftSync;
 
 	var createIpuz = function(size, puzzle, solution, acrossClues, downClues) {
 		var ipuz = {
@@ -576,6 +784,13 @@ var Storage = (function() {
 			if (window.localStorage) {
 				localStorage.setItem(storageName, json);
 			}
+
+			if (draftSync)
+				draftSync.queue(JSON.parse(json));
+		},
+
+		setDraftSync: function(sync) {
+			draftSync = sync;
 		},
 
 		loadLocal: function() {
@@ -586,6 +801,8 @@ var Storage = (function() {
 
 		clearLocal: function() {
 			localStorage.removeItem(storageName);
+			if (draftSync)
+				draftSync.discard();
 			return true;
 		},
 	};
@@ -600,6 +817,7 @@ var PuzzleCreator = (function() {
 	var showIntro;
 	var grid;
 	var saveUrl;
+	var reusedAnswersUrl;
 
 	var suggestionAccepted = function(suggestion) {
 		grid.setActiveEntry(suggestion.replace(/[^A-Z]/g, ''));
@@ -711,10 +929,14 @@ var PuzzleCreator = (function() {
 		Display.showBlanks();
 
 		var thumbs = document.getElementsByTagName('svg');
+		var statsData = document.getElementById('blank-stats');
+		var stats = statsData ? JSON.parse(statsData.textContent) : [];
 		for (var i = 0; i < thumbs.length; i++) {
+			thumbs[i].setAttribute('data-stats', stats[i] || '');
 			thumbs[i].addEventListener('mouseenter', function() {
 				Display.clearGridBox();
 				GridCreator.createBlankGrid(this, gridBox, blockImgUrl);
+				Display.showGridStats(this.getAttribute('data-stats'));
 			});
 
 			thumbs[i].addEventListener('mouseleave', Display.showBlanks);
@@ -727,7 +949,7 @@ var PuzzleCreator = (function() {
 	};
 
 	return {
-		init: function(wordListUrl, blockImgUrl, saveLocation, storage) {
+		init: function(wordListUrl, blockImgUrl, saveLocation, storage, answerUrls, draft) {
 			gridBox = document.getElementById('grid');
 			suggestionBox = document.getElementById('suggestions');
 			clueLists = document.getElementById('clues').getElementsByTagName('ul');
@@ -735,6 +957,10 @@ var PuzzleCreator = (function() {
 
 			grid = new GridModule.Grid(15, gridChangeListener);
 			Suggestor.loadWordList(wordListUrl);
+			if (answerUrls) {
+				Suggestor.setPastAnswersUrl(answerUrls.past);
+				reusedAnswersUrl = answerUrls.reused;
+			}
 			ClueCreator.registerListeners(clueSelected, clueChanged);
 
 			if (saveLocation) {
@@ -751,6 +977,21 @@ var PuzzleCreator = (function() {
 				editPuzzle();
 			else
 				loadGridPicker(blockImgUrl);
+
+			if (draft) {
+				var sync = new DraftSync(draft.url, draft.csrfToken, draft.number, (storage || 'create') + '-version');
+				sync.load(function(ipuz, version) {
+					Storage.setDraftSync(sync);
+					if (ipuz && version > sync.getLocalVersion()) {
+						// Carry on from changes made on another device
+						Display.hideBlanks();
+						restorePuzzle(ipuz, blockImgUrl);
+						Storage.saveLocal(grid, clueLists);
+					} else if (saved || saveLocation) {
+						Storage.saveLocal(grid, clueLists);
+					}
+				});
+			}
 		},
 
 		printPuzzle: function() {
@@ -784,6 +1025,33 @@ var PuzzleCreator = (function() {
 			}
 		},
 
+		showSaveForm: function() {
+			Display.showSaveForm();
+			var message = document.getElementById('reused-answers');
+			message.style.display = 'none';
+			if (!reusedAnswersUrl)
+				return;
+
+			var xhttp = new XMLHttpRequest();
+			xhttp.onload = function() {
+				if (xhttp.status != 200)
+					return;
+
+				var reused = JSON.parse(xhttp.responseText).reused;
+				var lines = Object.keys(reused).sort().map(function(letters) {
+					return letters + ': ' + reused[letters].map(function(use) {
+						return '#' + use.number + ' "' + use.clue + '"';
+					}).join(', ');
+				});
+				if (lines.length) {
+					message.textContent = 'You\'ve used these answers before - ' + lines.join('; ');
+					message.style.display = 'block';
+				}
+			};
+			xhttp.open('POST', reusedAnswersUrl);
+			xhttp.send(new FormData(document.getElementById('save-form')));
+		},
+
 		validateSaveForm: function() {
 			var username = document.getElementById('save-username');
 			if (username && (username.value == null || username.value == '')) {
@@ -92,6 +92,7 @@ var GridModule = (function() {
 	function Grid(size, changeListener) {
 		var grid = [];
 		var storageName;
+		var progressSync;
 		var active = new Entry();
 		active.clear();
 
@@ -372,26 +373,30 @@ var GridModule = (function() {
 				changeListener('text');
 		};
 
+		var getLetters = function() {
+			var letters = '';
+			iterateLights(function(x, y) {
+				var text = getLetter(x, y);
+				letters += text.length ? text : '.';
+			});
+
+			return letters;
+		};
+
 		var saveLetters = function() {
-			if (window.localStorage && storageName) {
-				var letters = '';
-				var nonEmpty = false;
-
-				iterateLights(function(x, y) {
-					var text = getLetter(x, y);
-					if (text.length) {
-						letters += text;
-						nonEmpty = true;
-					} else {
-						letters += '.';
-					}
-				});
+			if (!storageName)
+				return;
 
-				if (nonEmpty)
+			var letters = getLetters();
+			if (window.localStorage) {
+				if (letters.search('[^\\.]') != -1)
 					localStorage.setItem(storageName, letters);
 				else
 					localStorage.removeItem(storageName);
 			}
+
+			if (progressSync)
+				progressSync.queue(letters);
 		};
 
 		this.loadLetters = function() {
@@ -408,6 +413,33 @@ var GridModule = (function() {
 			}
 		};
 
+		/* Fill in empty squares from progress saved elsewhere, and send back anything it was missing. */
+		this.mergeLetters = function(letters) {
+			var i = 0;
+			var merged = false;
+			iterateLights(function(x, y) {
+				if (letters[i] && letters[i] !== '.' && !getLetter(x, y).length) {
+					setLetter(x, y, letters[i]);
+					merged = true;
+				}
+				i++;
+			});
+
+			var current = getLetters();
+			if (current !== letters && current.search('[^\\.]') != -1)
+				saveLetters();
+			else if (merged && window.localStorage && storageName)
+				localStorage.setItem(storageName, current);
+		};
+
+		this.syncProgress = function(sync) {
+			var self = this;
+			progressSync = sync;
+			sync.load(function(letters) {
+				self.mergeLetters(letters || '');
+			});
+		};
+
 		this.deleteTargetLetter = function(backpedal) {
 			clearTargetLetter(backpedal);
 			saveLetters();
@@ -632,6 +664,62 @@ var GridModule = (function() {
 		};
 	}
 
+	/* Send a logged in solver's progress to the server, a few seconds after they stop typing
+	 * (or at most every so often while they keep going), and whatever's left when they leave the page.
+	 */
+	var SYNC_DELAY = 3000;
+	var SYNC_MAX_DELAY = 15000;
+
+	function ProgressSync(url, csrfToken, author, number) {
+		var pending = null;
+		var firstQueued = null;
+		var timer = null;
+
+		var send = function(leaving) {
+			window.clearTimeout(timer);
+			timer = null;
+			firstQueued = null;
+			if (pending === null)
+				return;
+
+			var data = new FormData();
+			data.append('csrfmiddlewaretoken', csrfToken);
+			data.append('progress', JSON.stringify([{author: author, number: number, letters: pending}]));
+			pending = null;
+
+			if (leaving && navigator.sendBeacon) {
+				navigator.sendBeacon(url, data);
+			} else {
+				var xhttp = new XMLHttpRequest();
+				xhttp.open('POST', url);
+				xhttp.send(data);
+			}
+		};
+
+		this.queue = function(letters) {
+			var now = Date.now();
+			pending = letters;
+			if (firstQueued === null)
+				firstQueued = now;
+
+			window.clearTimeout(timer);
+			timer = window.setTimeout(send, Math.max(0, Math.min(SYNC_DELAY, firstQueued + SYNC_MAX_DELAY - now)));
+		};
+
+		this.load = function(callback) {
+			var xhttp = new XMLHttpRequest();
+			xhttp.onload = function() {
+				callback(xhttp.status == 200 ? JSON.parse(xhttp.responseText).letters : null);
+			};
+			xhttp.open('GET', url + '?author=' + encodeURIComponent(author) + '&number=' + number);
+			xhttp.send();
+		};
+
+		window.addEventListener('pagehide', function() {
+			send(true);
+		});
+	}
+
 	/* The Android soft keyboard is spectacularly painful to work with.
 	 * - It doesn't provide keypress events.
 	 * - It provides keydown events but no keycode (except for number keys, bizarrely).
@@ -814,9 +902,85 @@ var GridModule = (function() {
 		div.appendChild(solutionButton);
 	};
 
+	/* Build the grid squares and clue lists from ipuz data, matching the server-rendered page. */
+	var renderClues = function(list, clues) {
+		for (var i = 0; i < clues.length; i++) {
+			var li = document.createElement('li');
+			li.innerHTML = '<span class="clue-number">' + clues[i].number + '</span> ' +
+				clues[i].clue + ' (' + clues[i].enumeration + ')';
+			list.appendChild(li);
+		}
+	};
+
+	var renderIpuz = function(data, container, acrossList, downList, blockImg) {
+		var size = data.dimensions.width;
+		for (var y = 0; y < size; y++) {
+			for (var x = 0; x < size; x++) {
+				var cell = data.puzzle[y][x];
+				var sq = document.createElement('div');
+				sq.setAttribute('data-x', x);
+				sq.setAttribute('data-y', y);
+
+				if (cell === '#') {
+					ClassShim.addClass(sq, 'block');
+					if (blockImg) {
+						var img = document.createElement('img');
+						img.src = blockImg;
+						img.alt = 'block';
+						sq.appendChild(img);
+					}
+				} else {
+					ClassShim.addClass(sq, 'light');
+					if (data.solution[y][x])
+						sq.setAttribute('data-a', data.solution[y][x]);
+					if (cell) {
+						var gn = document.createElement('div');
+						ClassShim.addClass(gn, 'grid-number');
+						gn.innerHTML = cell;
+						sq.appendChild(gn);
+					}
+				}
+
+				if (y === 0)
+					ClassShim.addClass(sq, 'topmost');
+				if (x === 0)
+					ClassShim.addClass(sq, 'leftmost');
+				container.appendChild(sq);
+			}
+		}
+
+		renderClues(acrossList, data.clues.Across);
+		renderClues(downList, data.clues.Down);
+	};
+
+	/* ipuz dates are mm/dd/yyyy. Show them the same way as the server does. */
+	var formatIpuzDate = function(date) {
+		if (!date)
+			return 'Unpublished';
+		var mdy = date.split('/');
+		var months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+		return mdy[1] + ' ' + months[+mdy[0] - 1] + ' ' + mdy[2];
+	};
+
+	var fetchIpuz = function(url, callback) {
+		var xhttp = new XMLHttpRequest();
+		xhttp.onload = function() {
+			callback(xhttp.status == 200 ? JSON.parse(xhttp.responseText) : null);
+		};
+		xhttp.onerror = function() {
+			callback(null);
+		};
+		xhttp.open('GET', url);
+		xhttp.send();
+	};
+
 	return {
 		Grid: Grid,
 		GridInput: GridInput,
+		ProgressSync: ProgressSync,
 		makeButtonBox: makeButtonBox,
+		renderIpuz: renderIpuz,
+		formatIpuzDate: formatIpuzDate,
+		fetchIpuz: fetchIpuz,
 	};
 })();
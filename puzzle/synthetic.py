@@ -0,0 +1,186 @@
+"""
+Generate realistic-looking crossword data for benchmarks.
+
+Everything is driven by a seeded random number generator, so the same seed
+always gives the same grids, clues and catalogue. Grids follow the usual
+British blocked pattern with rotational symmetry, and the ipuz and XML are
+in the same shape as the site's own editor and Crossword Compiler produce.
+"""
+
+import json
+from datetime import timedelta
+from random import Random
+from xml.sax.saxutils import quoteattr, escape
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+from puzzle.construction import get_answer, get_start_position
+from puzzle.models import Puzzle, Entry, Blank, Block, default_pub_date
+
+LETTERS = 'ETAOINSHRDLCUMWFGYPBVKJXQZ'
+LETTER_WEIGHTS = [127, 91, 82, 75, 70, 67, 63, 61, 60, 43, 40, 28, 28, 24, 24, 22, 20, 20,
+                  19, 15, 10, 8, 2, 2, 1, 1]
+CLUE_WORDS = ['Sailor', 'finally', 'heads', 'north', 'to', 'find', 'some', 'old', 'bird',
+              'in', 'river', 'after', 'party', 'leader', 'returns', 'with', 'a', 'drink',
+              'confused', 'about', 'king', 'and', 'queen', 'initially', 'upset', 'by', 'cold']
+
+def make_pattern(rng, size=15):
+    """Block layout for a grid, as a set of (x, y) pairs with rotational symmetry."""
+    blocks = set()
+    for y in range(size):
+        for x in range(size):
+            if (x, y) in blocks:
+                continue
+            if x % 2 and y % 2:
+                block = True
+            elif (x + y) % 2:
+                # Only one light runs through here, so a block just splits it in two
+                block = rng.random() < 0.12
+            else:
+                block = False
+            if block:
+                blocks.add((x, y))
+                blocks.add((size - 1 - x, size - 1 - y))
+    return blocks
+
+def get_lights(blocks, size):
+    """Numbered starting squares for the lights in a grid, in ipuz order.
+
+    Returns a list of (number, x, y, across length, down length) tuples.
+    """
+    lights = []
+    number = 1
+    for y in range(size):
+        for x in range(size):
+            if (x, y) in blocks:
+                continue
+            across = down = 0
+            if x == 0 or (x - 1, y) in blocks:
+                while x + across < size and (x + across, y) not in blocks:
+                    across += 1
+            if y == 0 or (x, y - 1) in blocks:
+                while y + down < size and (x, y + down) not in blocks:
+                    down += 1
+            across = across if across > 1 else 0
+            down = down if down > 1 else 0
+            if across or down:
+                lights.append((number, x, y, across, down))
+                number += 1
+    return lights
+
+def make_enumeration(rng, length):
+    """Enumeration for an answer, sometimes split into several words."""
+    if length >= 8 and rng.random() < 0.4:
+        first = rng.randint(3, length - 4)
+        separator = rng.choice([',', ',', '-'])
+        return f'{first}{separator}{length - first}'
+    return str(length)
+
+def make_clue(rng, enumeration):
+    """Plausible-looking clue text."""
+    words = rng.choices(CLUE_WORDS, k=rng.randint(4, 9))
+    return ' '.join(words).capitalize() + f' ({enumeration})'
+
+def make_ipuz(rng, size=15, blocks=None):
+    """ipuz data for a complete puzzle, as a dictionary."""
+    if blocks is None:
+        blocks = make_pattern(rng, size)
+    lights = get_lights(blocks, size)
+    numbers = {(x, y): number for number, x, y, _, _ in lights}
+    puzzle = [['#' if (x, y) in blocks else numbers.get((x, y), 0) for x in range(size)]
+              for y in range(size)]
+    solution = [['#' if (x, y) in blocks else rng.choices(LETTERS, LETTER_WEIGHTS)[0]
+                 for x in range(size)] for y in range(size)]
+
+    clues = {'Across': [], 'Down': []}
+    for number, _, _, across, down in lights:
+        for direction, length in [('Across', across), ('Down', down)]:
+            if length:
+                enumeration = make_enumeration(rng, length)
+                clues[direction].append({'number': number, 'clue': make_clue(rng, enumeration),
+                                         'enumeration': enumeration})
+
+    return {'version': 'http://ipuz.org/v2', 'kind': ['http://ipuz.org/crossword#1'],
+            'dimensions': {'width': size, 'height': size},
+            'puzzle': puzzle, 'solution': solution, 'clues': clues}
+
+def get_entries(data, puzzle=None):
+    """Entry objects for ipuz data, the same as save_puzzle would create."""
+    entries = []
+    for direction, down in [('Across', False), ('Down', True)]:
+        for clue in data['clues'][direction]:
+            pos = get_start_position(data['puzzle'], clue['number'])
+            entries.append(Entry(puzzle=puzzle, clue=clue['clue'], x=pos['x'], y=pos['y'],
+                                 answer=get_answer(data, clue, down, pos), down=down))
+    return entries
+
+def make_xml(data):
+    """Crossword Compiler XML for the same puzzle as some ipuz data."""
+    size = data['dimensions']['width']
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<crossword-compiler xmlns="http://crossword.info/xml/crossword-compiler">',
+             '<rectangular-puzzle xmlns="http://crossword.info/xml/rectangular-puzzle">',
+             '<crossword>', f'<grid width="{size}" height="{size}">']
+    for y, row in enumerate(data['solution']):
+        for x, letter in enumerate(row):
+            if letter == '#':
+                lines.append(f'<cell x="{x + 1}" y="{y + 1}" type="block"></cell>')
+            else:
+                lines.append(f'<cell x="{x + 1}" y="{y + 1}" solution="{letter}"></cell>')
+    lines.append('</grid>')
+
+    clue_lines = []
+    for word_id, entry in enumerate(get_entries(data), 1):
+        length = len(entry.answer.replace(' ', '').replace('-', ''))
+        if entry.down:
+            span = f'x="{entry.x + 1}" y="{entry.y + 1}-{entry.y + length}"'
+        else:
+            span = f'x="{entry.x + 1}-{entry.x + length}" y="{entry.y + 1}"'
+        # Multi-word answers need the solution spelt out to keep their spaces and hyphens
+        solution = f' solution={quoteattr(entry.answer.lower())}' \
+                   if len(entry.answer) > length else ''
+        lines.append(f'<word id="{word_id}" {span}{solution}></word>')
+        clue_lines.append(f'<clue word="{word_id}">{escape(entry.clue)}</clue>')
+    lines += ['<clues>'] + clue_lines + ['</clues>',
+              '</crossword>', '</rectangular-puzzle>', '</crossword-compiler>']
+    return '\n'.join(lines).encode('utf-8')
+
+def generate_catalogue(users=2000, puzzles=20000, blanks=300, seed=0, batch_size=500):
+    """Fill the database with users, puzzles and blank grids. Returns the number of entries.
+
+    A few prolific setters write most of the puzzles, as on the real site, and
+    about one puzzle in twenty is still waiting to be published.
+    """
+    rng = Random(seed)
+    user_model = get_user_model()
+    password = make_password('password')
+    start = timezone.now() - timedelta(days=3650)
+    user_objs = user_model.objects.bulk_create(
+        [user_model(username=f'setter{i:05d}', password=password, is_staff=i < max(users // 100, 1),
+                    date_joined=start + timedelta(minutes=i)) for i in range(users)],
+        batch_size=batch_size)
+
+    numbers = [0] * users
+    entry_count = 0
+    for batch_start in range(0, puzzles, batch_size):
+        batch = []
+        for i in range(batch_start, min(batch_start + batch_size, puzzles)):
+            user_index = int(users * rng.random() ** 3)
+            numbers[user_index] += 1
+            pub_date = start + timedelta(hours=i * 87600 // puzzles) \
+                       if rng.random() > 0.05 else default_pub_date()
+            batch.append((Puzzle(user=user_objs[user_index], number=numbers[user_index],
+                                 pub_date=pub_date), make_ipuz(rng)))
+        Puzzle.objects.bulk_create([puz for puz, _ in batch])
+        entries = [entry for puz, data in batch for entry in get_entries(data, puz)]
+        Entry.objects.bulk_create(entries, batch_size=batch_size)
+        entry_count += len(entries)
+
+    blank_objs = Blank.objects.bulk_create([Blank(display_order=i) for i in range(blanks)])
+    Block.objects.bulk_create([Block(blank=blank, x=x, y=y) for blank in blank_objs
+                               for x, y in sorted(make_pattern(rng))], batch_size=batch_size)
+    return entry_count
+
+def make_ipuz_json(seed=0, size=15):
+    """A single ipuz puzzle as a JSON string, ready to pass to save_puzzle."""
+    return json.dumps(make_ipuz(Random(seed), size))
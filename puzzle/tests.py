@@ -5,16 +5,57 @@ All tests run under the standard Django framework 'manage.py test'.
 Unit test functions must start with 'test_' to be automatically detected.
 """
 
+import json
+import os
+import shutil
+import tempfile
+import zlib
 from datetime import timedelta, datetime
-from django.test import TestCase
+from threading import Thread
+from io import BytesIO, StringIO
+from re import split
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, Client, LiveServerTestCase, RequestFactory, TestCase
+from django.test import TransactionTestCase, override_settings
 from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from puzzle.models import Puzzle, Entry, Blank, Block
+from puzzle.models import Puzzle, PuzzleCounter, Entry, Blank, Block, Draft, Preview
+from puzzle.models import CatalogueVersion, GridAnalysis, SolveProgress
+from puzzle.models import allocate_number, default_pub_date
+from puzzle.caching import VERSION_KEY, bump_catalogue_version, cache_catalogue_page
+from puzzle.caching import catalogue_version
 from puzzle.feeds import PuzzleFeed
 from puzzle.construction import create_grid, create_thumbnail, get_clues, get_date_string
+from puzzle.construction import get_puzzle_version
 from puzzle.admin import import_from_xml, import_blank_from_ipuz
-from visitors.models import Visitor
+from puzzle.analysis import analyse_grid, describe_analysis, get_pattern_hash
+from puzzle.answers import find_reused_answers, match_answers
+from puzzle.drafts import apply_patch
+from puzzle import async_views
+from puzzle.construction import aget_puzzle_context, get_puzzle_context, save_puzzle
+from puzzle.benchmarks import compare_results, run_benchmarks
+from puzzle.loadtest import Result as LoadResult, parse_mix, run_load_test, summarise
+from puzzle.prerender import get_build_fingerprint, get_page_dir, rebuild
+from puzzle.previews import backfill, get_grid_hash, update_preview
+from puzzle.publishing import get_released, get_upcoming, get_wait, prepare, release
+from puzzle.printing import PAGE_HEIGHT, get_print_layout
+from puzzle.progress import ProgressBuffer, pack_letters, progress_buffer
+from puzzle.search import search_clues
+from puzzle.warmup import warm_up
+from puzzle.synthetic import generate_catalogue, get_entries, make_ipuz_json, make_xml
+from three_pins.middleware import PrimaryPinMiddleware, WhiteNoiseMiddleware
+from three_pins.routers import ReplicaRouter, replica_health, use_primary
+from visitors.models import Visitor, log_buffer
 
 def get_user():
     """Helper to get the first user in the database, creating one if necessary."""
@@ -125,6 +166,1301 @@ class FeedTests(TestCase):
         self.assertEqual(feed.items()[0].number, 0)
 
 
+class SitemapTests(TestCase):
+    """Tests for the sitemap of published puzzles and solutions."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sitemap_index(self):
+        """Check that the index links to each sitemap section."""
+        create_puzzle_range()
+        response = self.client.get(reverse('sitemap'))
+        self.assertContains(response, reverse('sitemap-section', args=['puzzles']))
+        self.assertContains(response, reverse('sitemap-section', args=['solutions']))
+
+    def test_published_puzzles_only(self):
+        """Check that only published puzzles and solutions are listed, with modification dates."""
+        create_puzzle_range()
+        response = self.client.get(reverse('sitemap-section', args=['puzzles']))
+        for number in range(3):
+            self.assertContains(response, reverse('puzzle', args=['super', number]))
+        self.assertNotContains(response, reverse('puzzle', args=['super', 3]))
+        self.assertEqual(response.content.count(b'<lastmod>'), 3)
+        response = self.client.get(reverse('sitemap-section', args=['solutions']))
+        self.assertContains(response, reverse('solution', args=['super', 2]))
+        self.assertNotContains(response, reverse('solution', args=['super', 3]))
+
+    def test_sitemap_cached_until_publish(self):
+        """Check that a repeat request is served from the cache until another puzzle is saved."""
+        create_puzzle_range()
+        self.client.get(reverse('sitemap-section', args=['puzzles']))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('sitemap-section', args=['puzzles']))
+        self.assertNotContains(response, reverse('puzzle', args=['super', 5]))
+        self.assertIn('max-age', response['Cache-Control'])
+        create_empty_staff_puzzle(5, timezone.now())
+        response = self.client.get(reverse('sitemap-section', args=['puzzles']))
+        self.assertContains(response, reverse('puzzle', args=['super', 5]))
+
+    def test_saved_by_another_process(self):
+        """Check that without a shared cache, a puzzle saved elsewhere is picked up once this
+        process next checks the catalogue version."""
+        create_puzzle_range()
+        self.client.get(reverse('sitemap-section', args=['puzzles']))
+        # Saved by another worker, which bumps the version in the database but not our cache
+        Puzzle.objects.bulk_create([Puzzle(number=5, user=get_superuser(),
+                                           pub_date=timezone.now())])
+        CatalogueVersion.objects.update(version=F('version') + 1)
+        response = self.client.get(reverse('sitemap-section', args=['puzzles']))
+        self.assertNotContains(response, reverse('puzzle', args=['super', 5]))
+        cache.delete(VERSION_KEY)
+        response = self.client.get(reverse('sitemap-section', args=['puzzles']))
+        self.assertContains(response, reverse('puzzle', args=['super', 5]))
+
+    def test_shared_cache_version(self):
+        """Check that a shared cache holds the version itself, without the database."""
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location}}):
+            version = catalogue_version()
+            bump_catalogue_version()
+            self.assertEqual(catalogue_version(), version + 1)
+        self.assertFalse(CatalogueVersion.objects.exists())
+
+
+class PrerenderTests(TestCase):
+    """Tests for pre-rendering published puzzles to static files."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.override = override_settings(PRERENDER_ROOT=self.root)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.root)
+
+    def test_published_pages_rendered(self):
+        """Check that published puzzles, their solutions and the archive are written out."""
+        create_puzzle_range()
+        written, removed = rebuild()
+        self.assertEqual(len(written), 7)
+        self.assertEqual(removed, [])
+        page = os.path.join(get_page_dir(reverse('puzzle', args=['super', 2])), 'index.html')
+        with open(page, encoding='utf-8') as file:
+            self.assertIn('data-number="2"', file.read())
+        self.assertFalse(os.path.exists(get_page_dir(reverse('puzzle', args=['super', 3]))))
+
+    def test_incremental_rebuild(self):
+        """Check that only puzzles whose neighbours have changed are rendered again."""
+        create_puzzle_range()
+        rebuild()
+        self.assertEqual(rebuild(), ([], []))
+        Puzzle.objects.filter(number=3).update(pub_date=timezone.now())
+        written, _ = rebuild()
+        self.assertEqual(set(written), {reverse('puzzle', args=['super', 2]),
+                                        reverse('solution', args=['super', 2]),
+                                        reverse('puzzle', args=['super', 3]),
+                                        reverse('solution', args=['super', 3]),
+                                        reverse('users')})
+
+    def test_rebuild_after_deployment(self):
+        """Check that every page is rendered again when the templates change."""
+        create_puzzle_range()
+        rebuild()
+        template_dir = os.path.join(self.root, 'templates')
+        os.makedirs(template_dir)
+        with open(os.path.join(template_dir, 'new.html'), 'w', encoding='utf-8') as file:
+            file.write('new template')
+        engine = settings.TEMPLATES[0]
+        templates = [dict(engine, DIRS=engine['DIRS'] + [template_dir])]
+        get_build_fingerprint.cache_clear()
+        try:
+            with override_settings(TEMPLATES=templates):
+                written, _ = rebuild()
+        finally:
+            get_build_fingerprint.cache_clear()
+        self.assertEqual(len(written), 7)
+        self.assertIn(reverse('users'), written)
+
+    def test_unpublished_pages_removed(self):
+        """Check that a puzzle which is no longer published is taken down."""
+        create_puzzle_range()
+        rebuild()
+        Puzzle.objects.filter(number=0).update(pub_date=timezone.now() + timedelta(days=1))
+        _, removed = rebuild()
+        self.assertEqual(removed, [reverse('puzzle', args=['super', 0])])
+        self.assertFalse(os.path.exists(get_page_dir(reverse('puzzle', args=['super', 0]))))
+
+    def test_serve_prerendered_anonymous_only(self):
+        """Check that anonymous visitors get the static copy and logged in users don't."""
+        create_puzzle_range()
+        rebuild()
+        path = reverse('puzzle', args=['super', 1])
+        with open(os.path.join(get_page_dir(path), 'index.html'), 'w', encoding='utf-8') as file:
+            file.write('pre-rendered')
+        response = self.client.get(path)
+        self.assertContains(response, 'pre-rendered')
+        self.assertEqual(Visitor.objects.count(), 1)
+        self.client.login(username='super', password='password')
+        response = self.client.get(path)
+        self.assertNotContains(response, 'pre-rendered')
+        self.assertContains(response, reverse('edit', args=['super', 1]))
+
+    def test_rendered_after_save(self):
+        """Check that saving a public puzzle pre-renders it once the save is committed."""
+        ipuz = '{"dimensions":{"width":3,"height":3},"puzzle":[[1,0,0],[0,"#","#"],[0,"#","#"]],' \
+               '"clues":{"Across":[{"number":1,"clue":"1a","enumeration":"3"}],' \
+               '"Down":[{"number":1,"clue":"1d","enumeration":"3"}]},' \
+               '"solution":[["A","B","C"],["D","#","#"],["E","#","#"]]}'
+        get_user()
+        self.client.login(username='test', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('save'), {'author': '', 'number': '', 'ipuz': ipuz,
+                                               'visibility': 'public'})
+        page_dir = get_page_dir(reverse('puzzle', args=['test', 1]))
+        self.assertTrue(os.path.exists(os.path.join(page_dir, 'index.html.gz')))
+
+
+class IpuzViewTests(TestCase):
+    """Tests for serving puzzles as ipuz data for rendering in the browser."""
+
+    def get_ipuz(self, author, number):
+        """Helper to fetch ipuz data, following the redirect to the current version."""
+        return self.client.get(reverse('ipuz', args=[author, number]), follow=True)
+
+    def test_redirect_to_version(self):
+        """Check that unversioned requests are sent to a long-lived versioned URL."""
+        create_puzzle_range()
+        response = self.client.get(reverse('ipuz', args=['super', 1]))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('?v=', response['Location'])
+        response = self.client.get(response['Location'])
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_ipuz_content(self):
+        """Check the grid, solution and clues in the ipuz data."""
+        create_puzzle_range()
+        data = json.loads(self.get_ipuz('super', 1).content)
+        self.assertEqual(data['dimensions'], {'width': 3, 'height': 3})
+        self.assertEqual(data['puzzle'], [[1, 0, 2], [0, '#', 0], [3, 0, 0]])
+        self.assertEqual(data['solution'], [['A', 'B', 'C'], ['M', '#', 'N'], ['X', 'Y', 'Z']])
+        self.assertEqual(data['clues']['Across'][0],
+                         {'number': 1, 'clue': '1a', 'enumeration': '2,1'})
+        self.assertEqual(data['clues']['Down'][1]['number'], 2)
+        self.assertEqual(data['author'], 'super')
+        self.assertIn('date', data)
+
+    def test_unpublished_ipuz(self):
+        """Check that unpublished puzzles are only available to their author, and never cached."""
+        create_puzzle_range()
+        get_user()
+        self.client.login(username='test', password='password')
+        self.assertEqual(self.get_ipuz('super', 3).status_code, 403)
+        self.client.login(username='super', password='password')
+        response = self.get_ipuz('super', 3)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('date', json.loads(response.content))
+
+    def test_lite_page_shared(self):
+        """Check that the client-rendered page is the same for every puzzle."""
+        create_puzzle_range()
+        first = self.client.get(reverse('lite', args=['super', 1]))
+        second = self.client.get(reverse('lite', args=['super', 2]))
+        self.assertEqual(first.content, second.content)
+        self.assertContains(first, 'GridModule.renderIpuz')
+        self.assertNotContains(first, 'data-a=')
+
+
+class EmbedTests(TestCase):
+    """Tests for the stand-alone puzzle page which other sites can embed."""
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        log_buffer.flush()
+
+    def test_embed_page(self):
+        """Check that the embed page has the puzzle data but none of the site chrome."""
+        create_puzzle_range()
+        response = self.client.get(reverse('embed', args=['super', 1]))
+        self.assertContains(response, 'id="ipuz"')
+        self.assertContains(response, '"solution": [["A", "B", "C"]')
+        self.assertNotContains(response, 'fonts.googleapis.com')
+        self.assertNotContains(response, 'apple-touch-icon')
+        self.assertFalse(response.has_header('X-Frame-Options'))
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_embed_cached(self):
+        """Check that repeat views don't touch the database."""
+        create_puzzle_range()
+        self.client.get(reverse('embed', args=['super', 1]))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('embed', args=['super', 1]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_embed_unpublished(self):
+        """Check that unpublished puzzles can't be embedded, even by their author."""
+        create_puzzle_range()
+        self.client.login(username='super', password='password')
+        response = self.client.get(reverse('embed', args=['super', 3]))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(VISITOR_LOG_BATCH_SIZE=3)
+    def test_embed_visits_batched(self):
+        """Check that visits are logged once a batch has built up."""
+        create_puzzle_range()
+        log_buffer.flush()
+        self.client.get(reverse('embed', args=['super', 1]))
+        self.client.get(reverse('embed', args=['super', 1]))
+        self.assertEqual(Visitor.objects.count(), 0)
+        self.client.get(reverse('embed', args=['super', 1]))
+        self.assertEqual(Visitor.objects.count(), 3)
+
+
+class PuzzleListTests(TestCase):
+    """Tests for the paginated JSON list of published puzzles."""
+
+    def setUp(self):
+        cache.clear()
+
+    def get_list(self, **params):
+        """Helper to fetch one page of the list."""
+        return json.loads(self.client.get(reverse('puzzle-list'), params).content)
+
+    def test_walk_all_pages(self):
+        """Check that following the cursor visits every published puzzle once, newest first."""
+        for i in range(7):
+            create_empty_staff_puzzle(i, timezone.now() - timedelta(days=7 - i))
+        create_empty_staff_puzzle(7, timezone.now() + timedelta(days=1))
+        numbers = []
+        page = self.get_list(limit=3)
+        while True:
+            numbers += [puz['number'] for puz in page['results']]
+            if not page['cursor']:
+                break
+            page = self.get_list(limit=3, cursor=page['cursor'])
+        self.assertEqual(numbers, [6, 5, 4, 3, 2, 1, 0])
+
+    def test_cached_encoding(self):
+        """Check that a compressed copy of the list isn't served to clients which can't take it."""
+        for i in range(10):
+            create_empty_staff_puzzle(i, timezone.now() - timedelta(days=i + 1))
+        response = self.client.get(reverse('puzzle-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(reverse('puzzle-list'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(json.loads(response.content)['results']), 10)
+
+    def test_same_publish_date(self):
+        """Check that puzzles published at the same moment are neither skipped nor repeated."""
+        pub_date = timezone.now() - timedelta(days=1)
+        for i in range(4):
+            create_empty_staff_puzzle(i, pub_date)
+        first = self.get_list(limit=2)
+        second = self.get_list(limit=2, cursor=first['cursor'])
+        numbers = [puz['number'] for puz in first['results'] + second['results']]
+        self.assertEqual(sorted(numbers), [0, 1, 2, 3])
+        self.assertIsNone(second['cursor'])
+
+    def test_filters_and_fields(self):
+        """Check filtering by setter and date, and choosing which fields to show."""
+        create_puzzle_range()
+        Puzzle.objects.create(number=0, user=get_user(), pub_date=timezone.now())
+        page = self.get_list(setter='test', fields='author,ipuz')
+        self.assertEqual(page['results'], [{'author': 'test',
+                                            'ipuz': reverse('ipuz', args=['test', 0])}])
+        since = (timezone.now() - timedelta(days=1, hours=1)).isoformat()
+        page = self.get_list(setter='super', since=since, fields='number')
+        self.assertEqual(page['results'], [{'number': 2}, {'number': 1}])
+
+    def test_bad_parameters(self):
+        """Check that nonsense parameters are rejected."""
+        for params in [{'fields': 'password'}, {'cursor': 'nonsense'}, {'since': 'yesterday'},
+                       {'limit': 'lots'}]:
+            response = self.client.get(reverse('puzzle-list'), params)
+            self.assertEqual(response.status_code, 400)
+
+
+def async_request(path, user=None):
+    """Build a request for an async view, as it would come out of the middleware."""
+    request = AsyncRequestFactory().get(path)
+    async def auser():
+        return user or AnonymousUser()
+    request.auser = auser
+    return request
+
+class AsyncViewTests(TestCase):
+    """Tests for the asynchronous puzzle pages used under ASGI."""
+
+    def setUp(self):
+        create_puzzle_range()
+        self.superuser = get_user_model().objects.get(username='super')
+
+    def tearDown(self):
+        log_buffer.flush()
+
+    async def test_async_context_matches(self):
+        """Check that the async page context is the same as the ordinary one."""
+        obj = await Puzzle.objects.select_related('user').aget(number=1)
+        for user in [AnonymousUser(), self.superuser]:
+            expected = await sync_to_async(get_puzzle_context)(obj, user, 'Title', 'Description')
+            context = await aget_puzzle_context(obj, user, 'Title', 'Description')
+            self.assertEqual(context, expected)
+
+    async def test_async_puzzle(self):
+        """Check that the async view shows a published puzzle and logs the visit."""
+        response = await async_views.puzzle(async_request('/setter/super/1/'), 'super', '1')
+        self.assertContains(response, 'Crossword #1')
+        self.assertEqual(log_buffer.logs[-1].path, '/setter/super/1/')
+
+    async def test_async_unpublished(self):
+        """Check that only the author can see an unpublished puzzle through the async view."""
+        with self.assertRaises(PermissionDenied):
+            await async_views.puzzle(async_request('/setter/super/3/'), 'super', '3')
+        request = async_request('/setter/super/3/', self.superuser)
+        response = await async_views.solution(request, 'super', '3')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_async_latest(self):
+        """Check that the async home page shows the most recently published puzzle."""
+        response = await async_views.latest(async_request('/'))
+        self.assertContains(response, '&#35;2 - ')
+
+    async def test_async_rss(self):
+        """Check that the async feed lists the same puzzles as the ordinary one."""
+        response = await async_views.rss(async_request('/rss/'))
+        self.assertContains(response, 'Crossword #2 is now available')
+        self.assertNotContains(response, 'Crossword #3')
+
+    def test_async_rss_cached(self):
+        """Check that the async feed is cached, so the publish worker can warm it up."""
+        view = async_to_sync(cache_catalogue_page(async_views.rss))
+        response = view(async_request('/rss/'))
+        self.assertIn('max-age', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            cached = view(async_request('/rss/'))
+        self.assertEqual(cached.content, response.content)
+
+    def test_whitenoise_async(self):
+        """Check that the static file middleware stays async in an async chain."""
+        async def get_response(request): #pylint: disable=unused-argument
+            return None
+        def get_sync_response(request): #pylint: disable=unused-argument
+            return None
+        self.assertTrue(iscoroutinefunction(WhiteNoiseMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(WhiteNoiseMiddleware(get_sync_response)))
+
+class SyntheticDataTests(TestCase):
+    """Tests for the synthetic data used by the benchmarks."""
+
+    def test_ipuz_deterministic(self):
+        """Check that the same seed always gives the same puzzle."""
+        self.assertEqual(make_ipuz_json(1), make_ipuz_json(1))
+        self.assertNotEqual(make_ipuz_json(1), make_ipuz_json(2))
+
+    def test_ipuz_saved(self):
+        """Check that a generated puzzle saves with answers fitting their enumerations."""
+        data = json.loads(make_ipuz_json(3))
+        puz = save_puzzle(get_user(), 1, json.dumps(data), True)
+        entries = Entry.objects.filter(puzzle=puz)
+        self.assertEqual(entries.count(), len(data['clues']['Across']) + len(data['clues']['Down']))
+        for entry in entries:
+            enumeration = entry.clue[entry.clue.rindex('(') + 1:-1]
+            self.assertEqual(len(entry.answer), sum(int(n) for n in split('[,-]', enumeration)) +
+                             len(split('[,-]', enumeration)) - 1)
+
+    def test_xml_matches_ipuz(self):
+        """Check that the XML version of a puzzle imports with the same answers."""
+        data = json.loads(make_ipuz_json(4))
+        user = get_user()
+        puz = Puzzle.objects.create(user=user, number=2)
+        import_from_xml(BytesIO(make_xml(data)), puz)
+        imported = sorted((e.x, e.y, e.down, e.answer.upper(), e.clue)
+                          for e in Entry.objects.filter(puzzle=puz))
+        expected = sorted((e.x, e.y, e.down, e.answer, e.clue) for e in get_entries(data))
+        self.assertEqual(imported, expected)
+
+    def test_generate_catalogue(self):
+        """Check that a catalogue of the requested size is generated."""
+        entries = generate_catalogue(users=5, puzzles=30, blanks=3, seed=1, batch_size=7)
+        self.assertEqual(get_user_model().objects.filter(username__startswith='setter').count(), 5)
+        self.assertEqual(Puzzle.objects.count(), 30)
+        self.assertEqual(Entry.objects.count(), entries)
+        self.assertEqual(Blank.objects.count(), 3)
+        self.assertTrue(Block.objects.exists())
+
+class BenchmarkTests(TestCase):
+    """Tests for the benchmark runner."""
+
+    def test_run_benchmarks(self):
+        """Check that scenarios are measured on a small catalogue."""
+        generate_catalogue(users=3, puzzles=10, blanks=2)
+        results = run_benchmarks(['create_grid', 'view_puzzle'], iterations=2)
+        self.assertEqual(set(results), {'create_grid', 'view_puzzle'})
+        self.assertEqual(results['create_grid']['queries'], 1)
+        self.assertGreater(results['view_puzzle']['queries'], 1)
+        self.assertGreater(results['view_puzzle']['memory'], 0)
+
+    def test_compare_results(self):
+        """Check that slowdowns and extra queries are flagged, but small changes aren't."""
+        baseline = {'a': {'median': 1.0, 'queries': 3, 'memory': 1000000},
+                    'b': {'median': 1.0, 'queries': 3, 'memory': 1000000}}
+        results = {'a': {'median': 1.1, 'queries': 3, 'memory': 1100000},
+                   'b': {'median': 1.5, 'queries': 4, 'memory': 2000000},
+                   'c': {'median': 9.0, 'queries': 9, 'memory': 9000000}}
+        self.assertEqual(compare_results(results, baseline),
+                         [('b', 'median', 1.0, 1.5), ('b', 'queries', 3, 4),
+                          ('b', 'memory', 1000000, 2000000)])
+
+class LoadTestTests(LiveServerTestCase):
+    """Tests for the load test harness, run against a live test server."""
+    # Outside a transaction, reads may be routed to read replicas
+    databases = '__all__'
+
+    def setUp(self):
+        create_puzzle_range()
+
+    def check_results(self, results, kinds):
+        """Check that the requests all succeeded and covered the expected kinds."""
+        self.assertTrue(results)
+        self.assertEqual([result for result in results if result.error], [])
+        self.assertEqual({result.kind for result in results}, kinds)
+
+    def test_threads(self):
+        """Check that reads and saves work from threads, with saves creating puzzles."""
+        results, _ = run_load_test(self.live_server_url, concurrency=1, duration=30,
+                                   requests=12, mix={'puzzle': 1, 'save': 1})
+        self.check_results(results, {'puzzle', 'create', 'save'})
+        saves = sum(1 for result in results if result.kind == 'save')
+        self.assertEqual(Puzzle.objects.filter(user__username='loadtest0x0').count(), saves)
+
+    def test_asyncio(self):
+        """Check that requests can also be made from asyncio tasks."""
+        results, elapsed = run_load_test(self.live_server_url, concurrency=2, duration=30,
+                                         requests=10, mode='asyncio',
+                                         mix={'latest': 1, 'rss': 1, 'archive': 1})
+        self.check_results(results, {'latest', 'rss', 'archive'})
+        summary = summarise(results, elapsed)
+        self.assertEqual(summary['all']['requests'], len(results))
+        self.assertEqual(summary['all']['error_rate'], 0)
+
+    def test_summary(self):
+        """Check the percentiles and error rates in the summary."""
+        results = [LoadResult('latest', 200, n / 100, None) for n in range(1, 100)] + \
+                  [LoadResult('save', 500, 1.0, 'HTTP 500')]
+        summary = summarise(results, 10)
+        self.assertEqual(summary['all']['throughput'], 10)
+        self.assertEqual(summary['all']['error_rate'], 0.01)
+        self.assertEqual(summary['kinds']['latest']['p50'], 0.5)
+        self.assertEqual(summary['kinds']['latest']['p99'], 0.98)
+        self.assertEqual(summary['error_counts'], {'HTTP 500': 1})
+        self.assertEqual(parse_mix('latest=3,save=1'), {'latest': 3, 'save': 1})
+        self.assertRaises(ValueError, parse_mix, 'login=1')
+
+class WarmUpTests(TestCase):
+    """Tests for warming up a process before it serves requests."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_warm_up(self):
+        """Check that every step runs, and the main pages then need fewer queries."""
+        create_puzzle_range()
+        blank = Blank.objects.create(size=3)
+        Block.objects.create(blank=blank, x=1, y=1)
+        thumbnail = create_thumbnail(blank, 10)
+        self.assertEqual(set(warm_up()),
+                         {'templates', 'latest', 'archive', 'thumbnails', 'blank-stats'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('create')).context['thumbs'], [thumbnail])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('users')).status_code, 200)
+
+    def test_empty_database(self):
+        """Check that warming up works before anything has been published."""
+        self.assertEqual(len(warm_up()), 5)
+        self.assertEqual(self.client.get(reverse('create')).context['thumbs'], [])
+
+    def test_thumbnails_redrawn(self):
+        """Check that changing a blank grid clears the cached thumbnails."""
+        blank = Blank.objects.create(size=3)
+        self.client.get(reverse('create'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Block.objects.create(blank=blank, x=0, y=0)
+        response = self.client.get(reverse('create'))
+        self.assertEqual(response.context['thumbs'], [create_thumbnail(blank, 10)])
+        self.assertIn('fill:rgb(0,0,0)', response.context['thumbs'][0])
+
+    def test_latest_follows_publication(self):
+        """Check that the cached latest puzzle changes when a newer one is published."""
+        create_puzzle_range()
+        warm_up()
+        self.assertNotContains(self.client.get('/'), '&#35;10 - ')
+        create_empty_staff_puzzle(10, timezone.now())
+        self.assertContains(self.client.get('/'), '&#35;10 - ')
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """Tests for sending puzzle reads to read replicas."""
+    databases = '__all__'
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        replica_health.set_status('replica1', True)
+
+    def tearDown(self):
+        replica_health.reset()
+
+    def test_routing(self):
+        """Check that only puzzle reads outside transactions go to a replica."""
+        self.assertEqual(self.router.db_for_read(Puzzle), 'replica1')
+        self.assertEqual(self.router.db_for_read(get_user_model()), 'replica1')
+        self.assertIsNone(self.router.db_for_read(Visitor))
+        self.assertEqual(self.router.db_for_write(Puzzle), 'default')
+        with transaction.atomic():
+            self.assertIsNone(self.router.db_for_read(Puzzle))
+        token = use_primary.set(True)
+        self.assertIsNone(self.router.db_for_read(Puzzle))
+        use_primary.reset(token)
+        self.assertFalse(self.router.allow_migrate('replica1', 'puzzle'))
+        self.assertTrue(self.router.allow_migrate('default', 'puzzle'))
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertIsNone(self.router.db_for_read(Puzzle))
+
+    def test_unavailable_replica(self):
+        """Check that reads fall back to the primary when no replica is available."""
+        replica_health.set_status('replica1', False)
+        self.assertEqual(self.router.db_for_read(Puzzle), 'default')
+
+    def test_pinned_after_save(self):
+        """Check that saving keeps the visitor's reads on the primary for a while."""
+        ipuz = make_ipuz_json(0, 5)
+        response = self.client.post(reverse('save'), {'author': '', 'number': '', 'ipuz': ipuz,
+                                                      'username': 'new', 'password': 'password',
+                                                      'email': '', 'visibility': 'public'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies['use_primary']['max-age'], 10)
+        self.assertEqual(Puzzle.objects.using('default').filter(user__username='new').count(), 1)
+
+        middleware = PrimaryPinMiddleware(
+            lambda request: HttpResponse(str(self.router.db_for_read(Puzzle))))
+        factory = RequestFactory()
+        self.assertEqual(middleware(factory.get('/')).content, b'replica1')
+        factory.cookies['use_primary'] = '1'
+        self.assertEqual(middleware(factory.get('/')).content, b'None')
+        self.assertFalse(use_primary.get())
+
+class NumberAllocationTests(TransactionTestCase):
+    """Tests for giving out new puzzle numbers, including to concurrent saves."""
+    # Outside a transaction, reads may be routed to read replicas
+    databases = '__all__'
+
+    def run_threads(self, count, target):
+        """Run a function in several threads at once, returning any errors."""
+        errors = []
+
+        def run():
+            try:
+                target()
+            except Exception as error: #pylint: disable=broad-except
+                errors.append(repr(error))
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_follows_existing_numbers(self):
+        """Check that numbering carries on from existing puzzles, including hand-picked ones."""
+        create_puzzle_range()
+        user = get_superuser()
+        self.assertEqual(allocate_number(user), 5)
+        self.assertEqual(allocate_number(user), 6)
+        create_empty_staff_puzzle(20, timezone.now())
+        self.assertEqual(allocate_number(user), 21)
+        self.assertEqual(allocate_number(get_user()), 1)
+
+    def test_concurrent_allocation(self):
+        """Check that threads allocating numbers for the same user never get the same one."""
+        user = get_user()
+        numbers = []
+
+        def allocate():
+            for _ in range(10):
+                with transaction.atomic():
+                    numbers.append(allocate_number(user))
+
+        self.assertEqual(self.run_threads(8, allocate), [])
+        self.assertEqual(sorted(numbers), list(range(1, 81)))
+        self.assertEqual(PuzzleCounter.objects.get(user=user).last_number, 80)
+
+    def test_concurrent_saves(self):
+        """Check that new puzzles saved at the same time by one setter all get kept."""
+        get_user()
+
+        def save():
+            client = Client()
+            client.login(username='test', password='password')
+            for seed in range(3):
+                response = client.post(reverse('save'), {'author': '', 'number': '',
+                                                         'ipuz': make_ipuz_json(seed, 5),
+                                                         'visibility': 'public'})
+                if response.status_code != 200:
+                    raise AssertionError(response.status_code)
+
+        self.assertEqual(self.run_threads(4, save), [])
+        numbers = Puzzle.objects.filter(user__username='test').values_list('number', flat=True)
+        self.assertEqual(sorted(numbers), list(range(1, 13)))
+
+class SearchTests(TestCase):
+    """Tests for searching clues and answers."""
+
+    def add_entry(self, clue, answer, pub_date=None, number=None):
+        """Add a one-entry puzzle by the superuser."""
+        puz = Puzzle.objects.create(user=get_superuser(), number=number,
+                                    pub_date=pub_date or timezone.now() - timedelta(days=1))
+        return Entry.objects.create(puzzle=puz, clue=clue, answer=answer, x=0, y=0)
+
+    def search(self, query):
+        """Answers found on the first page of results."""
+        return [result['answer'] for result in search_clues(query)[0]]
+
+    def test_clues_and_answers(self):
+        """Check that words are found in clues and answers, ignoring case and word endings."""
+        self.add_entry('Flightless birds run round Rich (7)', 'ostrich', number=1)
+        self.add_entry('Bird of prey (5)', 'eagle', number=2)
+        self.assertEqual(self.search('OSTRICH'), ['OSTRICH'])
+        self.assertEqual(self.search('flightless bird'), ['OSTRICH'])
+        self.assertEqual(sorted(self.search('bird')), ['EAGLE', 'OSTRICH'])
+        self.assertEqual(self.search('bird prey'), ['EAGLE'])
+        self.assertEqual(self.search('"*'), [])
+        self.assertEqual(self.search('penguin'), [])
+
+    def test_published_only(self):
+        """Check that clues from unpublished puzzles aren't found."""
+        self.add_entry('Flightless bird (7)', 'ostrich', timezone.now() + timedelta(days=1), 1)
+        self.assertEqual(self.search('ostrich'), [])
+
+    def test_index_follows_edits(self):
+        """Check that the index keeps up with entries being changed and deleted."""
+        entry = self.add_entry('Flightless bird (7)', 'ostrich', number=1)
+        entry.clue = 'Large bird (7)'
+        entry.save()
+        self.assertEqual(self.search('flightless'), [])
+        self.assertEqual(self.search('large'), ['OSTRICH'])
+        entry.puzzle.delete()
+        self.assertEqual(self.search('large'), [])
+
+    def test_search_page(self):
+        """Check that the search page shows results a page at a time."""
+        for number in range(25):
+            self.add_entry(f'Bird number {number}', 'ostrich',
+                           timezone.now() - timedelta(days=25 - number), number)
+        response = self.client.get(reverse('search'), {'q': 'bird'})
+        self.assertEqual(len(response.context['results']), 20)
+        self.assertEqual(response.context['results'][0]['number'], 24)
+        self.assertContains(response, reverse('solution', args=['super', 24]))
+        response = self.client.get(reverse('search'), {'q': 'bird',
+                                                       'cursor': response.context['cursor']})
+        self.assertEqual([result['number'] for result in response.context['results']],
+                         list(range(4, -1, -1)))
+        self.assertIsNone(response.context['cursor'])
+        self.assertContains(self.client.get(reverse('search'), {'q': 'penguin'}),
+                            'No published clues or answers match')
+        response = self.client.get(reverse('search'), {'q': 'bird', 'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+class AnswerReuseTests(TestCase):
+    """Tests for looking up answers a setter has used before."""
+
+    def add_puzzle(self, user, number, answers):
+        """Add a puzzle with an entry for each answer."""
+        puz = Puzzle.objects.create(user=user, number=number)
+        for answer in answers:
+            Entry.objects.create(puzzle=puz, clue=f'Clue for {answer}', answer=answer, x=0, y=0)
+        return puz
+
+    def test_letters(self):
+        """Check that answers are stored without spaces, hyphens and apostrophes."""
+        self.add_puzzle(get_user(), 1, ["Jack-o'-lantern", 'tea set'])
+        self.assertEqual(sorted(Entry.objects.values_list('letters', 'length')),
+                         [('JACKOLANTERN', 12), ('TEASET', 6)])
+
+    def test_find_reused(self):
+        """Check that reused answers are found in the setter's own earlier puzzles."""
+        user = get_user()
+        self.add_puzzle(user, 87, ['ostrich', 'tea set'])
+        self.add_puzzle(user, 203, ['ostrich'])
+        self.add_puzzle(get_superuser(), 1, ['emu'])
+        reused = find_reused_answers(user, ['OSTRICH', 'TEA-SET', 'EMU', 'E.U', 'KIWI'])
+        self.assertEqual(sorted(reused), ['OSTRICH', 'TEASET'])
+        self.assertEqual([use['number'] for use in reused['OSTRICH']], [87, 203])
+        self.assertEqual(reused['OSTRICH'][0]['clue'], 'Clue for ostrich')
+        self.assertEqual(reused['TEASET'][0]['answer'], 'TEA SET')
+        self.assertEqual(sorted(find_reused_answers(user, ['OSTRICH', 'TEASET'], 87)),
+                         ['OSTRICH'])
+        self.assertEqual(find_reused_answers(AnonymousUser(), ['OSTRICH']), {})
+
+    def test_match_pattern(self):
+        """Check that past answers are found to fit a pattern."""
+        user = get_user()
+        self.add_puzzle(user, 1, ['lake', 'cake', 'lakes'])
+        self.add_puzzle(user, 2, ['cake', 'lane'])
+        self.add_puzzle(get_superuser(), 1, ['bake'])
+        self.assertEqual(match_answers(user, '?a?e'), [{'letters': 'CAKE', 'numbers': [1, 2]},
+                                                       {'letters': 'LAKE', 'numbers': [1]},
+                                                       {'letters': 'LANE', 'numbers': [2]}])
+        self.assertEqual(match_answers(user, 'L.KE_'), [{'letters': 'LAKES', 'numbers': [1]}])
+        self.assertEqual(match_answers(user, '?A?E', limit=1), [{'letters': 'CAKE',
+                                                                 'numbers': [1, 2]}])
+        self.assertEqual(match_answers(user, "L%'"), [])
+        self.assertEqual(match_answers(user, ''), [])
+
+    def test_views(self):
+        """Check that the editor can look up past answers and reused answers before saving."""
+        user = get_user()
+        ipuz = make_ipuz_json(0, 5)
+        save_puzzle(user, 1, ipuz, True)
+        self.add_puzzle(user, 2, ['nowhere'])
+        response = self.client.get(reverse('past-answers'), {'pattern': 'n?where'})
+        self.assertEqual(response.json(), {'answers': []})
+
+        self.client.login(username='test', password='password')
+        response = self.client.get(reverse('past-answers'), {'pattern': 'n?where'})
+        self.assertEqual(response.json(), {'answers': [{'letters': 'NOWHERE', 'numbers': [2]}]})
+        response = self.client.post(reverse('reused-answers'), {'ipuz': ipuz, 'number': ''})
+        reused = response.json()['reused']
+        self.assertEqual(len(reused), Entry.objects.filter(puzzle__number=1).count())
+        self.assertTrue(all(uses[0]['number'] == 1 for uses in reused.values()))
+        response = self.client.post(reverse('reused-answers'), {'ipuz': ipuz, 'number': '1'})
+        self.assertEqual(response.json(), {'reused': {}})
+        response = self.client.post(reverse('reused-answers'), {'ipuz': '{"clues": 1}'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('reused-answers')).status_code, 405)
+
+class SolveProgressTests(TestCase):
+    """Tests for keeping solvers' progress on the server."""
+
+    def setUp(self):
+        create_puzzle_range()
+        get_user()
+        progress_buffer.flush()
+        self.client.login(username='test', password='password')
+
+    def tearDown(self):
+        progress_buffer.flush()
+
+    def post_progress(self, *updates):
+        """Send some progress as the grid would."""
+        return self.client.post(reverse('progress'), {'progress': json.dumps(
+            [{'author': 'super', 'number': number, 'letters': letters}
+             for number, letters in updates])})
+
+    def get_progress(self, number):
+        """Fetch the progress for a puzzle as the grid would."""
+        response = self.client.get(reverse('progress'), {'author': 'super', 'number': number})
+        return response.json()['letters']
+
+    def test_pack_letters(self):
+        """Check that grid letters are packed a byte apiece, and nonsense is refused."""
+        self.assertEqual(pack_letters('AB..Z', 15), b'AB..Z')
+        self.assertIsNone(pack_letters('ab', 15))
+        self.assertIsNone(pack_letters('', 15))
+        self.assertIsNone(pack_letters('A' * 226, 15))
+        self.assertIsNone(pack_letters(['A'], 15))
+
+    def test_batched_writes(self):
+        """Check that progress is written out in batches, keeping only the latest."""
+        self.assertIsNone(self.get_progress(1))
+        self.assertEqual(self.post_progress((1, 'A....')).json(), {'saved': 1})
+        self.assertEqual(self.post_progress((1, 'AB...')).json(), {'saved': 1})
+        self.assertEqual(SolveProgress.objects.count(), 0)
+        # Loading the puzzle writes out its waiting progress first
+        self.assertEqual(self.get_progress(1), 'AB...')
+        self.assertEqual(bytes(SolveProgress.objects.get().letters), b'AB...')
+        self.post_progress((1, 'ABC..'))
+        progress_buffer.flush()
+        self.assertEqual(bytes(SolveProgress.objects.get().letters), b'ABC..')
+
+    def test_survives_edit(self):
+        """Check that the setter saving over a puzzle keeps solvers' progress, saved or waiting."""
+        self.post_progress((1, 'AB...'), (2, 'C'))
+        progress_buffer.flush()
+        self.post_progress((1, 'ABC..'))
+        for number in (1, 2):
+            save_puzzle(get_superuser(), number, make_ipuz_json(number), True)
+        progress_buffer.flush()
+        self.assertEqual(self.get_progress(1), 'ABC..')
+        self.assertEqual(self.get_progress(2), 'C')
+        self.assertEqual(SolveProgress.objects.count(), 2)
+
+    def test_timed_flush(self):
+        """Check that a worker keeps a timer running to write out progress which has waited."""
+        self.post_progress((1, 'A'))
+        self.assertTrue(progress_buffer.timer.is_alive())
+        buffer = ProgressBuffer()
+        with buffer.lock:
+            self.assertFalse(buffer.is_old())
+            buffer.pending[(1, 1)] = (b'A', timezone.now())
+            self.assertFalse(buffer.is_old())
+            buffer.started -= settings.PROGRESS_BATCH_SECONDS
+            self.assertTrue(buffer.is_old())
+
+    @override_settings(PROGRESS_BATCH_SIZE=2)
+    def test_full_batch(self):
+        """Check that a full batch is written out in one go."""
+        # The session and user, then the puzzles
+        with self.assertNumQueries(3):
+            self.post_progress((0, 'A'))
+        # Then check they still exist and upsert all the progress
+        with self.assertNumQueries(5):
+            self.post_progress((1, 'B'), (2, 'C'))
+        self.assertEqual(SolveProgress.objects.count(), 3)
+        self.assertEqual(self.get_progress(2), 'C')
+
+    def test_visible_puzzles_only(self):
+        """Check that progress is only kept for puzzles the solver can see."""
+        self.assertEqual(self.post_progress((3, 'A'), (99, 'B'), (1, 'b')).json(),
+                         {'saved': 0})
+        self.assertIsNone(self.get_progress(3))
+
+    def test_bad_requests(self):
+        """Check that anonymous solvers and malformed requests are turned away."""
+        response = self.client.post(reverse('progress'), {'progress': '{"author": "super"}'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('progress')).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.post_progress((1, 'A')).status_code, 403)
+
+    def test_page_syncs_logged_in(self):
+        """Check that the puzzle page only syncs progress for logged in solvers."""
+        response = self.client.get(reverse('puzzle', args=['super', 1]))
+        self.assertContains(response, 'GridModule.ProgressSync')
+        self.client.logout()
+        response = self.client.get(reverse('puzzle', args=['super', 1]))
+        self.assertNotContains(response, 'GridModule.ProgressSync')
+
+class DraftTests(TestCase):
+    """Tests for autosaving drafts from the composer."""
+
+    def setUp(self):
+        get_user()
+        self.client.login(username='test', password='password')
+        self.ipuz = json.loads(make_ipuz_json(0, 5))
+
+    def patch(self, version, operations, number=''):
+        """Send a patch as the composer would."""
+        return self.client.post(reverse('draft'), {'number': number, 'version': version,
+                                                   'patch': json.dumps(operations)})
+
+    def get_draft(self, number=''):
+        """Fetch a draft as the composer would."""
+        return self.client.get(reverse('draft'), {'number': number}).json()
+
+    def test_apply_patch(self):
+        """Check that operations change single squares and clues, and nothing else."""
+        ipuz = apply_patch(None, [{'path': [], 'value': self.ipuz}])
+        ipuz = apply_patch(ipuz, [{'path': ['solution', 0, 0], 'value': 'Q'},
+                                  {'path': ['clues', 'Across', 0, 'clue'], 'value': 'New'},
+                                  {'path': ['clues', 'Down', len(ipuz['clues']['Down'])],
+                                   'value': {'number': 9, 'clue': 'Extra'}}])
+        self.assertEqual(ipuz['solution'][0][0], 'Q')
+        self.assertEqual(ipuz['clues']['Across'][0]['clue'], 'New')
+        self.assertEqual(ipuz['clues']['Down'][-1]['clue'], 'Extra')
+        for operations in [[{'path': ['author'], 'value': 'someone'}],
+                           [{'path': ['solution', 99, 0], 'value': 'Q'}],
+                           [{'path': ['clues', 'Across', 'x'], 'value': {}}],
+                           [{'path': ['clues'], 'value': []}],
+                           [{'path': [], 'value': {'puzzle': []}}],
+                           [{'path': ['solution', 0, 0], 'value': 'Q' * 70000}],
+                           [{'value': 'Q'}], {'path': []}]:
+            with self.assertRaises(ValidationError):
+                apply_patch(json.loads(json.dumps(ipuz)), operations)
+        with self.assertRaises(ValidationError):
+            apply_patch(None, [{'path': ['solution', 0, 0], 'value': 'Q'}])
+
+    def test_autosave(self):
+        """Check that patches build up a draft version by version."""
+        self.assertEqual(self.get_draft(), {'version': 0, 'ipuz': None})
+        self.assertEqual(self.patch(0, [{'path': [], 'value': self.ipuz}]).json(),
+                         {'version': 1})
+        self.assertEqual(self.patch(1, [{'path': ['solution', 0, 0], 'value': 'Q'}]).json(),
+                         {'version': 2})
+        draft = self.get_draft()
+        self.assertEqual(draft['version'], 2)
+        self.assertEqual(draft['ipuz']['solution'][0][0], 'Q')
+
+        # A patch from another device which hasn't caught up yet
+        response = self.patch(1, [{'path': ['solution', 0, 0], 'value': 'Z'}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], 2)
+        self.assertEqual(response.json()['ipuz']['solution'][0][0], 'Q')
+
+        self.assertEqual(self.patch(2, [{'path': ['title'], 'value': 'x'}]).status_code, 400)
+        self.assertEqual(self.patch(2, 'nonsense').status_code, 400)
+        self.assertEqual(self.get_draft()['version'], 2)
+
+    def test_puzzle_untouched(self):
+        """Check that drafts of a saved puzzle leave it alone until it's saved again."""
+        save_puzzle(get_user(), 1, json.dumps(self.ipuz), True)
+        answers = list(Entry.objects.order_by('id').values_list('answer', flat=True))
+        edited = json.loads(json.dumps(self.ipuz))
+        edited['clues']['Across'][0]['clue'] = 'Edited'
+        self.patch(0, [{'path': [], 'value': edited}], 1)
+        self.assertEqual(list(Entry.objects.order_by('id').values_list('answer', flat=True)),
+                         answers)
+        self.assertEqual(self.get_draft()['ipuz'], None)
+        self.assertEqual(self.get_draft(1)['ipuz']['clues']['Across'][0]['clue'], 'Edited')
+
+        self.client.post(reverse('save'), {'author': 'test', 'number': '1', 'visibility': 'public',
+                                           'ipuz': json.dumps(edited)})
+        self.assertEqual(Entry.objects.filter(clue='Edited').count(), 1)
+        self.assertEqual(self.get_draft(1), {'version': 2, 'ipuz': None})
+
+    def test_new_puzzle_saved(self):
+        """Check that saving a new puzzle clears its draft, and discarding one does the same."""
+        self.patch(0, [{'path': [], 'value': self.ipuz}])
+        self.client.post(reverse('save'), {'author': '', 'number': '', 'visibility': 'public',
+                                           'ipuz': json.dumps(self.ipuz)})
+        self.assertEqual(self.get_draft(), {'version': 2, 'ipuz': None})
+        self.patch(2, [{'path': [], 'value': self.ipuz}])
+        self.client.post(reverse('draft'), {'number': '', 'discard': '1'})
+        self.assertEqual(self.get_draft(), {'version': 4, 'ipuz': None})
+        self.assertEqual(Draft.objects.count(), 1)
+
+    def test_not_allowed(self):
+        """Check that drafts are only kept for the setter's own puzzles."""
+        create_puzzle_range()
+        self.assertEqual(self.patch(0, [{'path': [], 'value': self.ipuz}], 1).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.patch(0, [{'path': [], 'value': self.ipuz}]).status_code, 403)
+        self.assertEqual(Draft.objects.count(), 0)
+
+class PrintTests(TestCase):
+    """Tests for printable copies of puzzles and booklets."""
+
+    def check_pdf(self, data, pages):
+        """Helper to check that a PDF's cross-reference table points at its objects."""
+        self.assertTrue(data.startswith(b'%PDF-1.4'))
+        self.assertTrue(data.endswith(b'%%EOF\n'))
+        xref = int(data.rsplit(b'startxref\n', 1)[1].split()[0])
+        table = data[xref:].split(b'trailer')[0].split(b'\n')[3:-1]
+        for object_id, line in enumerate(table, 1):
+            offset = int(line.split()[0])
+            self.assertTrue(data[offset:].startswith(f'{object_id} 0 obj'.encode()))
+        self.assertIn(f'/Count {pages}'.encode(), data)
+
+    def test_print_svg(self):
+        """Check the grid, numbers and clues of a printable SVG."""
+        create_puzzle_range()
+        url = reverse('print-svg', args=['super', 1])
+        response = self.client.get(url, follow=True)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('immutable', response['Cache-Control'])
+        svg = response.content.decode()
+        self.assertEqual(svg.count('<rect'), 10)
+        self.assertEqual(svg.count('fill:rgb(0,0,0)'), 1)
+        self.assertIn('>Across</text>', svg)
+        self.assertIn('>1a (2,1)</text>', svg)
+        self.assertIn('>3a (1-2)</text>', svg)
+
+    def test_print_pdf(self):
+        """Check that a printable PDF is well formed and only available when the puzzle is."""
+        create_puzzle_range()
+        response = self.client.get(reverse('print-pdf', args=['super', 1]), follow=True)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.check_pdf(response.content, 1)
+        response = self.client.get(reverse('print-pdf', args=['super', 3]), follow=True)
+        self.assertEqual(response.status_code, 403)
+
+    def test_clue_text(self):
+        """Check that clues are printed as plain text, safely escaped."""
+        puz = create_small_puzzle()
+        puz.pub_date = timezone.now()
+        puz.save()
+        Entry.objects.filter(puzzle=puz, clue='1a').update(
+            clue='<i>Fish</i> &amp; chips <b>(2)</b>')
+        svg = self.client.get(reverse('print-svg', args=['super', puz.number]), follow=True)
+        self.assertIn('>Fish &amp; chips (2) (2,1)</text>', svg.content.decode())
+
+    def test_long_clues_shrink(self):
+        """Check that the clues of a big puzzle are made smaller until they fit on the page."""
+        puz = Puzzle.objects.create(user=get_superuser(), size=15)
+        for y in range(15):
+            for down in [False, True]:
+                Entry.objects.create(puzzle=puz, clue='A rather long clue ' * 6, answer='a' * 15,
+                                     x=0 if not down else y, y=y if not down else 0, down=down)
+        shapes = get_print_layout(puz)
+        self.assertTrue(all(shape[2] <= PAGE_HEIGHT for shape in shapes))
+        sizes = {shape[3] for shape in shapes if shape[0] == 'text' and not shape[5]}
+        self.assertLess(min(sizes), 9)
+
+    def test_print_booklet(self):
+        """Check that a booklet has a page for each published puzzle asked for."""
+        create_puzzle_range()
+        stream = BytesIO()
+        with open(os.devnull, 'w', encoding='utf-8') as devnull:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'booklet.pdf')
+                call_command('print_booklet', path, '--user', 'super', '--first', '1',
+                             stderr=devnull)
+                with open(path, 'rb') as booklet:
+                    stream.write(booklet.read())
+        self.check_pdf(stream.getvalue(), 2)
+
+class PreviewTests(TestCase):
+    """Tests for preview images of puzzles' grids."""
+
+    def test_preview_shared(self):
+        """Check that puzzles with the same grid share one preview, not redrawn for clue edits."""
+        first = create_small_puzzle()
+        second = create_small_puzzle()
+        self.assertEqual(update_preview(first), update_preview(second))
+        self.assertEqual(Preview.objects.count(), 1)
+        Entry.objects.filter(puzzle=first).update(clue='Changed')
+        update_preview(first)
+        self.assertEqual(Preview.objects.count(), 1)
+        Entry.objects.filter(puzzle=second, down=True, x=2).delete()
+        Entry.objects.filter(puzzle=second, down=False, y=2).update(answer='xy')
+        self.assertNotEqual(update_preview(second), first.grid_hash)
+        self.assertEqual(Preview.objects.count(), 2)
+
+    def test_preview_images(self):
+        """Check the SVG and PNG previews are served with long-lived caching."""
+        grid_hash = update_preview(create_small_puzzle())
+        response = self.client.get(reverse('preview', args=[grid_hash, 'svg']))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn(b'viewBox="0 0 30 30"', response.content)
+        self.assertEqual(response.content.count(b'fill:rgb(0,0,0)'), 1)
+        self.assertNotIn(b'>A<', response.content)
+
+        png = self.client.get(reverse('preview', args=[grid_hash, 'png'])).content
+        self.assertTrue(png.startswith(b'\x89PNG\r\n\x1a\n'))
+        width, height = int.from_bytes(png[16:20], 'big'), int.from_bytes(png[20:24], 'big')
+        self.assertEqual((width, height), (61, 61))
+        length = int.from_bytes(png[33:37], 'big')
+        pixels = zlib.decompress(png[41:41 + length])
+        self.assertEqual(len(pixels), 61 * 62)
+        # The middle of the block in the centre is black, and the squares around it white
+        self.assertEqual(pixels[30 * 62 + 1 + 30], 0)
+        self.assertEqual(pixels[10 * 62 + 1 + 10], 255)
+
+        response = self.client.get(reverse('preview', args=['0' * 40, 'png']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_saved_puzzle_preview(self):
+        """Check that saving a puzzle draws its preview and links it from the puzzle page."""
+        get_user()
+        self.client.login(username='test', password='password')
+        self.client.post(reverse('save'), {'author': '', 'number': '', 'visibility': 'public',
+                                           'ipuz': make_ipuz_json(1)})
+        puz = Puzzle.objects.get(user__username='test')
+        self.assertTrue(Preview.objects.filter(grid_hash=puz.grid_hash).exists())
+        response = self.client.get(reverse('puzzle', args=['test', puz.number]))
+        self.assertContains(response, f'/previews/{puz.grid_hash}.png"')
+        self.assertContains(response, 'og:image')
+        response = self.client.get(reverse('users'))
+        self.assertContains(response, f'/previews/{puz.grid_hash}.svg"')
+
+    def test_backfill(self):
+        """Check that the backfill draws missing previews and clears out unused ones."""
+        create_puzzle_range()
+        Preview.objects.create(grid_hash='1' * 40, size=3, svg='', png=b'')
+        with open(os.devnull, 'w', encoding='utf-8') as devnull:
+            call_command('backfill_previews', stdout=devnull)
+        self.assertEqual(Preview.objects.count(), 1)
+        self.assertEqual(Puzzle.objects.filter(pub_date__lte=timezone.now())
+                         .exclude(grid_hash='').count(), 3)
+        self.assertEqual(backfill(), (0, 0))
+
+class PublishingTests(TestCase):
+    """Tests for warming up the site as scheduled puzzles go live."""
+
+    def test_upcoming(self):
+        """Check that the next scheduled puzzles are found, ignoring unscheduled ones."""
+        now = timezone.now()
+        self.assertEqual(get_upcoming(now), (None, []))
+        create_empty_staff_puzzle(1, default_pub_date())
+        self.assertEqual(get_upcoming(now), (None, []))
+        due = now + timedelta(hours=1)
+        puz = create_empty_staff_puzzle(2, due)
+        create_empty_staff_puzzle(3, now + timedelta(hours=2))
+        self.assertEqual(get_upcoming(now), (due, [puz]))
+
+    def test_wait(self):
+        """Check that the worker sleeps until it's time to prepare, then until publication."""
+        now = timezone.now()
+        self.assertEqual(get_wait(now, None, 60, 300), 300)
+        self.assertEqual(get_wait(now, now + timedelta(hours=1), 60, 300), 300)
+        self.assertEqual(get_wait(now, now + timedelta(seconds=100), 60, 300), 40)
+        self.assertEqual(get_wait(now, now + timedelta(seconds=30), 60, 300), 30)
+        self.assertEqual(get_wait(now, now - timedelta(seconds=1), 60, 300), 0)
+
+    def test_prepare(self):
+        """Check that the ipuz and preview are ready before publication."""
+        puz = create_small_puzzle()
+        prepare([puz])
+        self.assertTrue(Preview.objects.filter(grid_hash=puz.grid_hash).exists())
+        self.assertIsNotNone(cache.get('ipuz:' + get_puzzle_version(puz)))
+        response = self.client.get(reverse('puzzle', args=['super', puz.number]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_release(self):
+        """Check that the home page and catalogue pages are cached when a puzzle goes live."""
+        create_puzzle_range()
+        with tempfile.TemporaryDirectory() as root:
+            with override_settings(PRERENDER_ROOT=root):
+                puz = create_empty_staff_puzzle(10, timezone.now())
+                paths = release(get_released(timezone.now() - timedelta(minutes=1),
+                                             timezone.now()))
+                self.assertIn(reverse('puzzle', args=['super', 10]), paths)
+                self.assertTrue(os.path.exists(os.path.join(
+                    get_page_dir(reverse('puzzle', args=['super', 10])), 'index.html')))
+        self.assertIn(reverse('rss'), paths)
+        self.assertIn(reverse('sitemap'), paths)
+        with self.assertNumQueries(2):
+            # Only the visitor log is touched
+            response = self.client.get('/')
+        self.assertContains(response, f'data-number="{puz.number}"')
+
+    def test_worker_once(self):
+        """Check that a single pass of the worker releases puzzles which have just gone live."""
+        create_empty_staff_puzzle(1, timezone.now())
+        out = StringIO()
+        call_command('publish_worker', stdout=out)
+        self.assertIn('Published 1 puzzles', out.getvalue())
+
+class GridAnalysisTests(TestCase):
+    """Tests for the analysis of grids' symmetry, checking and word lengths."""
+
+    def test_small_grid(self):
+        """Check the statistics of a 3x3 grid with a block in the middle."""
+        analysis = analyse_grid(3, {(1, 1)})
+        self.assertEqual(analysis['lights'], 8)
+        self.assertEqual(analysis['words'], 4)
+        self.assertEqual(analysis['lengths'], {'3': 4})
+        self.assertEqual((analysis['checked'], analysis['unchecked']), (4, 4))
+        self.assertTrue(analysis['rotational'])
+        self.assertTrue(analysis['quarter_turn'])
+        self.assertTrue(analysis['mirror'])
+
+    def test_asymmetric_grid(self):
+        """Check word lengths and symmetry of a 5x5 grid, with no words off the end of a row."""
+        blocks = {(3, 0), (4, 0), (1, 2), (0, 4)}
+        analysis = analyse_grid(5, blocks)
+        self.assertEqual(analysis['lights'], 21)
+        self.assertEqual(analysis['lengths'], {'2': 2, '3': 2, '4': 4, '5': 3})
+        self.assertEqual(analysis['words'], 11)
+        # Only the lone square left of the middle block is in a single word
+        self.assertEqual((analysis['checked'], analysis['unchecked']), (20, 1))
+        self.assertFalse(analysis['rotational'] or analysis['quarter_turn'] or analysis['mirror'])
+        self.assertTrue(analyse_grid(5, {(0, 0), (4, 4)})['rotational'])
+        self.assertFalse(analyse_grid(5, {(0, 0), (4, 4)})['quarter_turn'])
+        self.assertTrue(analyse_grid(5, {(0, 0), (4, 0)})['mirror'])
+
+    def test_create_page_stats(self):
+        """Check that the create page describes each blank grid, in the order they're shown."""
+        blank = Blank.objects.create(size=3, display_order=2)
+        Block.objects.create(blank=blank, x=1, y=1)
+        Blank.objects.create(size=3, display_order=1)
+        response = self.client.get(reverse('create'))
+        self.assertEqual(response.context['blank_stats'],
+                         ['Quarter-turn symmetry, 6 words of 3 letters, 100% checked',
+                          'Quarter-turn symmetry, 4 words of 3 letters, 50% checked'])
+        self.assertContains(response, '<script id="blank-stats" type="application/json">')
+        # Serving the page doesn't write anything, that's left to analyse_grids
+        self.assertFalse(GridAnalysis.objects.exists())
+        call_command('analyse_grids', stdout=StringIO())
+        blank.refresh_from_db()
+        self.assertEqual(describe_analysis(GridAnalysis.objects.get(grid_hash=blank.grid_hash)),
+                         response.context['blank_stats'][1])
+
+    def test_analyse_grids(self):
+        """Check that the command analyses every puzzle, once per grid, and the admin shows it."""
+        create_puzzle_range()
+        output = StringIO()
+        call_command('analyse_grids', stdout=output)
+        self.assertIn('5 puzzles', output.getvalue())
+        self.assertEqual(GridAnalysis.objects.count(), 1)
+        self.assertEqual(Puzzle.objects.exclude(grid_hash='').count(), 5)
+        self.client.force_login(get_superuser())
+        response = self.client.get(reverse('admin:puzzle_puzzle_changelist'))
+        self.assertContains(response, 'Quarter-turn symmetry', count=5)
+        response = self.client.get(reverse('admin:puzzle_gridanalysis_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+
+class BlankDuplicateTests(TestCase):
+    """Tests for finding blank grids which are copies of each other, turned or flipped."""
+
+    def setUp(self):
+        cache.clear()
+
+    def create_blank(self, blocks, display_order=100):
+        """Helper to add a 15x15 blank grid with the given blocks."""
+        blank = Blank.objects.create(display_order=display_order)
+        Block.objects.bulk_create([Block(blank=blank, x=x, y=y) for x, y in blocks])
+        return blank
+
+    def test_pattern_hash(self):
+        """Check that every orientation of a pattern has the same hash, and others don't."""
+        blocks = {(3, 0), (4, 0), (1, 2), (0, 4)}
+        turned = {(4 - y, x) for x, y in blocks}
+        flipped = {(4 - x, y) for x, y in blocks}
+        self.assertEqual(get_pattern_hash(5, blocks), get_pattern_hash(5, turned))
+        self.assertEqual(get_pattern_hash(5, blocks), get_pattern_hash(5, flipped))
+        self.assertNotEqual(get_pattern_hash(5, blocks), get_pattern_hash(5, {(0, 0)}))
+        self.assertNotEqual(get_pattern_hash(5, set()), get_pattern_hash(4, set()))
+
+    def test_create_page_offers_pattern_once(self):
+        """Check that the create page shows one thumbnail for a blank and its turned copy."""
+        first = self.create_blank({(0, 0), (1, 0)}, display_order=1)
+        self.create_blank({(14, 0), (14, 1)}, display_order=2)
+        self.create_blank({(2, 2)}, display_order=3)
+        response = self.client.get(reverse('create'))
+        self.assertEqual(response.context['thumbs'],
+                         [create_thumbnail(first, 10), create_thumbnail(Blank.objects.last(), 10)])
+        self.assertEqual(len(response.context['blank_stats']), 2)
+        self.assertIn('thumbnail:' + get_grid_hash(15, {(0, 0), (1, 0)}), cache)
+
+    def test_import_warns_of_copies(self):
+        """Check that importing a flipped copy of a blank warns, and the admin lists the pair."""
+        original = self.create_blank({(0, 0), (1, 0), (2, 2)})
+        self.client.force_login(get_superuser())
+        call_command('analyse_grids', stdout=StringIO())
+        flipped = {(14, 0), (13, 0), (12, 2)}
+        ipuz = json.dumps({'puzzle': [['#' if (x, y) in flipped else 0 for x in range(15)]
+                                      for y in range(15)]})
+        response = self.client.post(reverse('admin:puzzle_blank_add'), {
+            'display_order': 100, 'file_import': SimpleUploadedFile('blank.ipuz', ipuz.encode()),
+            'block_set-TOTAL_FORMS': 0, 'block_set-INITIAL_FORMS': 0,
+            'block_set-MIN_NUM_FORMS': 0, 'block_set-MAX_NUM_FORMS': 1000}, follow=True)
+        copy = Blank.objects.latest('id')
+        self.assertContains(response, f'has the same pattern as blank {original.id}')
+        self.assertEqual(copy.pattern_hash, Blank.objects.get(id=original.id).pattern_hash)
+        self.assertNotEqual(copy.grid_hash, Blank.objects.get(id=original.id).grid_hash)
+
+        self.create_blank({(1, 1)})
+        response = self.client.get(reverse('admin:puzzle_blank_changelist') + '?duplicated=yes')
+        self.assertEqual([blank.id for blank in response.context['cl'].result_list],
+                         [original.id, copy.id])
+        output = StringIO()
+        call_command('analyse_grids', stdout=output)
+        self.assertIn(f'Blanks with the same pattern: {original.id}, {copy.id}', output.getvalue())
+
+
 class GridCreationTests(TestCase):
     """Tests for the grid rendering process."""
 
@@ -613,6 +1949,21 @@ class PuzzleAdminTests(TestCase):
         self.verify_entry(entries[3], {'puzzle': puz, 'clue': '2d', 'answer': 'c-nz',
                                        'startx': 2, 'starty': 0, 'down': True})
 
+    def test_admin_import_analysed(self):
+        """Check that a puzzle imported through the admin gets its preview and analysis."""
+        user = get_superuser()
+        self.client.force_login(user)
+        with open('puzzle/test_data/small.xml', 'rb') as file:
+            self.client.post(reverse('admin:puzzle_puzzle_add'), {
+                'number': 1, 'user': user.id, 'pub_date_0': '2020-01-01',
+                'pub_date_1': '00:00:00', 'comments': '', 'file_import': file,
+                'entry_set-TOTAL_FORMS': 0, 'entry_set-INITIAL_FORMS': 0,
+                'entry_set-MIN_NUM_FORMS': 0, 'entry_set-MAX_NUM_FORMS': 1000})
+        puz = Puzzle.objects.get(user=user, number=1)
+        self.assertNotEqual(puz.grid_hash, '')
+        self.assertTrue(Preview.objects.filter(grid_hash=puz.grid_hash).exists())
+        self.assertTrue(GridAnalysis.objects.filter(grid_hash=puz.grid_hash).exists())
+
     def verify_block(self, block, blank, x_coord, y_coord):
         """Helper to check that an individual block matches expected parameters."""
         self.assertEqual(block.blank, blank)
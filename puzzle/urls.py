@@ -2,25 +2,51 @@
 Map puzzle URLs to views. Also maps the root URL to the latest puzzle.
 """
 
+from django.conf import settings
 from django.urls import include, re_path
 from django.contrib.auth import views as auth_views
-from puzzle import views
+from django.contrib.sitemaps import views as sitemap_views
+from puzzle import async_views, views
+from puzzle.caching import cache_catalogue_page
 from puzzle.feeds import PuzzleFeed
+from puzzle.sitemaps import SITEMAPS
+
+# The read-only pages have asynchronous versions for running under ASGI
+read_views = async_views if settings.ASYNC_VIEWS else views #pylint: disable=invalid-name
+rss_view = cache_catalogue_page( #pylint: disable=invalid-name
+    async_views.rss if settings.ASYNC_VIEWS else PuzzleFeed())
 
 urlpatterns = [
-    re_path(r'^$', views.latest, name='latest'),
+    re_path(r'^$', read_views.latest, name='latest'),
     re_path(r'^login/$', auth_views.LoginView.as_view(template_name='puzzle/login.html'),
             name='login'),
     re_path(r'^logout/$', views.logout_user, name='logout'),
     re_path(r'^create/$', views.create, name='create'),
     re_path(r'^save/$', views.save, name='save'),
-    re_path(r'^rss/$', PuzzleFeed(), name='rss'),
+    re_path(r'^rss/$', rss_view, name='rss'),
+    re_path(r'^sitemap\.xml$', cache_catalogue_page(sitemap_views.index),
+            {'sitemaps': SITEMAPS, 'sitemap_url_name': 'sitemap-section'}, name='sitemap'),
+    re_path(r'^sitemap-(?P<section>\w+)\.xml$', cache_catalogue_page(sitemap_views.sitemap),
+            {'sitemaps': SITEMAPS}, name='sitemap-section'),
     re_path(r'^archive/$', views.users, name='users'),
+    re_path(r'^search/$', views.search, name='search'),
+    re_path(r'^api/puzzles/$', views.puzzle_list, name='puzzle-list'),
+    re_path(r'^api/answers/$', views.past_answers, name='past-answers'),
+    re_path(r'^api/answers/reused/$', views.reused_answers, name='reused-answers'),
+    re_path(r'^api/progress/$', views.progress, name='progress'),
+    re_path(r'^api/drafts/$', views.draft, name='draft'),
+    re_path(r'^previews/(?P<grid_hash>[0-9a-f]{40})\.(?P<extension>svg|png)$', views.preview,
+            name='preview'),
     re_path(r'^profile/$', views.profile, name='profile'),
     re_path(r'^puzzle/(?P<number>\d+)/$', views.puzzle_redirect),
     re_path(r'^setter/(?P<author>\w+)/(?P<number>\d+)/', include([
-        re_path(r'^$', views.puzzle, name='puzzle'),
-        re_path(r'^solution/$', views.solution, name='solution'),
+        re_path(r'^$', read_views.puzzle, name='puzzle'),
+        re_path(r'^solution/$', read_views.solution, name='solution'),
+        re_path(r'^ipuz/$', views.puzzle_ipuz, name='ipuz'),
+        re_path(r'^print\.svg$', views.print_svg, name='print-svg'),
+        re_path(r'^print\.pdf$', views.print_pdf, name='print-pdf'),
+        re_path(r'^lite/$', views.puzzle_lite, name='lite'),
+        re_path(r'^embed/$', views.embed, name='embed'),
         re_path(r'^edit/$', views.edit, name='edit'),
     ])),
 ]
@@ -5,36 +5,57 @@ Pull the details of puzzles and blank grids out of the database and
 wrangle them into their templates.
 """
 
+import json
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model, logout
-from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.decorators.gzip import gzip_page
-from puzzle.construction import display_puzzle, get_date_string
-from puzzle.construction import create_thumbnail, get_or_create_user, save_puzzle
-from puzzle.models import Puzzle, Blank
+from django.views.decorators.http import require_POST
+from instrumentation.metrics import timed
+from puzzle.analysis import index_puzzle
+from puzzle.answers import find_reused_answers, match_answers
+from puzzle.caching import cache_catalogue_data, cache_catalogue_page, catalogue_timeout
+from puzzle.caching import HOME_DESCRIPTION, HOME_TITLE, catalogue_version, get_home_page
+from puzzle.caching import get_blank_stats, get_latest_puzzle, get_thumbnails
+from puzzle.construction import display_puzzle, get_archive_list, get_date_string
+from puzzle.construction import create_ipuz, get_puzzle_listing, get_puzzle_version
+from puzzle.construction import get_puzzle_title, get_solution_title
+from puzzle.construction import get_ipuz_entries, get_or_create_user, save_puzzle
+from puzzle.drafts import clear_draft, load_draft, patch_draft
+from puzzle.models import Puzzle, allocate_number
+from puzzle.previews import get_preview_image
+from puzzle.printing import create_print_pdf, create_print_svg
+from puzzle.prerender import rebuild_for_user, serve_prerendered
+from puzzle.progress import load_progress, save_progress
+from puzzle.search import search_clues
+from visitors.models import queue_request, save_request
 
 @gzip_page
 def latest(request):
     """Show the latest published puzzle."""
-    obj = Puzzle.objects.filter(user__is_staff=True,
-                                pub_date__lte=timezone.now()).latest('pub_date')
-    title = 'Three Pins - A cryptic crossword outlet'
-    description = 'A free interactive site dedicated to amateur cryptic crosswords. ' \
-                  'Solve online or on paper.'
-    return display_puzzle(request, obj, title, description, 'puzzle/puzzle.html')
+    if not request.user.is_authenticated:
+        content = get_home_page()
+        with timed('log'):
+            save_request(request)
+        return HttpResponse(content)
+    return display_puzzle(request, get_latest_puzzle(), HOME_TITLE, HOME_DESCRIPTION,
+                          'puzzle/puzzle.html')
 
+@serve_prerendered(log_visit=True)
 @gzip_page
 def puzzle(request, author, number):
     """Show a puzzle by puzzle number."""
     obj = get_object_or_404(Puzzle, user__username=author, number=number)
-    title = 'Crossword #' + number + ' | ' + author + ' | Three Pins'
-    description = 'Crossword #' + number + 'by ' + author + ', first published on ' + \
-                  get_date_string(obj) + '.'
+    title, description = get_puzzle_title(obj)
     return display_puzzle(request, obj, title, description, 'puzzle/puzzle.html')
 
 def puzzle_redirect(request, number): #pylint: disable=unused-argument
@@ -55,21 +76,125 @@ def edit(request, author, number):
                   get_date_string(obj) + '.'
     return display_puzzle(request, obj, title, description, 'puzzle/edit.html')
 
+@serve_prerendered(log_visit=True)
 @gzip_page
 def solution(request, author, number):
     """Show a solution by puzzle number."""
     obj = get_object_or_404(Puzzle, user__username=author, number=number)
-    title = 'Solution #' + number + ' | ' + author + ' | Three Pins'
+    title = get_solution_title(obj)
     return display_puzzle(request, obj, title, title, 'puzzle/solution.html')
 
+def serve_puzzle_version(request, author, number, url_name, render_data, content_type):
+    """Serve something rendered from a puzzle, like its ipuz or a printable copy.
+
+    Requests are redirected to a URL for the current version of the puzzle,
+    which can then be cached for as long as anyone likes.
+    """
+    obj = get_object_or_404(Puzzle.objects.select_related('user'),
+                            user__username=author, number=number)
+    published = obj.pub_date <= timezone.now()
+    if not published and request.user != obj.user and not request.user.is_staff:
+        raise PermissionDenied
+
+    version = get_puzzle_version(obj)
+    if request.GET.get('v') != version:
+        response = redirect(reverse(url_name, args=[author, number]) + '?v=' + version)
+        if published:
+            patch_cache_control(response, public=True, max_age=60)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    key = url_name + ':' + version
+    data = cache.get(key)
+    if data is None:
+        data = render_data(obj)
+        cache.set(key, data, 60 * 60 * 24)
+
+    response = HttpResponse(data, content_type=content_type)
+    if published:
+        patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@gzip_page
+def puzzle_ipuz(request, author, number):
+    """Serve a puzzle in ipuz format."""
+    return serve_puzzle_version(request, author, number, 'ipuz', create_ipuz, 'application/json')
+
+@gzip_page
+def print_svg(request, author, number):
+    """Serve a printable copy of a puzzle as SVG."""
+    return serve_puzzle_version(request, author, number, 'print-svg', create_print_svg,
+                                'image/svg+xml')
+
+def print_pdf(request, author, number):
+    """Serve a printable copy of a puzzle as PDF, which is compressed already."""
+    response = serve_puzzle_version(request, author, number, 'print-pdf', create_print_pdf,
+                                    'application/pdf')
+    if response.status_code == 200:
+        response['Content-Disposition'] = f'inline; filename="{author}-{number}.pdf"'
+    return response
+
+def preview(request, grid_hash, extension): #pylint: disable=unused-argument
+    """Serve a preview image of a grid, which never changes since the URL names its pattern."""
+    key = f'preview:{grid_hash}.{extension}'
+    data = cache.get(key)
+    if data is None:
+        data = get_preview_image(grid_hash, extension)
+        if data is None:
+            raise Http404
+        cache.set(key, data, 60 * 60 * 24)
+    content_type = 'image/svg+xml' if extension == 'svg' else 'image/png'
+    response = HttpResponse(data, content_type=content_type)
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    return response
+
+@gzip_page
+def puzzle_lite(request, author, number): #pylint: disable=unused-argument
+    """Show a puzzle which is rendered in the browser from its ipuz data.
+
+    The page itself is the same for every puzzle, so anonymous visitors all share one copy.
+    """
+    if request.user.is_authenticated:
+        return render(request, 'puzzle/lite.html')
+
+    content = cache.get('puzzle-lite')
+    if content is None:
+        content = render(request, 'puzzle/lite.html').content
+        cache.set('puzzle-lite', content, 60 * 60 * 24)
+    response = HttpResponse(content)
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24)
+    return response
+
+@xframe_options_exempt
+@gzip_page
+def embed(request, author, number):
+    """Show a published puzzle on its own, for other sites to put in an iframe.
+
+    The page is cached until the catalogue changes, so popular puzzles are served
+    without going near the database. Visits are logged in batches for the same reason.
+    """
+    key = f'embed:{catalogue_version()}:{author}:{number}'
+    content = cache.get(key)
+    if content is None:
+        obj = get_object_or_404(Puzzle.objects.select_related('user'), user__username=author,
+                                number=number, pub_date__lte=timezone.now())
+        context = {'title': get_puzzle_title(obj)[0], 'author': author, 'number': obj.number,
+                   'ipuz': json.loads(create_ipuz(obj))}
+        content = render(request, 'puzzle/embed.html', context).content
+        cache.set(key, content, catalogue_timeout())
+
+    queue_request(request)
+    response = HttpResponse(content)
+    patch_cache_control(response, public=True, max_age=60 * 60)
+    return response
+
 @gzip_page
 def create(request):
     """Initialise the online puzzle creation page with images of the available grids."""
-    blanks = Blank.objects.all().order_by('display_order', 'id')
-    thumbs = []
-    for blank in blanks:
-        thumbs.append(create_thumbnail(blank, 10))
-    context = {'thumbs': thumbs}
+    context = {'thumbs': get_thumbnails(), 'blank_stats': get_blank_stats()}
     return render(request, 'puzzle/create.html', context)
 
 @transaction.atomic
@@ -93,28 +218,134 @@ def save(request):
         raise PermissionDenied
 
     if new_puzzle:
-        previous = Puzzle.objects.filter(user=user).order_by('-number')
-        number = previous[0].number + 1 if previous else 1
+        number = allocate_number(user)
 
-    save_puzzle(user, number, request.POST['ipuz'], public)
+    index_puzzle(save_puzzle(user, number, request.POST['ipuz'], public))
+    clear_draft(user, None if new_puzzle else int(number))
+    transaction.on_commit(lambda: rebuild_for_user(user))
     if new_puzzle:
         context = {'number': number, 'public': public}
         return render(request, 'puzzle/saved.html', context)
     return redirect('puzzle', author=user.username, number=number)
 
+@serve_prerendered()
 def users(request):
     """Show a list of users and their puzzles."""
-    user_model = get_user_model()
-    context = {'user_list': []}
-    for user in user_model.objects.all().order_by('username'):
-        objs = Puzzle.objects.filter(user=user, pub_date__lte=timezone.now()).order_by('-number')
-        if objs:
-            puzzle_list = []
-            for puz in objs:
-                puzzle_list.append({'number': puz.number, 'date': get_date_string(puz)})
-            context['user_list'].append({'name': user.username, 'puzzles': puzzle_list})
+    context = {'user_list': cache_catalogue_data('archive', get_archive_list)}
     return render(request, 'puzzle/users.html', context)
 
+@gzip_page
+def search(request):
+    """Search the clues and answers of published puzzles."""
+    query = request.GET.get('q', '').strip()
+    try:
+        results, cursor = search_clues(query, request.GET.get('cursor'))
+    except ValidationError:
+        return HttpResponseBadRequest('Invalid cursor')
+    context = {'query': query, 'results': results, 'cursor': cursor}
+    return render(request, 'puzzle/search.html', context)
+
+@gzip_page
+@cache_catalogue_page
+def puzzle_list(request):
+    """List published puzzles as JSON, a page at a time.
+
+    Pages follow on from an opaque cursor rather than an offset, so walking the whole
+    catalogue stays cheap. Results can be filtered by setter and publish date, and
+    limited to a selection of fields.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 50)), 1), 200)
+        results, cursor = get_puzzle_listing(request.GET, limit)
+    except (ValueError, ValidationError) as err:
+        return JsonResponse({'error': ' '.join(getattr(err, 'messages', [str(err)]))}, status=400)
+
+    next_url = None
+    if cursor:
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        next_url = request.build_absolute_uri(request.path + '?' + params.urlencode())
+    return JsonResponse({'results': results, 'cursor': cursor, 'next': next_url})
+
+@require_POST
+def reused_answers(request):
+    """List the answers in a puzzle about to be saved which the setter has used before.
+
+    Takes the same ipuz and number as saving the puzzle, so the editor can check
+    its save form before submitting it.
+    """
+    number = request.POST.get('number') or None
+    try:
+        entries = get_ipuz_entries(json.loads(request.POST['ipuz']))
+        reused = find_reused_answers(request.user, [entry['answer'] for entry in entries],
+                                     int(number) if number else None)
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid puzzle'}, status=400)
+    return JsonResponse({'reused': reused})
+
+def past_answers(request):
+    """List the setter's past answers which fit a pattern like ?A?E."""
+    return JsonResponse({'answers': match_answers(request.user, request.GET.get('pattern', ''))})
+
+def progress(request):
+    """Load a logged in solver's progress in a puzzle, or save progress sent by the grid.
+
+    Saves take a batch of updates as JSON in the progress field, and are written
+    out later along with everyone else's (see progress.py).
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+    try:
+        if request.method == 'POST':
+            updates = json.loads(request.POST['progress'])
+            if not isinstance(updates, list):
+                raise ValueError('Progress must be a list')
+            return JsonResponse({'saved': save_progress(request.user, updates)})
+        letters = load_progress(request.user, request.GET['author'], int(request.GET['number']))
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    return JsonResponse({'letters': letters})
+
+def send_draft(user, number):
+    """The latest version of a draft, with the puzzle as it stands in it."""
+    version, ipuz = load_draft(user, number)
+    return JsonResponse({'version': version, 'ipuz': ipuz})
+
+def discard_draft(user, number):
+    """Throw away the unsaved changes in a draft."""
+    clear_draft(user, number)
+    return JsonResponse({'version': load_draft(user, number)[0]})
+
+def apply_draft_patch(user, number, params):
+    """Apply a patch from the composer, or send back the latest version if it's out of date."""
+    obj, applied = patch_draft(user, number, int(params['version']), json.loads(params['patch']))
+    if not applied:
+        return JsonResponse({'version': obj.version, 'ipuz': obj.ipuz}, status=409)
+    return JsonResponse({'version': obj.version})
+
+def draft(request):
+    """Load the setter's draft of a puzzle, or change it with a patch from the composer.
+
+    The number is left empty for a new puzzle. Patches are JSON in the patch
+    field, made against the version in the version field. If the draft has
+    moved on since then, the response is a conflict with the latest version.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Not logged in'}, status=403)
+    params = request.POST if request.method == 'POST' else request.GET
+    try:
+        number = int(params['number']) if params.get('number') else None
+        if number is not None and not Puzzle.objects.filter(user=request.user,
+                                                            number=number).exists():
+            return JsonResponse({'error': 'No such puzzle'}, status=404)
+        if request.method != 'POST':
+            return send_draft(request.user, number)
+        if 'discard' in params:
+            return discard_draft(request.user, number)
+        return apply_draft_patch(request.user, number, params)
+    except (KeyError, ValueError, ValidationError) as err:
+        return JsonResponse({'error': ' '.join(getattr(err, 'messages', [str(err)]))}, status=400)
+
 @login_required
 def profile(request):
     """Show a list of puzzles belonging to the logged in user."""
@@ -0,0 +1,79 @@
+"""
+Get a process ready to serve before it takes its first request.
+
+Under gunicorn with preload_app, this runs once in the master process before
+the workers are forked (see gunicorn.conf.py). The templates are compiled
+into the cached loader and the latest puzzle, archive and create page
+thumbnails (with their grid statistics) are loaded into the cache, then
+everything is frozen out of the garbage collector's way so the workers
+share those pages of memory instead of each copying them. Anything else
+which is slow to build and only ever read, like an index of answers, should
+register itself with register_warmer.
+"""
+
+import gc
+import logging
+from time import perf_counter
+from django.db import connections
+from django.template.loader import get_template
+from puzzle.caching import cache_catalogue_data, get_blank_stats, get_latest_puzzle
+from puzzle.caching import get_thumbnails
+from puzzle.construction import get_archive_list
+from puzzle.models import Puzzle
+
+logger = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+TEMPLATES = ['puzzle/puzzle.html', 'puzzle/solution.html', 'puzzle/users.html',
+             'puzzle/create.html', 'puzzle/embed.html', 'puzzle/lite.html', 'puzzle/search.html']
+
+WARMERS = {}
+
+def register_warmer(name, function):
+    """Add a function to be called with no arguments during warm-up."""
+    WARMERS[name] = function
+
+def compile_templates():
+    """Load the page templates, so the cached loader has them compiled already."""
+    for name in TEMPLATES:
+        get_template(name)
+
+def prime_latest():
+    """Cache the latest puzzle, if there is one yet."""
+    try:
+        get_latest_puzzle()
+    except Puzzle.DoesNotExist:
+        pass
+
+register_warmer('templates', compile_templates)
+register_warmer('latest', prime_latest)
+register_warmer('archive', lambda: cache_catalogue_data('archive', get_archive_list))
+register_warmer('thumbnails', get_thumbnails)
+register_warmer('blank-stats', get_blank_stats)
+
+def warm_up():
+    """Run every warmer, returning how many seconds each took.
+
+    A failing warmer is logged and skipped, as it's no reason not to start serving.
+    """
+    timings = {}
+    for name, function in WARMERS.items():
+        start = perf_counter()
+        try:
+            function()
+        except Exception: #pylint: disable=broad-except
+            logger.exception('Warm-up step %s failed', name)
+            continue
+        timings[name] = perf_counter() - start
+    return timings
+
+def prepare_for_fork():
+    """Get the master process ready to fork its workers.
+
+    Database connections are closed so that workers don't end up sharing them.
+    Everything loaded so far is moved out of reach of the garbage collector,
+    since collections would otherwise write to every object's header, copying
+    pages which the workers could have shared with the master.
+    """
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
@@ -155,6 +155,38 @@ QUnit.test('No suggestions', function(assert) {
 	assert.equal(fixture.getElementsByClassName('warning').length, 1, 'Warning found');
 });
 
+QUnit.test('Past answers', function(assert) {
+	var fixture = document.getElementById('qunit-fixture');
+	setTestWordList();
+
+	Suggestor.showSuggestions(fixture, 'R.D.O');
+	Suggestor._showPastAnswers(fixture, [{letters: 'RADIO', numbers: [3, 7]}]);
+	var warnings = fixture.getElementsByClassName('warning');
+	assert.equal(warnings.length, 1, 'Warning found');
+	assert.equal(warnings[0].textContent, 'YOU\'VE USED: RADIO (#3, #7)', 'Past uses listed');
+
+	Suggestor.clearSuggestions();
+	Suggestor._showPastAnswers(fixture, []);
+	assert.equal(fixture.getElementsByClassName('warning').length, 0, 'Nothing to warn about');
+});
+
+QUnit.module('Draft sync');
+QUnit.test('Patch changes', function(assert) {
+	var diff = new DraftSync('/api/drafts/', 'token', '', 'create-version')._diff;
+	var before = {puzzle: [[1, 0], ['#', 2]], solution: [['A', 0], ['#', 0]],
+				  clues: {Across: [{number: 1, clue: 'One'}], Down: [{number: 1, clue: 'Two'}]}};
+	var after = {puzzle: [[1, 0], ['#', 2]], solution: [['A', 'B'], ['#', 0]],
+				 clues: {Across: [{number: 1, clue: 'Uno'}], Down: []}};
+
+	assert.deepEqual(diff(null, after), [{path: [], value: after}], 'First upload is the whole draft');
+	assert.deepEqual(diff(before, before), [], 'Nothing to send');
+	assert.deepEqual(diff(before, after), [
+		{path: ['solution', 0, 1], value: 'B'},
+		{path: ['clues', 'Across', 0], value: {number: 1, clue: 'Uno'}},
+		{path: ['clues', 'Down'], value: []},
+	], 'Changed square and clues only');
+});
+
 QUnit.module('Clue creator');
 QUnit.test('Create clues', function(assert) {
 	var across = document.createElement('ul');
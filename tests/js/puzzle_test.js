@@ -1150,3 +1150,59 @@ QUnit.test('Migrate storage name', function(assert) {
 	// Clear storage because other tests get upset when the grid size doesn't match
 	localStorage.removeItem('solve-Cyborg-1');
 });
+
+QUnit.test('Sync progress', function(assert) {
+	var size = 3;
+	var nodeList = Builder.createAlternating(size, 1);
+	var grid = createGrid(size, Builder.fixture);
+	var queued = [];
+	var sync = {
+		load: function(callback) {
+			callback('..M.S...');
+		},
+		queue: function(letters) {
+			queued.push(letters);
+		},
+	};
+
+	grid.activateClicked(nodeList.gridItem(0, 0));
+	grid.updateLetters('...', '...H');
+	grid.syncProgress(sync);
+	assert.letterEqual(nodeList.gridItem(0, 0), 'H', 'Local letter kept');
+	assert.letterEqual(nodeList.gridItem(2, 0), 'M', 'Saved letter filled in');
+	assert.deepEqual(queued, ['H.M.S...'], 'Merged progress sent back');
+
+	grid.updateLetters('...H', '...HA');
+	assert.deepEqual(queued, ['H.M.S...', 'HAM.S...'], 'New letters sent');
+	localStorage.removeItem('solve-Cyborg-1');
+});
+
+QUnit.module('Client rendering');
+QUnit.test('Render ipuz', function(assert) {
+	var data = {
+		dimensions: {width: 3, height: 3},
+		puzzle: [[1, 0, 2], [0, '#', 0], [3, 0, 0]],
+		solution: [['A', 'B', 'C'], ['M', '#', 'N'], ['X', 0, 'Z']],
+		clues: {Across: [{number: 1, clue: '1a', enumeration: '2,1'}, {number: 3, clue: '3a', enumeration: '3'}],
+				Down: [{number: 1, clue: '1d', enumeration: '3'}, {number: 2, clue: '2d', enumeration: '3'}]},
+	};
+	var across = document.createElement('ul');
+	var down = document.createElement('ul');
+	GridModule.renderIpuz(data, Builder.fixture, across, down, 'block.png');
+	var nodeList = document.querySelectorAll('#qunit-fixture > div');
+
+	assert.equal(nodeList.length, 9, 'All squares rendered');
+	assert.block(nodeList.gridItem(1, 1), 'Block');
+	assert.light(nodeList.gridItem(1, 0), 'Light');
+	assert.numbered(nodeList.gridItem(2, 0), 'Numbered');
+	assert.notNumbered(nodeList.gridItem(1, 2), 'Not numbered');
+	assert.equal(nodeList.gridItem(2, 2).getAttribute('data-a'), 'Z', 'Answer letter');
+	assert.equal(nodeList.gridItem(1, 2).getAttribute('data-a'), null, 'Unknown letter');
+	assert.ok(nodeList.gridItem(0, 1).classList.contains('leftmost'), 'Left border');
+	assert.equal(across.children.length, 2, 'Across clues');
+	assert.equal(down.children[1].textContent, '2 2d (3)', 'Down clue text');
+	assert.equal(GridModule.formatIpuzDate('03/04/1980'), '04 Mar 1980', 'Date format');
+	assert.equal(GridModule.formatIpuzDate(undefined), 'Unpublished', 'No date');
+
+	Builder.reset();
+});
@@ -0,0 +1,22 @@
+"""
+ASGI config for three_pins project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Running under ASGI switches the read-only puzzle pages to their asynchronous
+versions, unless ASYNC_VIEWS is already set in the environment. Persistent
+connections are off by default too, as the threads running async views'
+queries would each hold one open (set DB_POOL_MAX_SIZE to use a pool).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+#pylint: disable=invalid-name,wrong-import-position
+
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "three_pins.settings")
+os.environ.setdefault("ASYNC_VIEWS", "1")
+os.environ.setdefault("DB_CONN_MAX_AGE", "0")
+
+from django.core.asgi import get_asgi_application
+
+application = get_asgi_application()
@@ -0,0 +1,78 @@
+"""
+Site-wide middleware.
+
+WhiteNoise's middleware only works synchronously, which under ASGI would
+force every request below it onto Django's single thread for sync code and
+serialise the whole site. This version answers static file requests the same
+way but lets everything else carry on asynchronously.
+
+PrimaryPinMiddleware keeps a visitor's reads on the primary database for a
+little while after they change something (see routers.py).
+"""
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+from instrumentation.middleware import HybridMiddleware
+from three_pins.routers import use_primary
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """Serve static files with WhiteNoise, in either a sync or an async request chain."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        """Look up static files off the event loop, since that may mean reading the disk."""
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file,
+                                              thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+class PrimaryPinMiddleware(HybridMiddleware):
+    """Read from the primary database while changing something, and for a few seconds after."""
+    def handle(self, request):
+        token = use_primary.set(self.needs_primary(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            use_primary.reset(token)
+        return self.pin(request, response)
+
+    async def ahandle(self, request):
+        token = use_primary.set(self.needs_primary(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_primary.reset(token)
+        return self.pin(request, response)
+
+    @staticmethod
+    def needs_primary(request):
+        """Whether this request changes something, or follows soon after one that did."""
+        return request.method not in SAFE_METHODS or settings.REPLICA_PIN_COOKIE in request.COOKIES
+
+    @staticmethod
+    def pin(request, response):
+        """Keep the visitor on the primary for a while if they've just changed something."""
+        if (settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS
+                and response.status_code < 400):
+            response.set_cookie(settings.REPLICA_PIN_COOKIE, '1',
+                                max_age=settings.REPLICA_PIN_SECONDS, secure=request.is_secure(),
+                                httponly=True, samesite='Lax')
+        return response
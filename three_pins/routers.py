@@ -0,0 +1,87 @@
+"""
+Send puzzle reads to read replicas, if there are any.
+
+Replicas come from REPLICA_DATABASE_URLS (see settings). Reads of puzzles,
+grids and users go to a randomly chosen replica, everything else and every
+write goes to the primary. Reads stay on the primary inside a transaction,
+for the rest of any request which changes something, and for a few seconds
+afterwards for the visitor who made the change (PrimaryPinMiddleware), so
+nobody saves a puzzle and then finds it missing because a replica is behind.
+
+A replica which can't be connected to is skipped for REPLICA_RETRY_SECONDS.
+Only connecting is checked: a replica failing in the middle of a request
+still fails that request.
+"""
+
+import logging
+from contextvars import ContextVar
+from random import shuffle
+from threading import Lock
+from time import monotonic
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+# Set while handling a request which must see the primary's latest data
+use_primary = ContextVar('use_primary', default=False) #pylint: disable=invalid-name
+
+class ReplicaHealth:
+    """Remember which replicas could be connected to recently."""
+    def __init__(self):
+        self.lock = Lock()
+        self.status = {}
+
+    def set_status(self, alias, available):
+        """Record whether a replica is available, until it's due to be checked again."""
+        with self.lock:
+            self.status[alias] = (available, monotonic() + settings.REPLICA_RETRY_SECONDS)
+
+    def is_available(self, alias):
+        """Whether a replica can be used, connecting to it if it's due a check."""
+        available, until = self.status.get(alias, (None, 0))
+        if monotonic() < until:
+            return available
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as error:
+            logger.warning('Read replica %s is unavailable: %s', alias, error)
+            self.set_status(alias, False)
+            return False
+        self.set_status(alias, True)
+        return True
+
+    def reset(self):
+        """Forget every replica's status."""
+        with self.lock:
+            self.status.clear()
+
+replica_health = ReplicaHealth() #pylint: disable=invalid-name
+
+class ReplicaRouter:
+    """Database router spreading puzzle reads across the read replicas."""
+    read_apps = {'puzzle', 'auth'}
+
+    def db_for_read(self, model, **hints): #pylint: disable=unused-argument
+        """A replica for puzzle reads, when it's safe to use one."""
+        replicas = list(settings.DATABASE_REPLICAS)
+        if (not replicas or model._meta.app_label not in self.read_apps or use_primary.get()
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return None
+        shuffle(replicas)
+        for alias in replicas:
+            if replica_health.is_available(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints): #pylint: disable=unused-argument
+        """Every write goes to the primary."""
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints): #pylint: disable=unused-argument
+        """Replicas hold the same data as the primary, so anything can be related."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints): #pylint: disable=unused-argument
+        """Only migrate the primary, which the replicas copy."""
+        return db not in settings.DATABASE_REPLICAS
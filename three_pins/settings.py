@@ -35,25 +35,30 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.sitemaps',
     'puzzle',
     'contact',
     'visitors',
+    'instrumentation',
 ]
 
 MIDDLEWARE = [
+    'instrumentation.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'three_pins.middleware.WhiteNoiseMiddleware',
+    'three_pins.middleware.PrimaryPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'instrumentation.middleware.ProfilerMiddleware',
 ]
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'instrumentation.templates.DjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, 'templates'),
         ],
@@ -94,8 +99,59 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.7/ref/settings/#databases
 
 # Parse database configuration from $DATABASE_URL
+# Keep database connections open for this many seconds (0 to close them after every request),
+# checking they still work before reusing them. ASGI defaults to 0; set a pool there instead.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+# Set to use a pool of up to this many connections per process instead (needs psycopg 3)
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+
 DATABASES = {}
-DATABASES['default'] = dj_database_url.config()
+DATABASES['default'] = dj_database_url.config(conn_max_age=DB_CONN_MAX_AGE,
+                                              conn_health_checks=True)
+
+# SQLite can't upgrade a read transaction to a write under concurrent load, so
+# take the write lock up front and wait for it rather than failing at once
+if DATABASES['default'].get('ENGINE') == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update(
+        {'transaction_mode': 'IMMEDIATE', 'timeout': 20})
+    # Test on a file as well: threads sharing an in-memory database fail on locks instead of waiting
+    DATABASES['default']['TEST'] = {'NAME': DATABASES['default']['NAME'] + '.test'}
+
+# Cache, in each process's memory unless another backend is given, for instance
+# django.core.cache.backends.db.DatabaseCache with a table name as its location.
+# Anything warmed up by the publish worker needs a cache the web workers share.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Read replicas, as space separated database URLs. Puzzle reads are spread across them.
+DATABASE_REPLICAS = []
+for index, url in enumerate(os.environ.get('REPLICA_DATABASE_URLS', '').split()):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=DB_CONN_MAX_AGE,
+                                             conn_health_checks=True)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+for database in DATABASES.values():
+    if DB_POOL_MAX_SIZE and database.get('ENGINE') == 'django.db.backends.postgresql':
+        database['CONN_MAX_AGE'] = 0
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+
+DATABASE_ROUTERS = ['three_pins.routers.ReplicaRouter']
+# Skip a replica which can't be connected to for this many seconds
+REPLICA_RETRY_SECONDS = int(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+# Keep a visitor on the primary for this long after they change something
+REPLICA_PIN_COOKIE = 'use_primary'
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
@@ -106,6 +162,9 @@ SECURE_SSL_REDIRECT = 'SECURE_SSL_REDIRECT' in os.environ
 # Allow all host headers
 ALLOWED_HOSTS = ['*']
 
+# Where the site lives, for links which have to be absolute like social media preview images
+SITE_URL = os.environ.get('SITE_URL', 'http://www.threepins.org')
+
 
 # Email
 # http://wiki.gandi.net/en/mail/standard-settings
@@ -115,6 +174,12 @@ EMAIL_PORT = 465
 EMAIL_USE_SSL = True
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
+EMAIL_TIMEOUT = 30
+
+# Contact form messages are queued and sent by manage.py send_queued_mail
+MAIL_QUEUE_BATCH_SIZE = int(os.environ.get('MAIL_QUEUE_BATCH_SIZE', 20))
+MAIL_QUEUE_MAX_ATTEMPTS = int(os.environ.get('MAIL_QUEUE_MAX_ATTEMPTS', 6))
+MAIL_QUEUE_RETRY_SECONDS = int(os.environ.get('MAIL_QUEUE_RETRY_SECONDS', 60))
 
 
 # Static files (CSS, JavaScript, Images)
@@ -137,6 +202,46 @@ STORAGES = {
     },
 }
 
+# Caching
+# Catalogue-wide pages (sitemaps etc.) are cached for at most this many seconds
+CATALOGUE_CACHE_TIMEOUT = int(os.environ.get('CATALOGUE_CACHE_TIMEOUT', 3600))
+# Without a shared cache, each process checks the catalogue version in the database this often
+CATALOGUE_VERSION_SECONDS = int(os.environ.get('CATALOGUE_VERSION_SECONDS', 5))
+
+# Visitor logs from embedded puzzles and asynchronous views are written in batches
+VISITOR_LOG_BATCH_SIZE = int(os.environ.get('VISITOR_LOG_BATCH_SIZE', 50))
+VISITOR_LOG_BATCH_SECONDS = int(os.environ.get('VISITOR_LOG_BATCH_SECONDS', 60))
+
+# Solvers' progress is saved in batches too, the latest for each solver and puzzle
+PROGRESS_BATCH_SIZE = int(os.environ.get('PROGRESS_BATCH_SIZE', 200))
+PROGRESS_BATCH_SECONDS = int(os.environ.get('PROGRESS_BATCH_SECONDS', 10))
+
+# Published puzzles are pre-rendered into this directory if it's set
+PRERENDER_ROOT = os.environ.get('PRERENDER_ROOT')
+
+# Serve the read-only puzzle pages with asynchronous views (on by default under ASGI)
+ASYNC_VIEWS = bool(os.environ.get('ASYNC_VIEWS'))
+
+# Metrics
+# Each worker process writes its totals here, so /metrics/ can add them up
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_SECONDS = int(os.environ.get('METRICS_FLUSH_SECONDS', 10))
+# Prometheus can scrape /metrics/ with this bearer token (staff users can see it anyway)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Staff can profile a page with ?profile=cprofile|pstats|flame|sql
+PROFILE_SAMPLE_INTERVAL = 0.001
+PROFILE_REPORT_LINES = 100
+
+# Memory
+# Trace allocations with this many frames each, for /metrics/memory/ (0 turns tracing off)
+MEMORY_TRACE_FRAMES = int(os.environ.get('MEMORY_TRACE_FRAMES', 0))
+MEMORY_REPORT_LINES = 25
+# Warn when a worker grows past this size, checking every so many requests
+MEMORY_RSS_LIMIT_MB = int(os.environ.get('MEMORY_RSS_LIMIT_MB', 0))
+MEMORY_CHECK_EVERY = int(os.environ.get('MEMORY_CHECK_EVERY', 50))
+# Have gunicorn replace a worker which has grown too big (see gunicorn.conf.py)
+MEMORY_RECYCLE = 'MEMORY_RECYCLE' in os.environ
+
 # URLs
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/profile/'
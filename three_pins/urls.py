@@ -12,5 +12,6 @@ admin.autodiscover()
 urlpatterns = [ #pylint: disable=invalid-name
     re_path(r'^contact/', include('contact.urls')),
     re_path(r'^admin/', admin.site.urls),
+    re_path(r'^metrics/', include('instrumentation.urls')),
     re_path(r'^', include('puzzle.urls')),
 ]
@@ -6,24 +6,78 @@ visitors. This is the poor man's version which just records page requests
 and where they came from. Usually, the answer is "robots".
 """
 
+import atexit
 from re import sub
+from threading import Lock
+from time import monotonic
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from ipware.ip import get_client_ip
 
-def save_request(request):
-    """Record a page request's context in the database."""
+LOG_LENGTH = 100
+
+def create_log(request):
+    """Describe a page request's context, without saving it."""
     log = Visitor()
     ip_addr, _ = get_client_ip(request)
     log.ip_addr = sub(r'[0-9a-fA-F]+$', 'x', ip_addr) if ip_addr is not None else ''
-    log.user_agent = request.META.get('HTTP_USER_AGENT', '')
-    log.path = request.path
-    log.referrer = request.META.get('HTTP_REFERER', '')
+    log.user_agent = request.META.get('HTTP_USER_AGENT', '')[:256]
+    log.path = request.path[:256]
+    log.referrer = request.META.get('HTTP_REFERER', '')[:256]
     log.date = timezone.now()
-    log.save()
-    for old_log in Visitor.objects.order_by('-date')[100:]:
+    return log
+
+def save_request(request):
+    """Record a page request's context in the database."""
+    create_log(request).save()
+    for old_log in Visitor.objects.order_by('-date')[LOG_LENGTH:]:
         old_log.delete()
 
+class LogBuffer:
+    """Collect visitor logs in memory and write them out in batches.
+
+    Used for high-traffic pages where a database write per request would hurt.
+    A batch is written once it's big enough or old enough, whichever comes first.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.logs = []
+        self.started = monotonic()
+
+    def add(self, request):
+        """Queue up a request. Returns True if the batch is due to be written out."""
+        with self.lock:
+            if not self.logs:
+                self.started = monotonic()
+            self.logs.append(create_log(request))
+            return len(self.logs) >= settings.VISITOR_LOG_BATCH_SIZE or \
+                   monotonic() - self.started >= settings.VISITOR_LOG_BATCH_SECONDS
+
+    def flush(self):
+        """Write out everything queued so far, keeping only the most recent logs."""
+        with self.lock:
+            logs, self.logs = self.logs, []
+        if logs:
+            Visitor.objects.bulk_create(logs[-LOG_LENGTH:])
+            old_ids = list(Visitor.objects.order_by('-date')
+                           .values_list('id', flat=True)[LOG_LENGTH:])
+            Visitor.objects.filter(id__in=old_ids).delete()
+
+log_buffer = LogBuffer() #pylint: disable=invalid-name
+atexit.register(log_buffer.flush)
+
+def queue_request(request):
+    """Record a page request's context in the next batch of visitor logs."""
+    if log_buffer.add(request):
+        log_buffer.flush()
+
+async def aqueue_request(request):
+    """Asynchronous version of queue_request. The batch is written out in a worker thread."""
+    if log_buffer.add(request):
+        await sync_to_async(log_buffer.flush)()
+
 class Visitor(models.Model):
     """Visitor log."""
     ip_addr = models.CharField('IP address', max_length=40)